@@ -6,6 +6,7 @@ Provides product management, category management, and RFQ handling with email no
 """
 
 from werkzeug.middleware.proxy_fix import ProxyFix
+import hashlib
 import json
 import os
 import re
@@ -13,7 +14,7 @@ import uuid
 import secrets
 from datetime import datetime, timedelta
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, url_for
 from flask_cors import CORS
 from flask_mail import Mail, Message
 from pymongo import MongoClient
@@ -21,12 +22,9 @@ from bson import ObjectId
 from dotenv import load_dotenv
 import jwt
 import bcrypt
-import boto3
-from botocore.config import Config
 from botocore.exceptions import ClientError
-from backup_utils import backup_document, backup_s3_object
 
-# Load environment-specific configuration
+# Load environment-specific configuration before the modules below read it
 ENV = os.getenv('FLASK_ENV', 'development')
 env_file = f'env.{ENV}'
 
@@ -37,6 +35,26 @@ else:
     load_dotenv()  # Fallback to .env
     print(f"Loaded default environment configuration")
 
+import product_images
+from backup_utils import backup_document, backup_s3_object
+from db_indexes import start_index_sync
+from product_search import ProductSearchIndex, can_filter, SEARCH_FUZZY_MIN_RESULTS
+from product_suggest import ProductSuggester
+from pagination import InvalidCursorError, decode_cursor, encode_cursor, keyset_filter
+from catalog_version import CatalogVersion
+from catalog_snapshot import CatalogSnapshot
+from category_tree import CategoryTreeCache
+from category_fanout import CategoryFanout
+from category_counters import CategoryCounters
+from product_facets import FACETS_FIELD, extract_facets, facet_counts, facet_query, selected_facets
+from catalog_engine import CatalogEngine
+from image_hashing import IMAGE_HASHES_COLLECTION, hash_image, nearest, record as record_image_hash
+from product_slugs import SLUG_KEYS_FIELD, SlugHistory, candidate_keys, resolve_slug, sanitize_slug, slug_keys
+from bloom_filter import ProductKeyFilter
+from invalidation_bus import INVALIDATION_BUS_ENABLED, InvalidationBus
+from product_tombstones import PRODUCT_TOMBSTONES_COLLECTION, record_deletion
+from catalog_cache import CountCache, EntityCache, ResultCache, query_key
+
 # Get API configuration from environment
 BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000/api')
 API_HOST = os.getenv('API_HOST', '0.0.0.0')
@@ -74,6 +92,14 @@ products_collection = db['products']
 categories_collection = db['categories']
 media_pages_collection = db['media_pages']
 rfq_collection = db['rfq_requests']
+catalog_meta_collection = db['catalog_meta']
+slug_history_collection = db['slug_history']
+# Neighbour lists written by build_related_products.py (see related_products.py)
+related_products_collection = db['related_products']
+# Perceptual hashes of products/ uploads (see image_hashing.py)
+image_hashes_collection = db[IMAGE_HASHES_COLLECTION]
+# Deleted product ids, read by the per-worker catalog copies (see product_tombstones.py)
+product_tombstones_collection = db[PRODUCT_TOMBSTONES_COLLECTION]
 
 # Email Configuration
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
@@ -104,43 +130,85 @@ app.config['LOGIN_LOCKOUT_MINUTES'] = int(
 # Collections
 users_collection = db['users']
 
+# Build any missing indexes on a background thread (see db_indexes.py)
+start_index_sync(db)
+
+# Data versions bumped by every write, used to invalidate caches (see catalog_version.py)
+catalog_version = CatalogVersion(catalog_meta_collection)
+
+# Listing totals per filter shape, valid for one data version (see catalog_cache.py)
+count_cache = CountCache()
+
+# Pre-encoded product detail responses keyed by id and by slug
+entity_cache = EntityCache(
+    max_entries=int(os.getenv('ENTITY_CACHE_MAX_ENTRIES', 2048)),
+    ttl_seconds=float(os.getenv('ENTITY_CACHE_TTL_SECONDS', 300)))
+
+# Active products in a memory-mapped file shared by all workers (see
+# catalog_snapshot.py); products written since it was built are read from MongoDB
+catalog_snapshot = CatalogSnapshot(
+    products_collection,
+    encode=lambda product: product_response_body(product),
+    version_fn=catalog_version.current,
+    tombstones=product_tombstones_collection)
+catalog_snapshot.warm_start()
+
+# Every category by id, slug and name, loaded in one query and reloaded when
+# the categories version moves; product writes leave it alone (see category_tree.py)
+category_tree = CategoryTreeCache(
+    categories_collection, version_fn=lambda: catalog_version.current('categories'))
+
+# Active/total products per category, maintained with $inc on product writes
+# and seeded from the products on first read (see category_counters.py)
+category_counters = CategoryCounters(db['category_counters'], products_collection, catalog_meta_collection)
+
+# Columnar in-memory copy of the catalog answering plain listing queries
+# (see catalog_engine.py); anything it cannot answer goes to MongoDB
+catalog_engine = CatalogEngine(products_collection, product_tombstones_collection)
+catalog_engine.warm_start(catalog_version.current)
+
+# Retired product slugs -> current URL, served as 301s; loaded at boot and
+# caught up incrementally (see product_slugs.py)
+slug_history = SlugHistory(slug_history_collection, products_collection)
+slug_history.warm_start()
+
+# Bloom filter over product ids and slug keys: unknown keys 404 without a
+# query (see bloom_filter.py)
+product_key_filter = ProductKeyFilter(products_collection, slug_history_collection)
+product_key_filter.schedule_build(catalog_version.current)
+
+# Broadcast of catalog writes to the other workers (see invalidation_bus.py);
+# subscribed to and started once the handlers below are defined
+invalidation_bus = InvalidationBus(db)
+
+# Encoded listing pages, served stale-while-revalidate; a TTL of 0 disables caching
+list_cache = ResultCache(
+    max_entries=int(os.getenv('LIST_CACHE_MAX_ENTRIES', 512)),
+    stale_seconds=float(os.getenv('LIST_CACHE_STALE_SECONDS', 300)))
+LIST_CACHE_TTLS = {
+    'products': float(os.getenv('LIST_CACHE_TTL_PRODUCTS', 30)),
+    'category_products': float(os.getenv('LIST_CACHE_TTL_CATEGORY_PRODUCTS', 60)),
+}
+
+# Ranked full-text product search (see product_search.py)
+product_search_index = ProductSearchIndex(products_collection, product_tombstones_collection)
+product_search_index.warm_start()
+
+# Typeahead completions over product and category names (see product_suggest.py)
+product_suggester = ProductSuggester(products_collection, categories_collection)
+
 # In-memory storage for login attempts (in production, use Redis)
 login_attempts = {}
 account_lockouts = {}
 
-# AWS S3 / CloudFront Configuration
-AWS_REGION = os.getenv('AWS_REGION', 'ap-south-1')
-AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET')
-AWS_CDN_BASE_URL = os.getenv('AWS_CDN_BASE_URL', '').rstrip('/')
+# AWS S3 / CloudFront Configuration (client and settings in product_images.py)
+AWS_S3_BUCKET = product_images.AWS_S3_BUCKET
+AWS_CDN_BASE_URL = product_images.AWS_CDN_BASE_URL
 ALLOWED_IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
 ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}
 ALLOWED_UPLOAD_ROOT_FOLDERS = {'products', 'site', 'categories'}
 PRESIGNED_URL_EXPIRY_SECONDS = 300
 
-_s3_client = None
-
-
-def get_s3_client():
-    """Return a cached S3 client, or None if AWS credentials are not configured."""
-    global _s3_client
-    if _s3_client is not None:
-        return _s3_client
-
-    access_key = os.getenv('AWS_ACCESS_KEY_ID')
-    secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-    if not access_key or not secret_key or not AWS_S3_BUCKET:
-        return None
-
-    _s3_client = boto3.client(
-        's3',
-        region_name=AWS_REGION,
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        config=Config(signature_version='s3v4'),
-    )
-    return _s3_client
-
-
 def validate_image_urls(images):
     """Validate product image URLs before saving to MongoDB."""
     if not isinstance(images, list):
@@ -156,29 +224,9 @@ def validate_image_urls(images):
     return True, None
 
 
-def extract_s3_key_from_url(image_url):
-    """Extract the S3 object key from a CloudFront or S3 URL."""
-    if not image_url or not AWS_CDN_BASE_URL:
-        return None
-
-    if image_url.startswith(f'{AWS_CDN_BASE_URL}/'):
-        return image_url[len(AWS_CDN_BASE_URL) + 1:]
-
-    bucket_host = f'{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com'
-    if image_url.startswith(f'https://{bucket_host}/'):
-        return image_url[len(f'https://{bucket_host}/'):]
-
-    return None
-
-
 def sanitize_path_segment(value):
     """Convert a label or slug into a safe S3 path segment."""
-    if not value:
-        return ''
-    slug = str(value).lower().strip().replace(' ', '-').replace('_', '-')
-    slug = re.sub(r'[^a-z0-9-]', '', slug)
-    slug = re.sub(r'-+', '-', slug).strip('-')
-    return slug[:80]
+    return sanitize_slug(value)
 
 
 def build_upload_key(folder, filename, data=None):
@@ -197,17 +245,11 @@ def build_upload_key(folder, filename, data=None):
         if not main_slug or not sub_slug:
             sub_category_id = (data.get('subCategoryId') or '').strip()
             if sub_category_id:
-                sub_category = categories_collection.find_one(
-                    {'id': sub_category_id, 'type': 'sub'},
-                    {'id': 1, 'slug': 1, 'name': 1, 'main_category_id': 1, '_id': 0}
-                )
+                sub_category = category_tree.category(sub_category_id, 'sub')
                 if sub_category:
                     sub_slug = sanitize_path_segment(
                         sub_category.get('slug') or sub_category.get('name'))
-                    main_category = categories_collection.find_one(
-                        {'id': sub_category.get('main_category_id'), 'type': 'main'},
-                        {'slug': 1, 'name': 1, '_id': 0}
-                    )
+                    main_category = category_tree.tree().parent(sub_category)
                     if main_category:
                         main_slug = sanitize_path_segment(
                             main_category.get('slug') or main_category.get('name'))
@@ -328,6 +370,37 @@ def require_admin(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+
+def catalog_etag(f):
+    """Decorator for public catalog GETs: strong ETag from the catalog version.
+
+    Every product and category write bumps the version, and every cache a
+    catalog body comes from catches up with it before serving (category
+    tree, search index, listing engine, snapshot, entity and list caches).
+    The tag is the version plus a digest of the query parameters, so while
+    the version is unchanged a matching If-None-Match is answered 304 before
+    the view runs, without touching MongoDB or serializing anything.
+    """
+    def decorated_function(*args, **kwargs):
+        # Read before the view: its body is at least this new, so the tag can
+        # only ever be conservative
+        query = hashlib.sha1(
+            json.dumps(sorted(request.args.items(multi=True))).encode('utf-8')).hexdigest()[:12]
+        etag = f'catalog-v{catalog_version.current()}-{query}'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        response = app.make_response(f(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
 # Security Helper Functions
 
 
@@ -443,6 +516,242 @@ def convert_to_json_serializable(obj):
     else:
         return obj
 
+
+def encode_json(payload):
+    """Serialize a response payload once, for caching as raw bytes"""
+    return app.json.dumps(payload).encode('utf-8')
+
+
+def json_bytes_response(body, status=200):
+    """Return already-encoded JSON without re-serializing it"""
+    return Response(body, status=status, mimetype='application/json')
+
+
+# Stored for slug lookups and facet filters only (see product_slugs.py and
+# product_facets.py); never part of an API response
+PRIVATE_PRODUCT_FIELDS = ('_id', SLUG_KEYS_FIELD, FACETS_FIELD)
+
+
+def public_product(product):
+    """A product document without its internal lookup fields"""
+    return {k: v for k, v in product.items() if k not in PRIVATE_PRODUCT_FIELDS}
+
+
+def product_response_body(product):
+    """Encoded GET /api/products/<id> body for a product"""
+    return encode_json({'success': True, 'product': convert_to_json_serializable(public_product(product))})
+
+
+def cache_product_body(product, version):
+    """Write-through: store the GET /api/products/<id> body for a product"""
+    body = product_response_body(product)
+    entity_cache.put(('id', product['id']), body, product['id'], version)
+    return body
+
+
+def apply_invalidation(event):
+    """Drop this worker's cached state for a write made by another worker"""
+    if event.get('version') is not None:
+        # Every version-tagged cache (listings, totals, snapshot, engine)
+        # treats older entries as stale from here on
+        catalog_version.observe('catalog', event['version'])
+    if event.get('keys'):
+        product_key_filter.add(event['keys'], event.get('version'))
+    else:
+        product_key_filter.advance(event.get('version'))
+    if event.get('kind') == 'category':
+        category_tree.invalidate()
+    if event.get('kind') == 'product' and event.get('id'):
+        entity_cache.invalidate(event['id'])
+        if event.get('op') == 'delete':
+            product_search_index.remove(event['id'])
+    product_suggester.mark_dirty()
+
+
+def drop_local_caches(scope):
+    """A write could not bump its version: forget this worker's cached reads instead"""
+    list_cache.clear()
+    if scope == 'categories':
+        category_tree.invalidate()
+    if scope != 'catalog':
+        return
+    entity_cache.clear()
+    count_cache.clear()
+    catalog_snapshot.invalidate()
+    catalog_engine.invalidate()
+
+
+catalog_version.on_bump_failure(drop_local_caches)
+invalidation_bus.subscribe(apply_invalidation)
+if INVALIDATION_BUS_ENABLED:
+    invalidation_bus.start()
+
+
+def apply_category_fanout_batch(job, keys):
+    """A category propagation job rewrote a batch of products (see category_fanout.py)"""
+    catalog_version.bump('categories')
+    version = catalog_version.bump()
+    invalidation_bus.publish('category', 'fanout', job['category_id'], keys=keys, version=version)
+    product_key_filter.add(keys, version)
+    catalog_snapshot.schedule_rebuild()
+    product_suggester.mark_dirty()
+
+
+# Renamed categories are copied into their products in the background, and
+# the URLs they retire recorded as redirects; the thread also resumes jobs
+# left unfinished by a restarted worker
+category_fanout = CategoryFanout(db, on_batch=apply_category_fanout_batch, slug_history=slug_history)
+category_fanout.start()
+
+
+def slug_redirect_response(main_category_slug, seo_slug):
+    """301 to a product's canonical slug URL, with the target in the body for the storefront"""
+    location = url_for('get_product_by_slug', main_category=main_category_slug, slug=seo_slug)
+    response = jsonify({
+        'success': True,
+        'redirect': True,
+        'location': location,
+        'main_category_slug': main_category_slug,
+        'seo_slug': seo_slug
+    })
+    response.status_code = 301
+    response.headers['Location'] = location
+    return response
+
+
+def search_regex_filter(search, fields):
+    """Case-insensitive substring match across fields, with user input escaped"""
+    pattern = re.escape(search)
+    return {'$or': [{field: {'$regex': pattern, '$options': 'i'}} for field in fields]}
+
+
+def find_products_in_order(product_ids):
+    """Documents for a page of product ids, in that order, with one indexed $in query"""
+    products_by_id = {
+        product['id']: product
+        for product in products_collection.find({'id': {'$in': product_ids}}, {'_id': 0})
+    }
+    return [products_by_id[pid] for pid in product_ids if pid in products_by_id]
+
+
+def find_products_by_search(search, query, sort_by, skip, limit, allow_fuzzy=True):
+    """Rank products for a search term with the in-process index.
+
+    When exact matching finds fewer than SEARCH_FUZZY_MIN_RESULTS products
+    the search is retried with typo-tolerant trigram matching.
+
+    The index catches up to the current catalog version first, so the
+    ranking matches the version the listing is cached and tagged under.
+
+    Returns (page products, every ranked id, fuzzy), or None when the index
+    cannot serve the filter so the caller falls back to a MongoDB regex query.
+    """
+    if not can_filter(query) or not product_search_index.ensure_fresh(catalog_version.current()):
+        return None
+
+    ranked_ids = product_search_index.search(search, query, sort_by)
+    fuzzy = False
+    if allow_fuzzy and len(ranked_ids) < SEARCH_FUZZY_MIN_RESULTS:
+        fuzzy_ids = product_search_index.search(search, query, sort_by, fuzzy=True)
+        if len(fuzzy_ids) > len(ranked_ids):
+            ranked_ids, fuzzy = fuzzy_ids, True
+
+    products = find_products_in_order(ranked_ids[skip:skip + limit])
+    return products, ranked_ids, fuzzy
+
+
+def find_page_and_total(collection, scope, query, sort_criteria, skip, limit,
+                        page_filter=None, include_total=True):
+    """Fetch a listing page plus its total.
+
+    The page is an indexed find().sort().skip().limit(), so sorts walk the
+    indexes in db_indexes.py instead of sorting the whole match in memory.
+    Totals come from count_cache while the scope's data version is
+    unchanged; on a miss count_documents runs once and is cached.
+    Returns (documents, total); total is None when include_total is False.
+    """
+    total = None
+    if include_total:
+        version = catalog_version.current(scope)
+        total = count_cache.get(scope, query, version)
+        if total is None:
+            total = collection.count_documents(query)
+            count_cache.put(scope, query, version, total)
+
+    page_query = {'$and': [query, page_filter]} if page_filter else query
+    documents = list(collection.find(page_query, {'_id': 0}).sort(
+        sort_criteria).skip(skip).limit(limit))
+    return documents, total
+
+
+def cached_listing(endpoint, args, build, *key_parts):
+    """Encoded listing body for one endpoint and query, via list_cache.
+
+    The key is the endpoint, any path values and the query parameters with
+    empty values dropped and order ignored, so equivalent URLs share one
+    entry. Entries are tagged with the catalog version, which every product
+    and category write bumps.
+    """
+    args = {key: value for key, value in args.items() if value not in (None, '')}
+    ttl = LIST_CACHE_TTLS.get(endpoint, 0)
+    if ttl <= 0:
+        return encode_json(build(args))
+    key = query_key(endpoint, *key_parts, sorted(args.items()))
+    return list_cache.get_or_load(
+        key, lambda: encode_json(build(args)), ttl, catalog_version.current)
+
+
+def listing_facet_counts(base_query, selected):
+    """Facet value counts for a listing filter (see product_facets.py), cached until the catalog changes"""
+    ttl = LIST_CACHE_TTLS['products']
+    if ttl <= 0:
+        return facet_counts(products_collection, base_query, selected)
+    return list_cache.get_or_load(
+        query_key('facets', base_query, selected),
+        lambda: facet_counts(products_collection, base_query, selected),
+        ttl, catalog_version.current)
+
+
+def reject_search_cursor(args):
+    """Search results are ranked, so they page by skip only: a cursor is a client error"""
+    if args.get('cursor'):
+        raise InvalidCursorError('cursor cannot be combined with search; page search results with skip')
+
+
+def find_product_page(query, sort_criteria, skip, limit, cursor_token=None, include_total=True):
+    """Fetch one listing page, by keyset cursor when given, else by skip/limit.
+
+    Returns (products, next_cursor, total). Raises InvalidCursorError for an invalid cursor.
+    """
+    found = None
+    if not cursor_token and catalog_engine.ensure_fresh(catalog_version.current()):
+        # Plain filters, sorts and totals are answered in memory; only the
+        # page's documents are read, by id
+        found = catalog_engine.select(query, sort_criteria, skip, limit)
+
+    if found is not None:
+        product_ids, total = found
+        products = find_products_in_order(product_ids)
+        if not include_total:
+            total = None
+    else:
+        page_filter = None
+        if cursor_token:
+            cursor = decode_cursor(
+                cursor_token, sort_criteria, query, app.config['JWT_SECRET_KEY'])
+            page_filter = keyset_filter(cursor, sort_criteria)
+            skip = 0
+
+        products, total = find_page_and_total(
+            products_collection, 'catalog', query, sort_criteria, skip, limit,
+            page_filter=page_filter, include_total=include_total)
+
+    next_cursor = None
+    if limit and len(products) == limit:
+        next_cursor = encode_cursor(
+            products[-1], sort_criteria, query, app.config['JWT_SECRET_KEY'])
+    return products, next_cursor, total
+
 # ==================== AUTHENTICATION APIs ====================
 
 
@@ -648,10 +957,17 @@ def logout():
 
 
 @app.route('/api/categories', methods=['GET'])
+@catalog_etag
 def get_categories():
     """Get all categories"""
     try:
-        categories = list(categories_collection.find({}, {'_id': 0}))
+        categories = category_tree.tree().categories
+        if request.args.get('with_counts', 'false').lower() == 'true':
+            counts = category_counters.counts(catalog_version.current())
+            categories = [
+                {**category, 'product_counts': counts.get(category['id'], {'active': 0, 'total': 0})}
+                for category in categories
+            ]
         # Convert to JSON serializable format
         categories_json = convert_to_json_serializable(categories)
         return jsonify({'success': True, 'categories': categories_json}), 200
@@ -660,11 +976,11 @@ def get_categories():
 
 
 @app.route('/api/categories/main', methods=['GET'])
+@catalog_etag
 def get_main_categories():
     """Get main categories only"""
     try:
-        main_categories = list(categories_collection.find(
-            {'type': 'main'}, {'_id': 0}))
+        main_categories = [c for c in category_tree.tree().categories if c.get('type') == 'main']
         # Convert to JSON serializable format
         categories_json = convert_to_json_serializable(main_categories)
         return jsonify({'success': True, 'categories': categories_json}), 200
@@ -673,27 +989,18 @@ def get_main_categories():
 
 
 @app.route('/api/categories/sub/<main_category_slug>', methods=['GET'])
+@catalog_etag
 def get_sub_categories(main_category_slug):
     """Get sub-categories for a specific main category"""
     try:
         # First find the main category (by slug or name)
-        main_category_title = main_category_slug.replace('-', ' ').title()
-        main_category = categories_collection.find_one({
-            'type': 'main',
-            '$or': [
-                {'slug': main_category_slug},
-                {'name': {'$regex': f'^{main_category_title}$', '$options': 'i'}},
-                {'name': {'$regex': f'^{main_category_slug}$', '$options': 'i'}},
-            ]
-        })
+        tree = category_tree.tree()
+        main_category = tree.main_for_slug(main_category_slug)
         if not main_category:
             return jsonify({'success': False, 'error': 'Main category not found'}), 404
 
         # Get sub-categories for this main category
-        sub_categories = list(categories_collection.find(
-            {'main_category_id': main_category['id'], 'type': 'sub'},
-            {'_id': 0}
-        ))
+        sub_categories = tree.subs(main_category['id'])
 
         # Convert to JSON serializable format
         categories_json = convert_to_json_serializable(sub_categories)
@@ -729,17 +1036,14 @@ def create_category():
                 return jsonify({'success': False, 'error': 'main_category_id is required for sub-categories'}), 400
 
             # Check if main category exists
-            main_category = categories_collection.find_one(
-                {'id': data['main_category_id'], 'type': 'main'})
+            main_category = category_tree.category(data['main_category_id'], 'main')
             if not main_category:
                 return jsonify({'success': False, 'error': 'Invalid main_category_id'}), 400
 
         # Check if category already exists (considering type and main category)
-        query = {'name': data['name'], 'type': data['type']}
-        if data['type'] == 'sub':
-            query['main_category_id'] = data['main_category_id']
-
-        existing_category = categories_collection.find_one(query)
+        existing_category = category_tree.tree().find_by_name(
+            data['name'], data['type'],
+            data['main_category_id'] if data['type'] == 'sub' else None)
         if existing_category:
             return jsonify({'success': False, 'error': 'Category already exists'}), 400
 
@@ -763,7 +1067,14 @@ def create_category():
             })
 
         categories_collection.insert_one(category)
+        category_tree.invalidate()
         backup_document('categories', category)
+        catalog_version.bump('categories')
+        version = catalog_version.bump()
+        invalidation_bus.publish('category', 'upsert', category['id'], version=version)
+        product_key_filter.advance(version)
+        catalog_snapshot.schedule_rebuild()
+        product_suggester.mark_dirty()
         # Convert to JSON serializable format
         category_json = convert_to_json_serializable(category)
         return jsonify({'success': True, 'category': category_json}), 201
@@ -776,20 +1087,13 @@ def create_category():
 def get_categories_for_admin():
     """Get all categories organized by type for admin panel"""
     try:
-        # Get main categories
-        main_categories = list(categories_collection.find(
-            {'type': 'main'},
-            {'_id': 0}
-        ).sort('name', 1))
+        tree = category_tree.tree()
+        main_categories = tree.mains()
 
         # Get sub-categories grouped by main category
-        sub_categories_by_main = {}
-        for main_cat in main_categories:
-            sub_cats = list(categories_collection.find(
-                {'main_category_id': main_cat['id'], 'type': 'sub'},
-                {'_id': 0}
-            ).sort('name', 1))
-            sub_categories_by_main[main_cat['id']] = sub_cats
+        sub_categories_by_main = {
+            main_cat['id']: tree.subs(main_cat['id']) for main_cat in main_categories
+        }
 
         # Convert to JSON serializable format
         main_categories_json = convert_to_json_serializable(main_categories)
@@ -805,6 +1109,18 @@ def get_categories_for_admin():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/categories/jobs', methods=['GET'])
+@require_admin
+def get_category_jobs():
+    """Recent category rename propagation jobs with their progress (Admin only)"""
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        jobs = category_fanout.recent_jobs(limit, request.args.get('status'))
+        return jsonify({'success': True, 'jobs': convert_to_json_serializable(jobs)}), 200
+    except (ConnectionError, ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/categories/<category_id>', methods=['PUT'])
 @require_admin
 def update_category(category_id):
@@ -813,7 +1129,7 @@ def update_category(category_id):
         data = request.get_json()
 
         # Check if category exists
-        existing_category = categories_collection.find_one({'id': category_id})
+        existing_category = category_tree.category(category_id)
         if not existing_category:
             return jsonify({'success': False, 'error': 'Category not found'}), 404
 
@@ -831,8 +1147,7 @@ def update_category(category_id):
 
             # Check if new name conflicts with existing category
             if data['name'].strip() != existing_category['name']:
-                conflict_category = categories_collection.find_one(
-                    {'name': data['name'].strip()})
+                conflict_category = category_tree.tree().find_by_name(data['name'].strip())
                 if conflict_category:
                     return jsonify({'success': False, 'error': 'Category name already exists'}), 400
 
@@ -845,14 +1160,34 @@ def update_category(category_id):
             {'id': category_id},
             {'$set': update_data}
         )
-
-        # Get updated category
-        updated_category = categories_collection.find_one(
-            {'id': category_id}, {'_id': 0})
+        renamed = update_data.get('name', existing_category['name']) != existing_category['name']
+        if renamed and existing_category.get('type') == 'main':
+            # Sub-categories are few: copy the new name into them inline
+            categories_collection.update_many(
+                {'main_category_id': category_id, 'type': 'sub'},
+                {'$set': {'main_category_name': update_data['name']}})
+
+        category_tree.invalidate()
+        updated_category = {**existing_category, **update_data}
         backup_document('categories', updated_category)
+        catalog_version.bump('categories')
+        version = catalog_version.bump()
+        invalidation_bus.publish('category', 'upsert', category_id, version=version)
+        product_key_filter.advance(version)
+        catalog_snapshot.schedule_rebuild()
+        product_suggester.mark_dirty()
+
+        # Products embed the name; rewrite them in the background
+        job = None
+        if renamed:
+            job = category_fanout.enqueue(updated_category, created_by=str(request.user['user_id']))
         # Convert to JSON serializable format
         updated_category_json = convert_to_json_serializable(updated_category)
-        return jsonify({'success': True, 'category': updated_category_json}), 200
+        return jsonify({
+            'success': True,
+            'category': updated_category_json,
+            'propagation_job': convert_to_json_serializable(job)
+        }), 200
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -863,30 +1198,33 @@ def delete_category(category_id):
     """Delete a category (Admin only)"""
     try:
         # Check if category exists
-        existing_category = categories_collection.find_one({'id': category_id})
+        existing_category = category_tree.category(category_id)
         if not existing_category:
             return jsonify({'success': False, 'error': 'Category not found'}), 404
 
         category_type = existing_category.get('type', 'main')
 
+        # The counter answers without counting; when it says the category is
+        # empty, an indexed existence probe guards against counter drift
         if category_type == 'main':
-            sub_category_ids = [
-                sub['id'] for sub in categories_collection.find(
-                    {'main_category_id': category_id, 'type': 'sub'},
-                    {'id': 1, '_id': 0}
-                )
-            ]
-
+            # Products not yet migrated (migrate_category_fields.py) have no
+            # main_category_id, so the legacy slug/name fields are probed too
             product_filters = [
+                {'main_category_id': category_id},
                 {'main_category_slug': existing_category.get('slug')},
                 {'main_category_name': existing_category.get('name')},
             ]
+            sub_category_ids = [sub['id'] for sub in category_tree.tree().subs(category_id)]
             if sub_category_ids:
                 product_filters.append({'category_id': {'$in': sub_category_ids}})
+            product_query = {'$or': product_filters}
+        else:
+            product_query = {'category_id': category_id}
+        products_using_category = category_counters.get(category_id, catalog_version.current())['total']
+        if products_using_category <= 0 and products_collection.find_one(product_query, {'_id': 1}):
+            products_using_category = products_collection.count_documents(product_query)
 
-            products_using_category = products_collection.count_documents(
-                {'$or': product_filters}
-            )
+        if category_type == 'main':
             if products_using_category > 0:
                 return jsonify({
                     'success': False,
@@ -896,8 +1234,6 @@ def delete_category(category_id):
                     )
                 }), 400
         else:
-            products_using_category = products_collection.count_documents(
-                {'category_id': category_id})
             if products_using_category > 0:
                 return jsonify({
                     'success': False,
@@ -905,8 +1241,16 @@ def delete_category(category_id):
                 }), 400
 
         result = categories_collection.delete_one({'id': category_id})
+        category_tree.invalidate()
         if result.deleted_count == 0:
             return jsonify({'success': False, 'error': 'Category not found'}), 404
+        category_counters.forget(category_id)
+        catalog_version.bump('categories')
+        version = catalog_version.bump()
+        invalidation_bus.publish('category', 'delete', category_id, version=version)
+        product_key_filter.advance(version)
+        catalog_snapshot.schedule_rebuild()
+        product_suggester.mark_dirty()
 
         return jsonify({'success': True, 'message': 'Category deleted successfully'}), 200
     except (ConnectionError, ValueError, TypeError) as e:
@@ -985,7 +1329,7 @@ def presign_upload():
         if not AWS_CDN_BASE_URL:
             return jsonify({'success': False, 'error': 'Upload service not configured (AWS_CDN_BASE_URL missing)'}), 500
 
-        s3_client = get_s3_client()
+        s3_client = product_images.s3_client()
         if not s3_client:
             return jsonify({'success': False, 'error': 'Upload service not configured (AWS credentials missing)'}), 500
 
@@ -1033,7 +1377,7 @@ def delete_upload():
         image_url = (data.get('url') or '').strip()
 
         if not key and image_url:
-            key = extract_s3_key_from_url(image_url)
+            key = product_images.s3_key_from_url(image_url)
 
         if not key:
             return jsonify({'success': False, 'error': 'key or url is required'}), 400
@@ -1045,7 +1389,7 @@ def delete_upload():
         if root_folder not in ALLOWED_UPLOAD_ROOT_FOLDERS:
             return jsonify({'success': False, 'error': 'Invalid upload key'}), 400
 
-        s3_client = get_s3_client()
+        s3_client = product_images.s3_client()
         if not s3_client:
             return jsonify({'success': False, 'error': 'Upload service not configured'}), 500
 
@@ -1062,6 +1406,39 @@ def delete_upload():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def find_duplicate_upload(key):
+    """
+    Compare a fresh upload with the stored image hashes and record its hash.
+    Returns the closest existing object as {key, url, distance, identical},
+    or None. Only an identical object (same ETag and size) replaces the
+    upload, which is then deleted; a perceptual match is just reported for
+    the admin to confirm, since two shots of one garment can look alike.
+    """
+    s3_client = product_images.s3_client()
+    if not s3_client:
+        return None
+    obj = s3_client.get_object(Bucket=AWS_S3_BUCKET, Key=key)
+    etag, size = (obj.get('ETag') or '').strip('"'), obj.get('ContentLength')
+    hashes = hash_image(obj['Body'].read())
+    for match in nearest(image_hashes_collection, hashes, exclude_key=key):
+        try:
+            head = s3_client.head_object(Bucket=AWS_S3_BUCKET, Key=match['key'])
+        except ClientError:
+            # Deleted since it was hashed
+            image_hashes_collection.delete_one({'_id': match['key']})
+            continue
+        identical = bool(etag) and (head.get('ETag') or '').strip('"') == etag \
+            and head.get('ContentLength') == size
+        if identical:
+            s3_client.delete_object(Bucket=AWS_S3_BUCKET, Key=key)
+        else:
+            record_image_hash(image_hashes_collection, key, etag, size, hashes)
+        return {'key': match['key'], 'url': f"{AWS_CDN_BASE_URL}/{match['key']}",
+                'distance': match['distance'], 'identical': identical}
+    record_image_hash(image_hashes_collection, key, etag, size, hashes)
+    return None
+
+
 @app.route('/api/uploads/confirm-backup', methods=['POST'])
 @require_admin
 def confirm_upload_backup():
@@ -1079,6 +1456,26 @@ def confirm_upload_backup():
         if root_folder not in ALLOWED_UPLOAD_ROOT_FOLDERS:
             return jsonify({'success': False, 'error': 'Invalid upload key'}), 400
 
+        # Opt-in: a byte-identical re-upload of a product photo is dropped and
+        # the existing URL returned; a similar photo is only suggested
+        check_duplicates = bool(data.get('check_duplicates')) and root_folder == 'products'
+        duplicate = None
+        if check_duplicates:
+            try:
+                duplicate = find_duplicate_upload(key)
+            except (ClientError, OSError, ValueError) as exc:
+                print(f"Duplicate check skipped for {key}: {exc}")
+            if duplicate is not None and duplicate['identical']:
+                return jsonify({
+                    'success': True,
+                    'duplicate': True,
+                    'message': 'Upload is identical to an existing image; use its URL instead',
+                    'key': duplicate['key'],
+                    'publicUrl': duplicate['url'],
+                    'distance': duplicate['distance'],
+                    'deletedKey': key,
+                }), 200
+
         ok = backup_s3_object(key)
         if not ok:
             return jsonify({
@@ -1090,6 +1487,13 @@ def confirm_upload_backup():
             'success': True,
             'message': 'Upload backed up successfully',
             'key': key,
+            **({'duplicate': False} if check_duplicates else {}),
+            # Looks like a stored photo: the admin decides whether to use it instead
+            **({'duplicateCandidate': {
+                'key': duplicate['key'],
+                'publicUrl': duplicate['url'],
+                'distance': duplicate['distance'],
+            }} if duplicate is not None else {}),
             'backupKey': (
                 f"backups/assets/"
                 f"{datetime.utcnow().strftime('%Y')}/{datetime.utcnow().strftime('%B')}/"
@@ -1122,14 +1526,12 @@ def create_product():
             return jsonify({'success': False, 'error': 'Product name must be at least 3 characters long'}), 400
 
         # Validate sub-category exists and get main category info
-        sub_category = categories_collection.find_one(
-            {'id': data['category_id'], 'type': 'sub'})
+        sub_category = category_tree.category(data['category_id'], 'sub')
         if not sub_category:
             return jsonify({'success': False, 'error': 'Invalid category_id - must be a sub-category'}), 400
 
         # Get main category info
-        main_category = categories_collection.find_one(
-            {'id': sub_category['main_category_id'], 'type': 'main'})
+        main_category = category_tree.tree().parent(sub_category)
         if not main_category:
             return jsonify({'success': False, 'error': 'Invalid main category reference'}), 400
 
@@ -1155,6 +1557,7 @@ def create_product():
             'name': data['name'].strip(),
             'category_id': data['category_id'],
             'category_name': sub_category['name'],
+            'main_category_id': main_category['id'],
             'main_category_name': main_category['name'],
             'main_category_slug': main_category['slug'],
             'description': data['description'].strip(),
@@ -1170,154 +1573,289 @@ def create_product():
             'updated_at': datetime.utcnow().isoformat(),
             'created_by': str(request.user['user_id'])
         }
+        product[SLUG_KEYS_FIELD] = slug_keys(product)
+        product[FACETS_FIELD] = extract_facets(product['specifications'])
 
         products_collection.insert_one(product)
+        category_counters.apply(None, product)
+        slug_history.release(product[SLUG_KEYS_FIELD])
         backup_document('products', product)
+        version = catalog_version.bump()
+        invalidation_bus.publish('product', 'upsert', product['id'],
+                                 keys=product[SLUG_KEYS_FIELD], version=version)
+        product_key_filter.add(product[SLUG_KEYS_FIELD], version)
+        catalog_snapshot.schedule_rebuild()
+        cache_product_body(product, version)
+        catalog_engine.upsert(product, version)
+        product_search_index.upsert(product)
+        product_suggester.mark_dirty()
         # Convert to JSON serializable format
-        product_json = convert_to_json_serializable(product)
+        product_json = convert_to_json_serializable(public_product(product))
         return jsonify({'success': True, 'product': product_json}), 201
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def build_products_listing(args):
+    """Response payload for GET /api/products given its query parameters"""
+    # Query parameters
+    category_id = args.get('category_id')
+    is_active_param = args.get('is_active', 'true')
+    limit = int(args.get('limit', 50))
+    skip = int(args.get('skip', 0))
+
+    # Build query
+    query = {}
+    if is_active_param.lower() != 'all':
+        query['is_active'] = is_active_param.lower() == 'true'
+    if category_id:
+        query['category_id'] = category_id
+
+    # Add main category filtering
+    main_category_name = args.get('main_category_name')
+    if main_category_name:
+        query['main_category_name'] = main_category_name
+
+    # ?material=&color=&size= match normalized specification tokens and
+    # ?palette= colors extracted from the photos; ?include_facets=true adds
+    # value counts for every facet
+    selected = selected_facets(args)
+    facet_base = dict(query)
+    query.update(facet_query(selected))
+    include_facets = args.get('include_facets', 'false').lower() == 'true'
+
+    # Search is served by the ranked in-process index (relevance order
+    # unless sortBy is given); regex matching is only the fallback
+    search = args.get('search')
+    if search:
+        reject_search_cursor(args)
+        search_filter = search_regex_filter(
+            search, ['name', 'description', 'seo_keywords', 'seo_title'])
+        found = find_products_by_search(
+            search, query, args.get('sortBy'), skip, limit,
+            allow_fuzzy=args.get('fuzzy', 'true').lower() != 'false')
+        if found is not None:
+            products, ranked_ids, fuzzy = found
+            payload = {
+                'success': True,
+                'products': convert_to_json_serializable([public_product(p) for p in products]),
+                'total': len(ranked_ids),
+                'limit': limit,
+                'skip': skip,
+                'fuzzy': fuzzy
+            }
+            if include_facets:
+                # Count what the ranked (possibly fuzzy) search matched, not
+                # the regex fallback. The index only serves filters without
+                # facet selections, so the ids already carry every filter
+                payload['facets'] = listing_facet_counts({'id': {'$in': ranked_ids}}, selected)
+            return payload
+        query.update(search_filter)
+        facet_base.update(search_filter)
+
+    # Apply sorting
+    sort_by = args.get('sortBy', 'name')
+    # Stable pagination: id breaks ties so identical names must not reshuffle
+    # across pages. Its direction makes every sort a forward or backward walk
+    # of the (name, id) / (created_at desc, id) indexes in db_indexes.py
+    sort_options = {
+        'name': [('name', 1), ('id', 1)],
+        'name_desc': [('name', -1), ('id', -1)],
+        'newest': [('created_at', -1), ('id', 1)],
+        'oldest': [('created_at', 1), ('id', -1)]
+    }
+    sort_criteria = sort_options.get(sort_by, sort_options['name'])
+
+    # Keyset pagination: ?cursor=<next_cursor> resumes after the last row.
+    # ?include_total=false skips counting entirely.
+    include_total = args.get('include_total', 'true').lower() != 'false'
+    products, next_cursor, total = find_product_page(
+        query, sort_criteria, skip, limit, args.get('cursor'),
+        include_total=include_total)
+
+    # Convert to JSON serializable format
+    products_json = convert_to_json_serializable([public_product(p) for p in products])
+
+    payload = {
+        'success': True,
+        'products': products_json,
+        'total': total,
+        'limit': limit,
+        'skip': skip,
+        'next_cursor': next_cursor
+    }
+    if include_facets:
+        payload['facets'] = listing_facet_counts(facet_base, selected)
+    return payload
+
+
 @app.route('/api/products', methods=['GET'])
+@catalog_etag
 def get_products():
     """Get all products (with optional filters)"""
     try:
-        # Query parameters
-        category_id = request.args.get('category_id')
-        is_active_param = request.args.get('is_active', 'true')
-        limit = int(request.args.get('limit', 50))
-        skip = int(request.args.get('skip', 0))
+        body = cached_listing('products', request.args, build_products_listing)
+        return json_bytes_response(body)
+    except InvalidCursorError as exc:
+        return jsonify({'success': False, 'error': str(exc)}), 400
+    except (ConnectionError, ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # Build query
-        query = {}
-        if is_active_param.lower() != 'all':
-            query['is_active'] = is_active_param.lower() == 'true'
-        if category_id:
-            query['category_id'] = category_id
-
-        # Add main category filtering
-        main_category_name = request.args.get('main_category_name')
-        if main_category_name:
-            query['main_category_name'] = main_category_name
-
-        # Add search filtering
-        search = request.args.get('search')
-        if search:
-            query['$or'] = [
-                {'name': {'$regex': search, '$options': 'i'}},
-                {'description': {'$regex': search, '$options': 'i'}},
-                {'seo_keywords': {'$regex': search, '$options': 'i'}},
-                {'seo_title': {'$regex': search, '$options': 'i'}}
-            ]
 
-        # Apply sorting
-        sort_by = request.args.get('sortBy', 'name')
-        sort_options = {
-            'name': [('name', 1)],
-            'name_desc': [('name', -1)],
-            'newest': [('created_at', -1)],
-            'oldest': [('created_at', 1)]
-        }
+@app.route('/api/products/suggest', methods=['GET'])
+def suggest_products():
+    """Typeahead completions for product names, keywords and categories"""
+    try:
+        prefix = (request.args.get('q') or '').strip()
+        limit = min(max(int(request.args.get('limit', 8)), 1), 20)
+        suggestions = product_suggester.suggest(prefix, limit) if prefix else []
+        return jsonify({'success': True, 'query': prefix, 'suggestions': suggestions}), 200
+    except (ConnectionError, ValueError, TypeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        sort_criteria = sort_options.get(sort_by, [('name', 1)])
-        # Stable pagination: identical names must not reshuffle across skip/limit pages
-        sort_criteria = list(sort_criteria) + [('id', 1)]
 
-        total = products_collection.count_documents(query)
-        products = list(products_collection.find(query, {'_id': 0}).sort(
-            sort_criteria).skip(skip).limit(limit))
+def product_body(product_id, version):
+    """Encoded GET /api/products/<id> body, or None when the product does not exist"""
+    body = entity_cache.get(('id', product_id), version)
+    if body is not None:
+        return body
 
-        # Convert to JSON serializable format
-        products_json = convert_to_json_serializable(products)
+    if not product_key_filter.might_exist([f'id:{product_id}'], version, catalog_version.current):
+        return None
+
+    snapshot = catalog_snapshot.current()
+    if snapshot is not None:
+        body = snapshot.product_by_id(product_id)
+        if body is not None:
+            return body
+
+    product = products_collection.find_one({'id': product_id}, {'_id': 0})
+    if not product:
+        return None
+    return cache_product_body(product, version)
 
-        return jsonify({
-            'success': True,
-            'products': products_json,
-            'total': total,
-            'limit': limit,
-            'skip': skip
-        }), 200
-    except (ConnectionError, ValueError, TypeError) as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+
+def product_with_related_body(product_id, version):
+    """Product body plus its precomputed related products: one indexed read, then cached"""
+    body = entity_cache.get(('related', product_id), version)
+    if body is not None:
+        return body
+
+    body = product_body(product_id, version)
+    if body is None:
+        return None
+    neighbours = related_products_collection.find_one({'_id': product_id}, {'related': 1})
+    payload = json.loads(body)
+    payload['related'] = (neighbours or {}).get('related', [])
+    body = encode_json(payload)
+    entity_cache.put(('related', product_id), body, product_id, version)
+    return body
 
 
 @app.route('/api/products/<product_id>', methods=['GET'])
+@catalog_etag
 def get_product(product_id):
-    """Get a specific product by ID"""
+    """Get a specific product by ID (?include=related adds precomputed related products)"""
     try:
-        product = products_collection.find_one({'id': product_id}, {'_id': 0})
-        if not product:
+        # Read the version before the product so a concurrent write can
+        # never leave a stale body cached under the newer version
+        version = catalog_version.current()
+        include = {part.strip() for part in request.args.get('include', '').split(',')}
+        if 'related' in include:
+            body = product_with_related_body(product_id, version)
+        else:
+            body = product_body(product_id, version)
+        if body is None:
             return jsonify({'success': False, 'error': 'Product not found'}), 404
-
-        # Convert to JSON serializable format
-        product_json = convert_to_json_serializable(product)
-        return jsonify({'success': True, 'product': product_json}), 200
+        return json_bytes_response(body)
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/products/category/<main_category_slug>', methods=['GET'])
-def get_products_by_main_category(main_category_slug):
-    """Get products by main category slug"""
-    try:
-        # Query parameters
-        sub_category_id = request.args.get('sub_category_id')
-        is_active_param = request.args.get('is_active', 'true')
-        limit = int(request.args.get('limit', 50))
-        skip = int(request.args.get('skip', 0))
-
-        # Build query - check both main_category_slug and main_category_name
-        main_category_title = main_category_slug.replace('-', ' ').title()
+def build_category_listing(main_category_slug, args):
+    """Response payload for GET /api/products/category/<slug> given its query parameters"""
+    # Query parameters
+    sub_category_id = args.get('sub_category_id')
+    is_active_param = args.get('is_active', 'true')
+    limit = int(args.get('limit', 50))
+    skip = int(args.get('skip', 0))
 
-        query_parts = [{
-            '$or': [
-                {'main_category_slug': main_category_slug},
-                {'main_category_name': main_category_title}
-            ]
-        }]
-        if is_active_param.lower() != 'all':
-            query_parts.append({'is_active': is_active_param.lower() == 'true'})
-        if sub_category_id:
-            query_parts.append({'category_id': sub_category_id})
-
-        search = request.args.get('search')
-        if search:
-            query_parts.append({
-                '$or': [
-                    {'name': {'$regex': search, '$options': 'i'}},
-                    {'description': {'$regex': search, '$options': 'i'}},
-                ]
-            })
+    # Products carry their canonical main_category_id (see migrate_category_fields.py)
+    main_category = category_tree.tree().main_for_slug(main_category_slug)
+    if main_category is not None:
+        query_parts = [{'main_category_id': main_category['id']}]
+    else:
+        query_parts = [{'main_category_slug': main_category_slug}]
+    if is_active_param.lower() != 'all':
+        query_parts.append({'is_active': is_active_param.lower() == 'true'})
+    if sub_category_id:
+        query_parts.append({'category_id': sub_category_id})
+
+    search = args.get('search')
+    if search:
+        reject_search_cursor(args)
+        base_query = query_parts[0] if len(query_parts) == 1 else {'$and': query_parts}
+        found = find_products_by_search(
+            search, base_query, args.get('sortBy'), skip, limit,
+            allow_fuzzy=args.get('fuzzy', 'true').lower() != 'false')
+        if found is not None:
+            products, ranked_ids, fuzzy = found
+            return {
+                'success': True,
+                'products': convert_to_json_serializable([public_product(p) for p in products]),
+                'total': len(ranked_ids),
+                'limit': limit,
+                'skip': skip,
+                'fuzzy': fuzzy
+            }
+        query_parts.append(search_regex_filter(search, ['name', 'description']))
+
+    query = query_parts[0] if len(query_parts) == 1 else {'$and': query_parts}
+
+    sort_by = args.get('sortBy', 'name')
+    # Stable pagination: id breaks ties so identical names must not reshuffle
+    # across pages. Its direction makes every sort a forward or backward walk
+    # of the (name, id) / (created_at desc, id) indexes in db_indexes.py
+    sort_options = {
+        'name': [('name', 1), ('id', 1)],
+        'name_desc': [('name', -1), ('id', -1)],
+        'newest': [('created_at', -1), ('id', 1)],
+        'oldest': [('created_at', 1), ('id', -1)]
+    }
+    sort_criteria = sort_options.get(sort_by, sort_options['name'])
 
-        query = query_parts[0] if len(query_parts) == 1 else {'$and': query_parts}
+    # Keyset pagination: ?cursor=<next_cursor> resumes after the last row.
+    # ?include_total=false skips counting entirely.
+    include_total = args.get('include_total', 'true').lower() != 'false'
+    products, next_cursor, total = find_product_page(
+        query, sort_criteria, skip, limit, args.get('cursor'),
+        include_total=include_total)
 
-        sort_by = request.args.get('sortBy', 'name')
-        sort_options = {
-            'name': [('name', 1)],
-            'name_desc': [('name', -1)],
-            'newest': [('created_at', -1)],
-            'oldest': [('created_at', 1)]
-        }
-        sort_criteria = sort_options.get(sort_by, [('name', 1)])
-        # Stable pagination: identical names must not reshuffle across skip/limit pages
-        sort_criteria = list(sort_criteria) + [('id', 1)]
+    # Convert to JSON serializable format
+    products_json = convert_to_json_serializable([public_product(p) for p in products])
 
-        total = products_collection.count_documents(query)
-        products = list(products_collection.find(
-            query, {'_id': 0}).sort(sort_criteria).skip(skip).limit(limit))
+    return {
+        'success': True,
+        'products': products_json,
+        'total': total,
+        'limit': limit,
+        'skip': skip,
+        'next_cursor': next_cursor
+    }
 
-        # Convert to JSON serializable format
-        products_json = convert_to_json_serializable(products)
 
-        return jsonify({
-            'success': True,
-            'products': products_json,
-            'total': total,
-            'limit': limit,
-            'skip': skip
-        }), 200
+@app.route('/api/products/category/<main_category_slug>', methods=['GET'])
+@catalog_etag
+def get_products_by_main_category(main_category_slug):
+    """Get products by main category slug"""
+    try:
+        body = cached_listing(
+            'category_products', request.args,
+            lambda args: build_category_listing(main_category_slug, args),
+            main_category_slug)
+        return json_bytes_response(body)
+    except InvalidCursorError as exc:
+        return jsonify({'success': False, 'error': str(exc)}), 400
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1343,12 +1881,16 @@ def update_product(product_id):
             update_data['name'] = data['name']
         if 'category_id' in data:
             # Validate category exists
-            category = categories_collection.find_one(
-                {'id': data['category_id']})
+            category = category_tree.category(data['category_id'])
             if not category:
                 return jsonify({'success': False, 'error': 'Invalid category_id'}), 400
             update_data['category_id'] = data['category_id']
             update_data['category_name'] = category['name']
+            main_category = category_tree.tree().main_for_product(update_data)
+            if main_category:
+                update_data['main_category_id'] = main_category['id']
+                update_data['main_category_name'] = main_category['name']
+                update_data['main_category_slug'] = main_category['slug']
 
         if 'description' in data:
             update_data['description'] = data['description']
@@ -1361,6 +1903,7 @@ def update_product(product_id):
             update_data['images'] = data['images']
         if 'specifications' in data:
             update_data['specifications'] = data['specifications']
+            update_data[FACETS_FIELD] = extract_facets(data['specifications'])
         if 'is_active' in data:
             update_data['is_active'] = data['is_active']
 
@@ -1373,18 +1916,35 @@ def update_product(product_id):
             update_data['seo_keywords'] = data['seo_keywords']
         if 'seo_slug' in data:
             update_data['seo_slug'] = sanitize_path_segment(data['seo_slug']) or data['seo_slug']
+        update_data[SLUG_KEYS_FIELD] = slug_keys({**existing_product, **update_data})
 
-        products_collection.update_one(
-            {'id': product_id},
-            {'$set': update_data}
-        )
+        update = {'$set': update_data}
+        if 'images' in update_data and update_data['images'][:1] != (existing_product.get('images') or [])[:1]:
+            # The palette describes the old first image (extract_product_colors.py redoes it)
+            update['$unset'] = {'color_palette': ''}
+        products_collection.update_one({'id': product_id}, update)
 
         # Get updated product
         updated_product = products_collection.find_one(
             {'id': product_id}, {'_id': 0})
+        category_counters.apply(existing_product, updated_product)
+        slug_history.record(
+            updated_product,
+            existing_product.get(SLUG_KEYS_FIELD) or slug_keys(existing_product),
+            update_data[SLUG_KEYS_FIELD])
         backup_document('products', updated_product)
+        version = catalog_version.bump()
+        invalidation_bus.publish('product', 'upsert', product_id,
+                                 keys=update_data[SLUG_KEYS_FIELD], version=version)
+        product_key_filter.add(update_data[SLUG_KEYS_FIELD], version)
+        catalog_snapshot.schedule_rebuild()
+        entity_cache.invalidate(product_id)
+        cache_product_body(updated_product, version)
+        catalog_engine.upsert(updated_product, version)
+        product_search_index.upsert(updated_product)
+        product_suggester.mark_dirty()
         # Convert to JSON serializable format
-        updated_product_json = convert_to_json_serializable(updated_product)
+        updated_product_json = convert_to_json_serializable(public_product(updated_product))
         return jsonify({'success': True, 'product': updated_product_json}), 200
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1403,7 +1963,18 @@ def delete_product(product_id):
         if not product:
             return jsonify({'success': False, 'error': 'Product not found'}), 404
 
-        products_collection.delete_one({'id': product_id})
+        if products_collection.delete_one({'id': product_id}).deleted_count:
+            category_counters.apply(product, None)
+            record_deletion(product_tombstones_collection, product_id)
+        slug_history.forget_product(product_id)
+        version = catalog_version.bump()
+        invalidation_bus.publish('product', 'delete', product_id, version=version)
+        product_key_filter.advance(version)
+        catalog_snapshot.schedule_rebuild()
+        entity_cache.invalidate(product_id)
+        catalog_engine.remove(product_id, version)
+        product_search_index.remove(product_id)
+        product_suggester.mark_dirty()
 
         return jsonify({
             'success': True,
@@ -1415,72 +1986,42 @@ def delete_product(product_id):
 
 
 @app.route('/api/products/slug/<main_category>/<slug>', methods=['GET'])
+@catalog_etag
 def get_product_by_slug(main_category, slug):
     """Get a product by its SEO slug and main category"""
     try:
-        # Find product by slug and main category (try multiple approaches)
-        product = None
-        slug_normalized = sanitize_path_segment(slug) or slug
-        slug_candidates = list({slug, slug_normalized, f'{slug_normalized}-'})
-
-        # First try: exact match with main_category_slug
-        product = products_collection.find_one({
-            'seo_slug': {'$in': slug_candidates},
-            'main_category_slug': main_category,
-            'is_active': True
-        }, {'_id': 0})
-
-        # Second try: match with main_category_name (case-insensitive)
-        if not product:
-            product = products_collection.find_one({
-                'seo_slug': {'$in': slug_candidates},
-                'main_category_name': {'$regex': f'^{main_category}$', '$options': 'i'},
-                'is_active': True
-            }, {'_id': 0})
+        cache_key = ('slug', main_category, slug)
+        version = catalog_version.current()
+        body = entity_cache.get(cache_key, version)
+        if body is not None:
+            return json_bytes_response(body)
+
+        # Every accepted URL form maps to a precomputed slug key (see product_slugs.py)
+        keys = candidate_keys(main_category, slug)
+        if not product_key_filter.might_exist(keys, version, catalog_version.current):
+            return jsonify({'success': False, 'error': 'Product not found'}), 404
 
-        # Third try: find by slug only (fallback)
-        if not product:
-            product = products_collection.find_one({
-                'seo_slug': {'$in': slug_candidates},
-                'is_active': True
-            }, {'_id': 0})
+        snapshot = catalog_snapshot.current()
+        if snapshot is not None:
+            body = snapshot.product_by_slug_keys(keys)
+            if body is not None:
+                return json_bytes_response(body)
 
-        # Fourth try: search by generated slug from product name (if seo_slug doesn't exist)
-        if not product:
-            all_products = list(products_collection.find({
-                'is_active': True,
-                'main_category_slug': main_category
-            }, {'_id': 0}))
-
-            for p in all_products:
-                # Generate slug from product name
-                product_name_slug = p.get(
-                    'name', '').lower().strip().replace(' ', '-')
-                product_name_slug = re.sub(
-                    r'[^a-z0-9-]', '', product_name_slug)
-                product_name_slug = re.sub(
-                    r'-+', '-', product_name_slug).strip('-')
-
-                existing_slug = sanitize_path_segment(p.get('seo_slug') or '')
-
-                # Check if generated slug matches
-                if product_name_slug == slug_normalized or existing_slug == slug_normalized:
-                    product = p
-                    break
-
-        # Fifth try: search by product ID (if slug looks like an ID)
-        if not product:
-            product = products_collection.find_one({
-                'id': slug,
-                'is_active': True
-            }, {'_id': 0})
+        product = resolve_slug(products_collection, main_category, slug)
 
         if not product:
+            # A slug a product used to have: redirect to its current URL.
+            # Only after resolve_slug, so a live product always wins over history
+            if slug_history.ensure_fresh(version):
+                target = slug_history.lookup(keys)
+                if target is not None:
+                    _, target_main, target_slug = target
+                    return slug_redirect_response(target_main, target_slug)
             return jsonify({'success': False, 'error': 'Product not found'}), 404
 
-        # Convert to JSON serializable format
-        product_json = convert_to_json_serializable(product)
-        return jsonify({'success': True, 'product': product_json}), 200
+        body = product_response_body(product)
+        entity_cache.put(cache_key, body, product['id'], version)
+        return json_bytes_response(body)
 
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1518,6 +2059,7 @@ def submit_rfq():
 
         rfq_collection.insert_one(rfq_data)
         backup_document('rfq_requests', rfq_data)
+        catalog_version.bump('rfq')
 
         # Send email to admin
         admin_email = os.getenv('ADMIN_EMAIL', 'admin@outrecouture.com')
@@ -1584,9 +2126,10 @@ def get_rfq_requests():
         if status:
             query['status'] = status
 
-        total = rfq_collection.count_documents(query)
-        rfq_requests = list(rfq_collection.find(query, {'_id': 0}).sort(
-            'created_at', -1).skip(skip).limit(limit))
+        include_total = request.args.get('include_total', 'true').lower() != 'false'
+        rfq_requests, total = find_page_and_total(
+            rfq_collection, 'rfq', query, [('created_at', -1)], skip, limit,
+            include_total=include_total)
 
         return jsonify({
             'success': True,
@@ -1626,6 +2169,7 @@ def update_rfq_status(rfq_id):
 
         if result.matched_count == 0:
             return jsonify({'success': False, 'error': 'RFQ not found'}), 404
+        catalog_version.bump('rfq')
 
         updated_rfq = rfq_collection.find_one({'id': rfq_id}, {'_id': 0})
         if updated_rfq:
@@ -1635,6 +2179,30 @@ def update_rfq_status(rfq_id):
     except (ConnectionError, ValueError, TypeError) as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ==================== CACHE STATS ====================
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+@require_admin
+def get_cache_stats():
+    """Hit/miss/eviction counters for the in-process caches (Admin only)"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'catalog_version': catalog_version.current(),
+        'entity_cache': entity_cache.stats(),
+        'count_cache': count_cache.stats(),
+        'list_cache': list_cache.stats(),
+        'catalog_snapshot': catalog_snapshot.stats(),
+        'category_tree': category_tree.stats(),
+        'category_fanout': category_fanout.stats(),
+        'category_counters': category_counters.stats(),
+        'catalog_engine': catalog_engine.stats(),
+        'invalidation_bus': invalidation_bus.stats(),
+        'slug_history': slug_history.stats(),
+        'product_key_filter': product_key_filter.stats()
+    }), 200
+
 # ==================== HEALTH CHECK ====================
 
 
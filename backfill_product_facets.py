@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Backfill the `facets` field used by GET /api/products?material=&color=&size=.
+
+create_product and update_product derive facets from specifications (see
+product_facets.py); products written before that need this one-off
+backfill, or they never match a facet filter. Products whose stored facets
+are already current are skipped, so re-running is safe (and needed after
+changing the tokenizer).
+
+Safe default is dry-run.
+
+Usage:
+  # Preview
+  python backfill_product_facets.py
+
+  # Write the facets
+  python backfill_product_facets.py --apply
+
+  # Smaller write batches
+  python backfill_product_facets.py --apply --batch-size 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient, UpdateOne  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from product_facets import FACETS_FIELD, extract_facets  # noqa: E402
+
+PROJECTION = {'_id': 1, 'id': 1, 'name': 1, 'specifications': 1, FACETS_FIELD: 1}
+
+
+def pending_updates(products):
+    """Yield (product, facets) for every product whose stored facets are missing or stale."""
+    for product in products.find({}, PROJECTION):
+        facets = extract_facets(product.get('specifications'))
+        if product.get(FACETS_FIELD) != facets:
+            yield product, facets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill product facets')
+    parser.add_argument('--batch-size', type=int, default=500, help='Products per bulk write')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+    products = db['products']
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    print()
+
+    pending = 0
+    written = 0
+    batch = []
+    try:
+        for product, facets in pending_updates(products):
+            pending += 1
+            if not args.apply:
+                summary = '; '.join(f"{facet}={', '.join(values)}" for facet, values in facets.items() if values)
+                print(f"  would set facets on {product.get('id')} ({product.get('name', '')}): {summary or 'none'}")
+                continue
+            # updated_at lets cache catch-ups (engine, search, snapshot) see it
+            batch.append(UpdateOne({'_id': product['_id']},
+                                   {'$set': {FACETS_FIELD: facets, 'updated_at': datetime.utcnow().isoformat()}}))
+            if len(batch) >= args.batch_size:
+                written += products.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            written += products.bulk_write(batch, ordered=False).modified_count
+    except PyMongoError as exc:
+        print(f'❌ Backfill failed after {written} updates: {exc}')
+        sys.exit(1)
+
+    print()
+    if args.apply:
+        print(f'✓ Updated facets on {written} of {pending} products')
+        if written:
+            # Running app workers drop their cached listings on the new version
+            version = CatalogVersion(db['catalog_meta']).bump()
+            print(f'✓ Catalog version bumped to {version}')
+    else:
+        print(f'✓ {pending} products need facets. Re-run with --apply to write them.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Backfill the `slug_keys` field used by GET /api/products/slug/<main>/<slug>.
+
+create_product and update_product maintain slug_keys (see product_slugs.py);
+products written before that need this one-off backfill, or they are not
+found by slug. Products whose stored keys are already current are skipped,
+so re-running is safe.
+
+Safe default is dry-run.
+
+Usage:
+  # Preview
+  python backfill_slug_keys.py
+
+  # Write the keys
+  python backfill_slug_keys.py --apply
+
+  # Smaller write batches
+  python backfill_slug_keys.py --apply --batch-size 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient, UpdateOne  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from product_slugs import SLUG_KEYS_FIELD, slug_keys  # noqa: E402
+
+PROJECTION = {'_id': 1, 'id': 1, 'name': 1, 'seo_slug': 1,
+              'main_category_slug': 1, 'main_category_name': 1, SLUG_KEYS_FIELD: 1}
+
+
+def pending_updates(products):
+    """Yield (product, keys) for every product whose stored keys are missing or stale."""
+    for product in products.find({}, PROJECTION):
+        keys = slug_keys(product)
+        if product.get(SLUG_KEYS_FIELD) != keys:
+            yield product, keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill product slug_keys')
+    parser.add_argument('--batch-size', type=int, default=500, help='Products per bulk write')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+    products = db['products']
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    print()
+
+    pending = 0
+    written = 0
+    batch = []
+    try:
+        for product, keys in pending_updates(products):
+            pending += 1
+            if not args.apply:
+                print(f"  would set {len(keys)} keys on {product.get('id')} ({product.get('name', '')})")
+                continue
+            # updated_at lets cache catch-ups (engine, search, snapshot) see it
+            batch.append(UpdateOne({'_id': product['_id']},
+                                   {'$set': {SLUG_KEYS_FIELD: keys, 'updated_at': datetime.utcnow().isoformat()}}))
+            if len(batch) >= args.batch_size:
+                written += products.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            written += products.bulk_write(batch, ordered=False).modified_count
+    except PyMongoError as exc:
+        print(f'❌ Backfill failed after {written} updates: {exc}')
+        sys.exit(1)
+
+    print()
+    if args.apply:
+        print(f'✓ Updated slug_keys on {written} of {pending} products')
+        if written:
+            # Running app workers drop their cached catalog on the new version
+            version = CatalogVersion(db['catalog_meta']).bump()
+            print(f'✓ Catalog version bumped to {version}')
+    else:
+        print(f'✓ {pending} products need slug_keys. Re-run with --apply to write them.')
+
+
+if __name__ == '__main__':
+    main()
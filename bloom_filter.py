@@ -0,0 +1,165 @@
+"""
+Negative-lookup filter for product ids and slug keys.
+
+Scanners and stale links request product ids and slugs that do not exist.
+A Bloom filter over every product's keys (`id:<id>` plus its slug keys, see
+product_slugs.py) and every retired slug answers "definitely not here" from
+memory, so those requests 404 without a database query. A "maybe" still goes
+through the normal lookup, so false positives only cost what every request
+cost before.
+
+Bloom filters cannot delete: deleted products linger as false positives
+until the next periodic rebuild. Keys are added locally on create/update,
+and from other workers via invalidation_bus events. A negative answer is
+trusted only while the filter has seen every catalog version up to the
+current one; otherwise the caller falls back to MongoDB and a rebuild is
+scheduled.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+from pymongo.errors import PyMongoError
+
+from product_slugs import SLUG_KEYS_FIELD, slug_keys
+
+logger = logging.getLogger(__name__)
+
+BLOOM_FALSE_POSITIVE_RATE = float(os.getenv('BLOOM_FALSE_POSITIVE_RATE', 0.01))
+BLOOM_REBUILD_SECONDS = float(os.getenv('BLOOM_REBUILD_SECONDS', 600))
+
+# Room to grow between rebuilds without the false-positive rate degrading
+CAPACITY_HEADROOM = 2
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, using blake2b double hashing."""
+
+    def __init__(self, capacity: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE):
+        capacity = max(int(capacity), 1)
+        self.n_bits = max(64, int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)))
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.n_hashes):
+            yield (first + i * second) % self.n_bits
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def false_positive_rate(self) -> float:
+        """Expected rate for the number of keys added so far."""
+        return (1 - math.exp(-self.n_hashes * self.count / self.n_bits)) ** self.n_hashes
+
+
+class ProductKeyFilter:
+    """Per-worker Bloom filter over product keys, rebuilt periodically from MongoDB."""
+
+    def __init__(self, products_coll, history_coll,
+                 false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE,
+                 rebuild_seconds: float = BLOOM_REBUILD_SECONDS):
+        self.products = products_coll
+        self.history = history_coll
+        self.false_positive_rate = false_positive_rate
+        self.rebuild_seconds = rebuild_seconds
+        self._filter: BloomFilter | None = None
+        self._lock = threading.Lock()
+        self._building = False
+        self.version = None
+        self.built_at = 0.0
+        self.checks = 0
+        self.rejections = 0
+
+    def build(self, version: int):
+        """Rebuild from every product (active or not) and every retired slug."""
+        projection = {'_id': 0, 'id': 1, 'name': 1, 'seo_slug': 1,
+                      'main_category_slug': 1, 'main_category_name': 1, SLUG_KEYS_FIELD: 1}
+        keys = []
+        for product in self.products.find({}, projection):
+            keys.extend(product.get(SLUG_KEYS_FIELD) or slug_keys(product))
+        keys.extend(entry['key'] for entry in self.history.find({'released': {'$ne': True}}, {'_id': 0, 'key': 1}))
+
+        bloom = BloomFilter(max(len(keys) * CAPACITY_HEADROOM, MIN_CAPACITY), self.false_positive_rate)
+        for key in keys:
+            bloom.add(key)
+        with self._lock:
+            self._filter = bloom
+            self.version = version
+            self.built_at = time.time()
+        logger.info('Product key filter built: %d keys, %d bytes', bloom.count, len(bloom.bits))
+
+    def schedule_build(self, version_fn):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def run():
+            try:
+                self.build(version_fn())
+            except PyMongoError as exc:
+                logger.error('Product key filter build failed: %s', exc)
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name='product-key-filter-build', daemon=True).start()
+
+    def add(self, keys: list[str], version: int | None = None):
+        """Record a local or broadcast write; `version` is the catalog version it produced."""
+        with self._lock:
+            if self._filter is None:
+                return
+            for key in keys:
+                self._filter.add(key)
+            self.advance(version)
+
+    def advance(self, version: int | None):
+        """Adopt a version whose write added no product keys (or whose keys were just added)."""
+        if version is not None and self.version is not None and version == self.version + 1:
+            self.version = version
+
+    def might_exist(self, keys: list[str], version: int, version_fn) -> bool:
+        """False only when no key can exist. Never a false negative."""
+        self.checks += 1
+        bloom = self._filter
+        stale = bloom is None or self.version != version
+        if stale or time.time() - self.built_at > self.rebuild_seconds:
+            self.schedule_build(version_fn)
+        if stale:
+            return True
+        if any(key in bloom for key in keys):
+            return True
+        self.rejections += 1
+        return False
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            'version': self.version,
+            'keys': bloom.count if bloom else 0,
+            'bits': bloom.n_bits if bloom else 0,
+            'bytes': len(bloom.bits) if bloom else 0,
+            'hashes': bloom.n_hashes if bloom else 0,
+            'target_false_positive_rate': self.false_positive_rate,
+            'estimated_false_positive_rate': round(bloom.false_positive_rate(), 6) if bloom else None,
+            'checks': self.checks,
+            'rejections': self.rejections,
+            'age_seconds': round(time.time() - self.built_at, 1) if bloom else None,
+        }
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Build the precomputed related-products lists (related_products collection).
+
+Scores every active product against the catalog with TF-IDF cosine
+similarity (see related_products.py) and stores the top RELATED_TOP_K
+neighbours per product, served by GET /api/products/<id>?include=related.
+By default only products changed since the previous run are re-scored;
+schedule it (e.g. cron every 15 minutes) and run it with --full
+occasionally to refresh every score.
+
+Safe default is dry-run.
+
+Usage:
+  # Show what an incremental run would re-score
+  python build_related_products.py
+
+  # Re-score products changed since the last run
+  python build_related_products.py --apply
+
+  # Recompute every product's list
+  python build_related_products.py --full --apply
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from related_products import RelatedProductsJob  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build precomputed related-products lists')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    parser.add_argument('--full', action='store_true',
+                        help='Re-score every product instead of only those changed since the last run')
+    parser.add_argument('--show', type=int, default=3,
+                        help='Products whose new lists are printed (default: 3)')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'} ({'full' if args.full else 'incremental'})")
+    print()
+
+    try:
+        result = RelatedProductsJob(db).run(full=args.full, apply=args.apply)
+    except PyMongoError as exc:
+        print(f'❌ Build failed: {exc}')
+        sys.exit(1)
+
+    documents = result.pop('documents')
+    for product_id, related in list(documents.items())[:args.show]:
+        print(f'  {product_id}:')
+        for entry in related:
+            print(f"    {entry['score']:.3f}  {entry['name']}")
+    if documents:
+        print()
+
+    print(f"✓ {result['products']} active products, {result['changed']} changed since the last run")
+    print(f"✓ {result['rescored']} lists re-scored, {result['merged']} merged, "
+          f"{result['removed']} removed in {result['seconds']}s")
+    if not args.apply:
+        print('Re-run with --apply to write them.')
+    elif documents or result['removed']:
+        # Cached product bodies with related lists are tagged with the version
+        version = CatalogVersion(db['catalog_meta']).bump()
+        print(f'✓ Catalog version bumped to {version}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+In-process caches for catalog reads.
+
+CountCache keeps listing totals per filter shape, valid for one data
+version (see catalog_version.py), so paging through a listing does not
+re-run count_documents for every page. The page itself is always an
+indexed find().sort().skip().limit(); only the total is cached.
+
+EntityCache holds fully encoded product responses so hot detail pages skip
+both MongoDB and JSON serialization.
+
+ResultCache serves listing pages stale-while-revalidate and coalesces
+concurrent misses on the same page into a single database query.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from bson import json_util
+
+logger = logging.getLogger(__name__)
+
+
+def query_key(*parts) -> str:
+    """Stable hash of a filter (and any other shape-defining values)."""
+    body = json_util.dumps(parts, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+
+class CountCache:
+    """LRU map of (scope, filter) -> total, tagged with the version it was counted at."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[int, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, scope: str, query: dict, version: int) -> int | None:
+        key = query_key(scope, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, scope: str, query: dict, version: int, total: int):
+        key = query_key(scope, query)
+        with self._lock:
+            self._entries[key] = (version, total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class EntityCache:
+    """
+    Bounded LRU + TTL cache of pre-encoded JSON response bodies.
+
+    Entries are tagged with the data version they were read at and with the
+    product id they describe, so a write can drop every key (by id, by slug)
+    that points at the product, and other workers stop serving an entry as
+    soon as they observe a newer version.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple, tuple[bytes, int, float, str]] = OrderedDict()
+        self._keys_by_entity: dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_entity.get(entry[3])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_entity[entry[3]]
+
+    def get(self, key: tuple, version: int) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, entry_version, expires_at, _ = entry
+            if entry_version != version or expires_at < time.time():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: tuple, body: bytes, entity_id: str, version: int):
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (body, version, time.time() + self.ttl_seconds, entity_id)
+            self._keys_by_entity.setdefault(entity_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, entity_id: str):
+        """Drop every cached body that describes this entity."""
+        with self._lock:
+            for key in list(self._keys_by_entity.get(entity_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_entity.clear()
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+
+class _Flight:
+    """One in-progress load that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    """
+    Stale-while-revalidate cache with single-flight loading.
+
+    An entry is fresh for its TTL, then served stale for up to
+    `stale_seconds` while one background thread reloads it. Entries from an
+    older data version are never served. Concurrent misses on the same key
+    share a single load instead of each querying MongoDB.
+    """
+
+    def __init__(self, max_entries: int = 512, stale_seconds: float = 300,
+                 wait_seconds: float = 30):
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self.wait_seconds = wait_seconds
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        self._flights: dict[str, _Flight] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+
+    def _store(self, key: str, value, ttl: float, version: int):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (value, version, now + ttl, now + ttl + self.stale_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh_in_background(self, key: str, loader, ttl: float, version_fn):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                version = version_fn()
+                self._store(key, loader(), ttl, version)
+            except Exception:
+                # Keep serving the stale entry; the next stale hit retries
+                logger.exception('Background refresh of cached result %s failed', key[:12])
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='result-cache-refresh', daemon=True).start()
+
+    def get_or_load(self, key: str, loader, ttl: float, version_fn):
+        """Return the cached value for key, loading it at most once at a time."""
+        version = version_fn()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == version:
+                value, _, fresh_until, stale_until = entry
+                if now < fresh_until:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < stale_until:
+                    self.stale_hits += 1
+                    stale_value = value
+                else:
+                    stale_value = None
+            else:
+                stale_value = None
+
+        if stale_value is not None:
+            self._refresh_in_background(key, loader, ttl, version_fn)
+            return stale_value
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.event.wait(self.wait_seconds):
+                return loader()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self._store(key, flight.value, ttl, version)
+            return flight.value
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'background_refreshes': self.refreshes,
+        }
@@ -0,0 +1,354 @@
+"""
+In-memory columnar engine for the product listing endpoints.
+
+GET /api/products and /api/products/category/<slug> only ever filter on a
+few equality fields (is_active, category_id, main_category_id,
+main_category_name, main_category_slug) and sort by name or created_at with id as tiebreaker.
+This engine answers exactly those requests, totals included, without
+touching MongoDB; the caller then reads the page's documents by id:
+
+  columns       one slot per product: id, name, created_at and the filter
+                fields (only ENGINE_FIELDS are loaded, never whole documents)
+  bitmaps       Python ints, bit i set when slot i matches field == value
+  permutations  slots sorted by (name, id) and by (created_at, id), kept in
+                order with bisect on every upsert/remove
+
+Anything else (search, cursors, other operators or sorts) makes select()
+return None and the caller falls back to MongoDB.
+
+The engine is per worker. Local writes are applied directly; writes made by
+other workers show up as a catalog version change (catalog_version.py) and
+are caught up from `updated_at`, with deletions read from the product
+tombstones (product_tombstones.py). Both reads are indexed deltas, so a
+version change that touched no product (a category write, a counter
+reconcile) costs two empty queries. Anything a delta cannot see (a script
+that removes products without a tombstone) is covered by the full reload
+every CATALOG_ENGINE_RELOAD_SECONDS.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from product_tombstones import catch_up_from, deleted_since
+
+logger = logging.getLogger(__name__)
+
+# Fields with a bitmap index; only equality on these can be answered
+BITMAP_FIELDS = ('is_active', 'category_id', 'main_category_id', 'main_category_name', 'main_category_slug')
+
+SORT_FIELDS = ('name', 'created_at')
+
+# The only fields read from MongoDB
+ENGINE_FIELDS = ('id', 'updated_at') + BITMAP_FIELDS + SORT_FIELDS
+ENGINE_PROJECTION = {**{field: 1 for field in ENGINE_FIELDS}, '_id': 0}
+
+CATALOG_ENGINE_RELOAD_SECONDS = float(os.getenv('CATALOG_ENGINE_RELOAD_SECONDS', 600))
+
+
+def sort_value(value) -> tuple:
+    """Order values the way MongoDB does: missing/null, numbers, strings, rest."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (4, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, str(value))
+
+
+def _bits(bitmap: int):
+    """Yield set bit positions, lowest first, in one pass over the bitmap's bytes."""
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            yield index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class CatalogEngine:
+    """Columnar product store answering listing filters, sorts and totals."""
+
+    def __init__(self, collection, tombstones):
+        self.collection = collection
+        self.tombstones = tombstones
+        self._lock = threading.RLock()
+        self._clear()
+        self.version = None
+        self.last_updated_at = ''
+        self.last_deleted_at: datetime | None = None
+        self.loaded = False
+        self.loaded_at = 0.0
+        self._loading = False
+        self.queries = 0
+        self.fallbacks = 0
+
+    def _clear(self):
+        self._slot_by_id: dict[str, int] = {}
+        self._free_slots: list[int] = []
+        self._ids: list[str | None] = []
+        self._values: list[tuple | None] = []
+        self._sort_keys: dict[str, list] = {field: [] for field in SORT_FIELDS}
+        self._bitmaps: dict[str, dict] = {field: {} for field in BITMAP_FIELDS}
+        self._alive = 0
+        # field -> sorted list of (sort_value, id, slot)
+        self._orders: dict[str, list[tuple]] = {field: [] for field in SORT_FIELDS}
+
+    # ---- maintenance ----
+
+    def _remove_slot(self, slot: int):
+        bit = 1 << slot
+        for field, value in zip(BITMAP_FIELDS, self._values[slot]):
+            bitmaps = self._bitmaps[field]
+            try:
+                present = value in bitmaps
+            except TypeError:  # unhashable: was never indexed
+                continue
+            if present:
+                bitmaps[value] &= ~bit
+                if not bitmaps[value]:
+                    del bitmaps[value]
+        for field in SORT_FIELDS:
+            order = self._orders[field]
+            entry = (self._sort_keys[field][slot], self._ids[slot], slot)
+            position = bisect.bisect_left(order, entry)
+            if position < len(order) and order[position] == entry:
+                order.pop(position)
+        self._alive &= ~bit
+        del self._slot_by_id[self._ids[slot]]
+        self._ids[slot] = None
+        self._values[slot] = None
+        self._free_slots.append(slot)
+
+    def _upsert(self, document: dict):
+        product_id = document.get('id')
+        if not product_id:
+            return
+        slot = self._slot_by_id.get(product_id)
+        if slot is not None:
+            self._remove_slot(slot)
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = len(self._ids)
+            self._ids.append(None)
+            self._values.append(None)
+            for field in SORT_FIELDS:
+                self._sort_keys[field].append(None)
+
+        bit = 1 << slot
+        self._slot_by_id[product_id] = slot
+        self._ids[slot] = product_id
+        self._values[slot] = tuple(document.get(field) for field in BITMAP_FIELDS)
+        self._alive |= bit
+        for field in BITMAP_FIELDS:
+            value = document.get(field)
+            try:
+                self._bitmaps[field][value] = self._bitmaps[field].get(value, 0) | bit
+            except TypeError:  # unhashable value: never matched by an equality filter
+                pass
+        for field in SORT_FIELDS:
+            key = sort_value(document.get(field))
+            self._sort_keys[field][slot] = key
+            bisect.insort(self._orders[field], (key, product_id, slot))
+        updated_at = document.get('updated_at') or ''
+        if isinstance(updated_at, str) and updated_at > self.last_updated_at:
+            self.last_updated_at = updated_at
+
+    def upsert(self, document: dict, version: int | None = None):
+        """Apply a local create/update. `version` is the catalog version it produced."""
+        with self._lock:
+            if not self.loaded:
+                return
+            self._upsert(document)
+            self._advance(version)
+
+    def remove(self, product_id: str, version: int | None = None):
+        """Apply a local delete."""
+        with self._lock:
+            if not self.loaded:
+                return
+            slot = self._slot_by_id.get(product_id)
+            if slot is not None:
+                self._remove_slot(slot)
+            self._advance(version)
+
+    def _advance(self, version: int | None):
+        # Only adopt the new version when no other worker's write came in between
+        if version is not None and self.version is not None and version == self.version + 1:
+            self.version = version
+
+    def load(self, version: int):
+        """Rebuild every column from MongoDB."""
+        # Taken before the read: a deletion racing with it is applied again
+        deleted_at = datetime.utcnow()
+        documents = list(self.collection.find({}, ENGINE_PROJECTION))
+        with self._lock:
+            self._clear()
+            self.last_updated_at = ''
+            self.last_deleted_at = deleted_at
+            for document in sorted(documents, key=lambda d: str(d.get('id'))):
+                self._upsert(document)
+            self.version = version
+            self.loaded = True
+            self.loaded_at = time.time()
+        logger.info('Catalog engine loaded %d products at v%s', len(self._slot_by_id), version)
+
+    def sync(self, version: int):
+        """Catch up with writes made by other workers since the last sync."""
+        if not self.loaded or time.time() - self.loaded_at >= CATALOG_ENGINE_RELOAD_SECONDS:
+            self.load(version)
+            return
+        changed = list(self.collection.find(
+            {'updated_at': {'$gte': catch_up_from(self.last_updated_at)}}, ENGINE_PROJECTION))
+        removed, deleted_at = deleted_since(self.tombstones, self.last_deleted_at)
+        with self._lock:
+            for document in changed:
+                self._upsert(document)
+            for product_id in removed:
+                slot = self._slot_by_id.get(product_id)
+                if slot is not None:
+                    self._remove_slot(slot)
+            self.last_deleted_at = deleted_at
+            self.version = version
+
+    def invalidate(self):
+        """Force a sync before the next query, even if the version has not moved."""
+        with self._lock:
+            self.version = None
+
+    def ensure_fresh(self, version: int) -> bool:
+        """Sync if the catalog version moved. False when the engine cannot be used."""
+        if not self.loaded:
+            if not self._loading:
+                self.warm_start(lambda: version)
+            return False
+        if self.version == version:
+            return True
+        try:
+            self.sync(version)
+        except PyMongoError as exc:
+            logger.error('Catalog engine sync failed: %s', exc)
+            return False
+        return True
+
+    def warm_start(self, version_fn):
+        """Load on a background thread so boot is not blocked."""
+        self._loading = True
+
+        def run():
+            try:
+                self.load(version_fn())
+            except PyMongoError as exc:
+                logger.error('Catalog engine load failed: %s', exc)
+            finally:
+                self._loading = False
+
+        threading.Thread(target=run, name='catalog-engine-load', daemon=True).start()
+
+    # ---- querying ----
+
+    def _match(self, query) -> int | None:
+        """Bitmap of slots matching a filter, or None if the filter is unsupported."""
+        if not isinstance(query, dict):
+            return None
+        result = self._alive
+        for key, value in query.items():
+            if key in ('$and', '$or'):
+                if not isinstance(value, list) or not value:
+                    return None
+                parts = [self._match(part) for part in value]
+                if any(part is None for part in parts):
+                    return None
+                combined = parts[0]
+                for part in parts[1:]:
+                    combined = combined & part if key == '$and' else combined | part
+                result &= combined
+            elif key in BITMAP_FIELDS and not isinstance(value, (dict, list)):
+                result &= self._bitmaps[key].get(value, 0)
+            else:
+                return None
+        return result
+
+    def _ordered_slots(self, bitmap: int, field: str, direction: int, tie_direction: int, count: int):
+        """Yield matching slots in (field direction, id tie_direction) order."""
+        if count * 8 < len(self._slot_by_id):
+            # Selective filter: sorting the matches beats walking every row
+            keys = self._sort_keys[field]
+            slots = sorted(_bits(bitmap), key=lambda slot: self._ids[slot], reverse=tie_direction == -1)
+            slots.sort(key=lambda slot: keys[slot], reverse=direction == -1)
+            yield from slots
+            return
+
+        # Byte view of the bitmap: a membership test is one index, not a
+        # shift of the whole integer
+        matches = bitmap.to_bytes(len(self._ids) // 8 + 1, 'little')
+        order = self._orders[field] if direction == 1 else reversed(self._orders[field])
+        if direction == tie_direction:
+            for _, _, slot in order:
+                if matches[slot >> 3] >> (slot & 7) & 1:
+                    yield slot
+            return
+        # Field and id in opposite directions: flip each run of equal keys
+        run_key, run = None, []
+        for key, _, slot in order:
+            if not matches[slot >> 3] >> (slot & 7) & 1:
+                continue
+            if key != run_key and run:
+                yield from reversed(run)
+                run = []
+            run_key = key
+            run.append(slot)
+        yield from reversed(run)
+
+    def select(self, query: dict, sort_criteria: list[tuple], skip: int, limit: int):
+        """
+        Return (product ids, total) for a listing page, or None when the
+        filter or sort cannot be answered from memory.
+        """
+        if (len(sort_criteria) != 2 or sort_criteria[1] not in (('id', 1), ('id', -1))
+                or sort_criteria[0][0] not in SORT_FIELDS):
+            self.fallbacks += 1
+            return None
+        field, direction = sort_criteria[0]
+        tie_direction = sort_criteria[1][1]
+        with self._lock:
+            if not self.loaded:
+                self.fallbacks += 1
+                return None
+            bitmap = self._match(query)
+            if bitmap is None:
+                self.fallbacks += 1
+                return None
+            total = bitmap.bit_count()
+            product_ids = []
+            limit = limit if limit > 0 else total  # limit(0) means no limit, as in MongoDB
+            if skip < total:
+                for position, slot in enumerate(self._ordered_slots(bitmap, field, direction, tie_direction, total)):
+                    if position < skip:
+                        continue
+                    product_ids.append(self._ids[slot])
+                    if len(product_ids) >= limit:
+                        break
+            self.queries += 1
+            return product_ids, total
+
+    def stats(self) -> dict:
+        return {
+            'loaded': self.loaded,
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'products': len(self._slot_by_id),
+            'queries': self.queries,
+            'fallbacks': self.fallbacks,
+        }
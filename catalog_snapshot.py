@@ -0,0 +1,405 @@
+"""
+Memory-mapped snapshot of the public catalog, shared by all gunicorn workers.
+
+Every active product is stored as its pre-encoded GET /api/products/<id>
+response body, next to sorted lookup tables by id and by slug key (see
+product_slugs.py). Workers map the same file read-only, so the catalog
+lives once in the page cache instead of once per worker, and a detail
+request is equally warm whichever worker serves it.
+
+Scope: products only. The category tree is small and is held per worker by
+category_tree.py (one query per catalog version), so it is not part of the
+snapshot; format 3 dropped the category section earlier snapshots carried.
+
+  header    magic, format version, counts, section offsets
+  meta      JSON: catalog version, read_at (UTC, before the read), built_at
+  rec_off   uint64[n_records + 1]   offsets into the record blob
+  records   encoded response bodies
+  id_off    uint32[n_ids + 1]       offsets into the sorted id blob
+  ids       utf-8 bytes, sorted
+  id_ord    uint32[n_ids]           record ordinal per id
+  slug_off  uint32[n_slugs + 1]
+  slugs     utf-8 bytes, sorted slug keys
+  slug_ord  uint32[n_slugs]
+
+A snapshot is tagged with the catalog version (catalog_version.py) it was
+read at. Writes schedule a rebuild, which one worker performs under a file
+lock and publishes with os.replace; the others notice the new file and
+remap it. Until then the older snapshot keeps serving through a per-version
+delta: the products written since its read_at (by updated_at) and deleted
+since (product_tombstones.py) are read with two indexed queries, and only
+those fall through to MongoDB. A delta larger than SNAPSHOT_MAX_DELTA waits
+for the rebuild instead.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from product_search import build_lock
+from product_slugs import SLUG_KEYS_FIELD, slug_keys
+from product_tombstones import catch_up_from, deleted_since
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OCCS'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sIIIII' + 'Q' * 9)
+
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH')
+SNAPSHOT_REBUILD_DELAY_SECONDS = float(os.getenv('SNAPSHOT_REBUILD_DELAY_SECONDS', 1))
+SNAPSHOT_CHECK_SECONDS = float(os.getenv('SNAPSHOT_CHECK_SECONDS', 1))
+SNAPSHOT_MAX_DELTA = int(os.getenv('SNAPSHOT_MAX_DELTA', 1000))
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _key_table(pairs: list[tuple[str, int]]) -> tuple[bytes, bytes, bytes]:
+    """Sorted (key, ordinal) pairs as (offsets, key blob, ordinals)."""
+    offsets = array('I', [0])
+    blob = bytearray()
+    ordinals = array('I')
+    for key, ordinal in sorted(pairs):
+        blob += key.encode('utf-8')
+        offsets.append(len(blob))
+        ordinals.append(ordinal)
+    return offsets.tobytes(), bytes(blob), ordinals.tobytes()
+
+
+def write_snapshot(path: str, records: list[tuple[dict, bytes]], info: dict):
+    """
+    Serialize a snapshot to `path` atomically.
+    `records` pairs each product with its encoded response body.
+    """
+    record_offsets = array('Q', [0])
+    record_blob = bytearray()
+    id_pairs, slug_pairs = [], []
+    for ordinal, (product, body) in enumerate(records):
+        record_blob += body
+        record_offsets.append(len(record_blob))
+        id_pairs.append((product['id'], ordinal))
+        for key in product.get(SLUG_KEYS_FIELD) or slug_keys(product):
+            slug_pairs.append((key, ordinal))
+
+    # A key shared by several products resolves to the first one
+    seen = set()
+    unique_slugs = []
+    for key, ordinal in slug_pairs:
+        if key not in seen:
+            seen.add(key)
+            unique_slugs.append((key, ordinal))
+
+    meta = json.dumps(info, separators=(',', ':'), default=str).encode('utf-8')
+    sections = [meta, record_offsets.tobytes(), bytes(record_blob),
+                *_key_table(id_pairs), *_key_table(unique_slugs)]
+
+    offsets = []
+    position = _aligned(HEADER.size)
+    for section in sections:
+        offsets.append(position)
+        position = _aligned(position + len(section))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(records), len(id_pairs),
+                                     len(unique_slugs), len(meta), *offsets))
+            for offset, section in zip(offsets, sections):
+                handle.seek(offset)
+                handle.write(section)
+            handle.truncate(position)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class _KeyIndex:
+    """Binary search over a sorted key table inside the mapped file."""
+
+    def __init__(self, view: memoryview, offsets_at: int, blob_at: int, ordinals_at: int, count: int):
+        self.count = count
+        self._offsets = view[offsets_at:offsets_at + 4 * (count + 1)].cast('I')
+        self._blob = view[blob_at:blob_at + (self._offsets[-1] if count else 0)]
+        self._ordinals = view[ordinals_at:ordinals_at + 4 * count].cast('I')
+
+    def _key(self, position: int) -> bytes:
+        return bytes(self._blob[self._offsets[position]:self._offsets[position + 1]])
+
+    def get(self, key: str) -> int | None:
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == target:
+            return self._ordinals[low]
+        return None
+
+
+class MappedSnapshot:
+    """Read-only view over a snapshot file."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as handle:
+            stat = os.fstat(handle.fileno())
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        (magic, version, n_records, n_ids, n_slugs, meta_length, meta_off,
+         rec_off_off, records_off, id_off_off, ids_off, id_ord_off,
+         slug_off_off, slugs_off, slug_ord_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'Not a catalog snapshot (format {version}): {path}')
+
+        view = memoryview(self._mm)
+        self.info: dict = json.loads(bytes(view[meta_off:meta_off + meta_length]))
+        self.version = int(self.info.get('version', -1))
+        self.n_records = n_records
+        self._record_offsets = view[rec_off_off:rec_off_off + 8 * (n_records + 1)].cast('Q')
+        self._records = view[records_off:records_off + self._record_offsets[-1]]
+        self._ids = _KeyIndex(view, id_off_off, ids_off, id_ord_off, n_ids)
+        self._slugs = _KeyIndex(view, slug_off_off, slugs_off, slug_ord_off, n_slugs)
+
+    def _record(self, ordinal: int | None) -> bytes | None:
+        if ordinal is None:
+            return None
+        return bytes(self._records[self._record_offsets[ordinal]:self._record_offsets[ordinal + 1]])
+
+    def product_by_id(self, product_id: str) -> bytes | None:
+        return self._record(self._ids.get(product_id))
+
+    def product_by_slug_keys(self, keys: list[str]) -> bytes | None:
+        """Body of the product matching the earliest of `keys` (priority order)."""
+        for key in keys:
+            ordinal = self._slugs.get(key)
+            if ordinal is not None:
+                return self._record(ordinal)
+        return None
+
+
+class SnapshotView:
+    """
+    A mapped snapshot as of a newer catalog version: products written or
+    deleted since it was read are not answered from it (None, so the caller
+    reads MongoDB), nor is any slug key such a product now owns.
+    """
+
+    def __init__(self, snapshot: MappedSnapshot, version: int,
+                 stale_ordinals: frozenset = frozenset(), stale_keys: frozenset = frozenset()):
+        self.snapshot = snapshot
+        self.version = version
+        self.stale_ordinals = stale_ordinals
+        self.stale_keys = stale_keys
+
+    def product_by_id(self, product_id: str) -> bytes | None:
+        ordinal = self.snapshot._ids.get(product_id)
+        if ordinal in self.stale_ordinals:
+            return None
+        return self.snapshot._record(ordinal)
+
+    def product_by_slug_keys(self, keys: list[str]) -> bytes | None:
+        """Body of the product matching the earliest of `keys` (priority order)."""
+        for key in keys:
+            if key in self.stale_keys:
+                return None
+            ordinal = self.snapshot._slugs.get(key)
+            if ordinal is not None:
+                return None if ordinal in self.stale_ordinals else self.snapshot._record(ordinal)
+        return None
+
+
+class CatalogSnapshot:
+    """
+    Owns this worker's mapping of the shared snapshot and keeps it current.
+
+    `encode` turns a product into its detail response body; `version_fn`
+    returns the current catalog version; `tombstones` is the collection of
+    deleted product ids used for deltas (without it only a snapshot of the
+    current version is served).
+    """
+
+    def __init__(self, products_coll, encode, version_fn, tombstones=None,
+                 path: str | None = None,
+                 rebuild_delay: float = SNAPSHOT_REBUILD_DELAY_SECONDS,
+                 check_seconds: float = SNAPSHOT_CHECK_SECONDS):
+        self.products = products_coll
+        self.encode = encode
+        self.version_fn = version_fn
+        self.tombstones = tombstones
+        self.path = path or SNAPSHOT_PATH or os.path.join(
+            tempfile.gettempdir(), f'outre_couture_catalog_{products_coll.database.name}.snap')
+        self.rebuild_delay = rebuild_delay
+        self.check_seconds = check_seconds
+        self._snapshot: MappedSnapshot | None = None
+        self._lock = threading.Lock()
+        self._rebuild_pending = False
+        self._checked_at = 0.0
+        # Snapshots at or below this version are not served (see invalidate())
+        self._distrusted_version = -1
+        self._view: SnapshotView | None = None
+        # (snapshot, version) whose delta could not be used: not retried
+        self._no_view = None
+        self.builds = 0
+        self.delta_reads = 0
+
+    def load(self) -> bool:
+        """Map the snapshot file if one exists. Returns False when unavailable."""
+        try:
+            snapshot = MappedSnapshot(self.path)
+        except (OSError, ValueError) as exc:
+            logger.info('No usable catalog snapshot at %s: %s', self.path, exc)
+            return False
+        self._snapshot = snapshot
+        return True
+
+    def _changed_on_disk(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        return self._snapshot is None or identity != self._snapshot.identity
+
+    def build(self):
+        """Read the active catalog from MongoDB and publish a new snapshot."""
+        # Read the version first: a write landing mid-build leaves the
+        # snapshot tagged older than the data, never the other way round
+        version = self.version_fn()
+        read_at = datetime.utcnow().isoformat()
+        records = [
+            (product, self.encode(product))
+            for product in self.products.find({'is_active': True}, {'_id': 0}).sort('id', 1)
+            if product.get('id')
+        ]
+        write_snapshot(self.path, records, {'version': version, 'read_at': read_at, 'built_at': time.time()})
+        self.builds += 1
+        self.load()
+        logger.info('Catalog snapshot v%s written: %d products', version, len(records))
+
+    def _rebuild_shared(self):
+        """Rebuild under the cross-process lock, or adopt another worker's newer file."""
+        with build_lock(self.path, True):
+            target = self.version_fn()
+            if self._changed_on_disk():
+                self.load()
+            if self._snapshot is not None and self._snapshot.version >= target:
+                return
+            self.build()
+
+    def _run_rebuild(self):
+        time.sleep(self.rebuild_delay)  # coalesce bursts of writes into one build
+        with self._lock:
+            self._rebuild_pending = False
+        try:
+            self._rebuild_shared()
+        except (PyMongoError, OSError) as exc:
+            logger.error('Catalog snapshot rebuild failed: %s', exc)
+
+    def schedule_rebuild(self):
+        """Rebuild on a background thread shortly after the last catalog write."""
+        with self._lock:
+            if self._rebuild_pending:
+                return
+            self._rebuild_pending = True
+        threading.Thread(target=self._run_rebuild, name='catalog-snapshot-build', daemon=True).start()
+
+    def warm_start(self):
+        """Map an existing snapshot at boot, and rebuild it if it is out of date."""
+        self.load()
+        self.current()
+
+    def invalidate(self):
+        """A write could not bump the version: stop serving snapshots until it moves on."""
+        self._distrusted_version = max(self._distrusted_version, self.version_fn())
+
+    def _delta_view(self, snapshot: MappedSnapshot, version: int) -> SnapshotView | None:
+        """The snapshot minus the products written or deleted since it was read."""
+        read_at = snapshot.info.get('read_at')
+        if not read_at or self.tombstones is None:
+            return None
+        try:
+            changed = list(self.products.find(
+                {'updated_at': {'$gte': catch_up_from(read_at)}},
+                {'_id': 0, 'id': 1, SLUG_KEYS_FIELD: 1}).limit(SNAPSHOT_MAX_DELTA + 1))
+            deleted, _ = deleted_since(self.tombstones, datetime.fromisoformat(read_at))
+        except PyMongoError as exc:
+            logger.error('Catalog snapshot delta failed: %s', exc)
+            return None
+        self.delta_reads += 1
+        if len(changed) + len(deleted) > SNAPSHOT_MAX_DELTA:
+            return None
+        stale_ids = [product.get('id') for product in changed] + deleted
+        stale_ordinals = frozenset(
+            ordinal for ordinal in map(snapshot._ids.get, stale_ids) if ordinal is not None)
+        stale_keys = frozenset(key for product in changed for key in product.get(SLUG_KEYS_FIELD) or ())
+        return SnapshotView(snapshot, version, stale_ordinals, stale_keys)
+
+    def current(self) -> SnapshotView | None:
+        """
+        The mapped snapshot as of the current catalog version: as is when it
+        matches, else with the delta since it was read. None when unavailable.
+        """
+        version = self.version_fn()
+        if version <= self._distrusted_version:
+            return None
+        view = self._view
+        if view is not None and view.version == version and view.snapshot is self._snapshot:
+            return view
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            now = time.time()
+            if now - self._checked_at >= self.check_seconds:
+                self._checked_at = now
+                if self._changed_on_disk():
+                    self.load()
+                    snapshot = self._snapshot
+                if snapshot is None or snapshot.version < version:
+                    self.schedule_rebuild()
+        if snapshot is None or snapshot.version > version:
+            return None
+        if snapshot.version == version:
+            view = SnapshotView(snapshot, version)
+        else:
+            if self._no_view == (snapshot, version):
+                return None
+            view = self._delta_view(snapshot, version)
+            if view is None:
+                self._no_view = (snapshot, version)
+                return None
+        self._view = view
+        return view
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'path': self.path,
+            'version': snapshot.version if snapshot is not None else None,
+            'products': snapshot.n_records if snapshot is not None else 0,
+            'bytes': snapshot.identity[2] if snapshot is not None else 0,
+            'builds': self.builds,
+            'delta_reads': self.delta_reads,
+        }
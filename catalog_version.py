@@ -0,0 +1,88 @@
+"""
+Monotonic data versions shared by all workers.
+
+Each scope ('catalog' for products/categories, 'categories' for the
+category tree alone, 'rfq' for quote requests) is
+a counter document in the catalog_meta collection, bumped with $inc by
+every write. Caches store the version they were filled at and treat any
+entry from an older version as invalid.
+
+Reads are served from a per-process copy refreshed at most every
+CATALOG_VERSION_POLL_SECONDS, so checking the version is normally free; a
+worker always sees its own bumps immediately.
+
+If a bump cannot reach MongoDB the local version is left as it is (making
+one up could collide with a version another worker published for other
+data); the listeners registered with on_bump_failure() drop this worker's
+cached reads instead.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_POLL_SECONDS = float(os.getenv('CATALOG_VERSION_POLL_SECONDS', 1))
+
+
+class CatalogVersion:
+    """Per-scope version counters backed by one MongoDB collection."""
+
+    def __init__(self, collection, poll_seconds: float = CATALOG_VERSION_POLL_SECONDS):
+        self.collection = collection
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._versions: dict[str, int] = {}
+        self._checked_at: dict[str, float] = {}
+        self._failure_listeners = []
+
+    def _store(self, scope: str, version: int):
+        with self._lock:
+            if version >= self._versions.get(scope, 0):
+                self._versions[scope] = version
+            self._checked_at[scope] = time.time()
+
+    def current(self, scope: str = 'catalog') -> int:
+        """Latest known version for a scope (0 before the first write)."""
+        if time.time() - self._checked_at.get(scope, 0.0) < self.poll_seconds:
+            return self._versions.get(scope, 0)
+        try:
+            document = self.collection.find_one({'_id': scope}, {'version': 1}) or {}
+            self._store(scope, int(document.get('version', 0)))
+        except PyMongoError as exc:
+            logger.error('Could not read %s version: %s', scope, exc)
+        return self._versions.get(scope, 0)
+
+    def bump(self, scope: str = 'catalog') -> int:
+        """Record a write; returns the new version. Never raises."""
+        try:
+            document = self.collection.find_one_and_update(
+                {'_id': scope},
+                {'$inc': {'version': 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            self._store(scope, int(document['version']))
+        except PyMongoError as exc:
+            logger.error('Could not bump %s version: %s', scope, exc)
+            for listener in self._failure_listeners:
+                try:
+                    listener(scope)
+                except Exception:
+                    logger.exception('Bump failure listener for %s failed', scope)
+        return self._versions.get(scope, 0)
+
+    def on_bump_failure(self, listener):
+        """Call listener(scope) when a write could not bump its version."""
+        self._failure_listeners.append(listener)
+
+    def observe(self, scope: str, version: int):
+        """Adopt a version learned from elsewhere without a database read."""
+        self._store(scope, int(version))
@@ -0,0 +1,187 @@
+"""
+Per-category product counters for menus and delete checks.
+
+  category_counters  {_id: category_id, active, total, updated_at}
+
+Every product counts towards its sub-category (category_id) and its main
+category (main_category_id). create_product, update_product and
+delete_product pass the document before and after the write to apply(),
+which turns the difference into $inc updates, so counters never need a
+count_documents. A failed increment is logged rather than failing the
+product write; reconcile() (run by reconcile_category_counters.py)
+recomputes every counter with one aggregation and repairs any drift.
+
+Readers get all counters from an in-memory copy reloaded with one query
+whenever the catalog version moves (every product write bumps it).
+
+Counters only exist once they have been seeded: on a database that had
+products before counters were introduced, the first read runs reconcile()
+once and records it in catalog_meta ({_id: 'category_counters'}), so no
+deploy step is needed (running reconcile_category_counters.py --apply at
+deploy does the same ahead of time).
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime
+
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+COUNTED_FIELDS = ('category_id', 'main_category_id')
+
+# catalog_meta document recording that the counters were seeded from the products
+SEEDED_MARKER = 'category_counters'
+
+
+def product_deltas(before: dict | None, after: dict | None) -> dict[str, dict[str, int]]:
+    """{category_id: {'active': delta, 'total': delta}} for one product write."""
+    deltas: dict[str, dict[str, int]] = {}
+
+    def add(product, sign):
+        if not product:
+            return
+        for category_id in {product.get(field) for field in COUNTED_FIELDS}:
+            if not category_id:
+                continue
+            delta = deltas.setdefault(category_id, {'active': 0, 'total': 0})
+            delta['total'] += sign
+            if product.get('is_active') is True:
+                delta['active'] += sign
+
+    add(before, -1)
+    add(after, 1)
+    return {category_id: delta for category_id, delta in deltas.items() if any(delta.values())}
+
+
+class CategoryCounters:
+    """$inc-maintained counters plus a per-version in-memory copy for readers."""
+
+    def __init__(self, collection, products=None, meta=None):
+        self.collection = collection
+        self.products = products
+        self.meta = meta
+        self._lock = threading.Lock()
+        self._counts: dict[str, dict[str, int]] = {}
+        self._version = None
+        self._seeded = products is None or meta is None
+        self.increments = 0
+
+    def ensure_seeded(self):
+        """Populate the counters from the products collection if that never happened."""
+        if self._seeded:
+            return
+        try:
+            if self.meta.find_one({'_id': SEEDED_MARKER}) is None:
+                drift = reconcile(self.products, self.collection, apply=True)
+                mark_seeded(self.meta, len(drift))
+                logger.info('Category counters seeded (%d categories written)', len(drift))
+            self._seeded = True
+        except PyMongoError as exc:
+            logger.error('Category counters not seeded (retrying on next read): %s', exc)
+
+    def apply(self, before: dict | None, after: dict | None):
+        """Record a product create (before=None), update, or delete (after=None)."""
+        deltas = product_deltas(before, after)
+        if not deltas:
+            return
+        now = datetime.utcnow().isoformat()
+        operations = [
+            UpdateOne({'_id': category_id}, {'$inc': delta, '$set': {'updated_at': now}}, upsert=True)
+            for category_id, delta in deltas.items()
+        ]
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+            self.increments += len(operations)
+        except PyMongoError as exc:
+            logger.error('Category counters not updated (reconcile to repair): %s', exc)
+        self._version = None
+
+    def forget(self, category_id: str):
+        """The category was deleted."""
+        self.collection.delete_one({'_id': category_id})
+        self._version = None
+
+    def counts(self, version: int) -> dict[str, dict[str, int]]:
+        """Every counter, reloaded at most once per catalog version."""
+        if self._version != version:
+            self.ensure_seeded()
+            counts = {
+                counter['_id']: {'active': counter.get('active', 0), 'total': counter.get('total', 0)}
+                for counter in self.collection.find({}, {'active': 1, 'total': 1})
+            }
+            with self._lock:
+                self._counts = counts
+                self._version = version
+        return self._counts
+
+    def get(self, category_id: str, version: int) -> dict[str, int]:
+        return self.counts(version).get(category_id, {'active': 0, 'total': 0})
+
+    def stats(self) -> dict:
+        return {'categories': len(self._counts), 'version': self._version, 'seeded': self._seeded,
+                'increments': self.increments}
+
+
+def expected_counts(products) -> dict[str, dict[str, int]]:
+    """Counters recomputed from the products collection with one aggregation."""
+    counts: dict[str, dict[str, int]] = {}
+    pipeline = [
+        {'$project': {'_id': 0, 'category_id': 1, 'main_category_id': 1,
+                      'active': {'$cond': [{'$eq': ['$is_active', True]}, 1, 0]}}},
+        {'$group': {'_id': {'category_id': '$category_id', 'main_category_id': '$main_category_id'},
+                    'active': {'$sum': '$active'}, 'total': {'$sum': 1}}},
+    ]
+    for group in products.aggregate(pipeline):
+        for category_id in {group['_id'].get(field) for field in COUNTED_FIELDS}:
+            if not category_id:
+                continue
+            count = counts.setdefault(category_id, {'active': 0, 'total': 0})
+            count['active'] += group['active']
+            count['total'] += group['total']
+    return counts
+
+
+def reconcile(products, counters_collection, apply: bool = False) -> list[dict]:
+    """
+    Compare stored counters with the products collection.
+    Returns the drifted entries; with apply=True also overwrites them.
+    Increments landing between the aggregation and the write are lost, so
+    run it when the catalog is quiet (or run it twice).
+    """
+    expected = expected_counts(products)
+    stored = {
+        counter['_id']: {'active': counter.get('active', 0), 'total': counter.get('total', 0)}
+        for counter in counters_collection.find({}, {'active': 1, 'total': 1})
+    }
+    zero = {'active': 0, 'total': 0}
+    drift = [
+        {'category_id': category_id,
+         'stored': stored.get(category_id, zero),
+         'expected': expected.get(category_id, zero)}
+        for category_id in sorted(set(expected) | set(stored))
+        if stored.get(category_id, zero) != expected.get(category_id, zero)
+    ]
+    if apply and drift:
+        now = datetime.utcnow().isoformat()
+        operations = [
+            UpdateOne({'_id': entry['category_id']},
+                      {'$set': {**entry['expected'], 'updated_at': now}}, upsert=True)
+            for entry in drift if entry['category_id'] in expected
+        ]
+        orphaned = [entry['category_id'] for entry in drift if entry['category_id'] not in expected]
+        if orphaned:
+            operations.append(DeleteMany({'_id': {'$in': orphaned}}))
+        counters_collection.bulk_write(operations, ordered=False)
+    return drift
+
+
+def mark_seeded(meta, repaired: int = 0):
+    """Record in catalog_meta that the counters match the products collection."""
+    meta.update_one({'_id': SEEDED_MARKER},
+                    {'$set': {'seeded_at': datetime.utcnow().isoformat(), 'repaired': repaired}},
+                    upsert=True)
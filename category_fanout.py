@@ -0,0 +1,295 @@
+"""
+Background propagation of category renames into product documents.
+
+Products embed category_name, main_category_name and main_category_slug
+(and slug_keys derived from them, see product_slugs.py) so reads need no
+joins. update_category only rewrites the category document, so it
+enqueues a job here and returns; a worker thread then rewrites the
+affected products:
+
+  category_jobs  {id, category_id, category_type, fields, status,
+                  last_id, scanned, modified, owner, lease_until, ...}
+
+A job walks the category's products in _id order, CATEGORY_FANOUT_BATCH_SIZE
+at a time, with one bulk_write per batch, and records its position
+(last_id) and counters after every batch. A worker holds a job through a
+lease renewed per batch; if the worker dies, the lease expires and any
+worker (including a freshly booted one) resumes the job from last_id.
+Renaming the same category again supersedes its unfinished jobs, since
+the newest job rewrites every product anyway.
+
+Each product is rewritten only if its name, seo_slug and slug_keys are
+still what the batch read, so a concurrent update_product is never
+overwritten with stale slug keys; products that changed in between are
+re-read and retried. Slug keys a rewrite retires (the old main category's
+URLs) are recorded in the slug history, so old URLs 301 to the new ones.
+
+`on_batch(job, keys)` runs after every batch with the slug keys the batch
+wrote, so the app can bump the catalog version and invalidate caches.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+from product_slugs import SLUG_KEYS_FIELD, slug_keys
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_JOBS_COLLECTION = 'category_jobs'
+CATEGORY_FANOUT_BATCH_SIZE = int(os.getenv('CATEGORY_FANOUT_BATCH_SIZE', 500))
+CATEGORY_FANOUT_POLL_SECONDS = float(os.getenv('CATEGORY_FANOUT_POLL_SECONDS', 5))
+CATEGORY_FANOUT_LEASE_SECONDS = float(os.getenv('CATEGORY_FANOUT_LEASE_SECONDS', 60))
+# Attempts per batch at rewriting products that changed while it ran
+CATEGORY_FANOUT_RETRIES = 5
+
+# Product fields to rewrite, by the type of the renamed category
+PRODUCT_FIELDS = {
+    'sub': {'name': 'category_name'},
+    'main': {'id': 'main_category_id', 'name': 'main_category_name', 'slug': 'main_category_slug'},
+}
+# Products belonging to the renamed category
+PRODUCT_MATCH_FIELD = {'sub': 'category_id', 'main': 'main_category_id'}
+
+PROJECTION = {'_id': 1, 'id': 1, 'name': 1, 'seo_slug': 1, 'category_name': 1, 'main_category_id': 1,
+              'main_category_name': 1, 'main_category_slug': 1, SLUG_KEYS_FIELD: 1}
+
+# Fields slug_keys is derived from, besides the ones a job rewrites: a
+# rewrite only applies while they are unchanged since the read
+GUARDED_FIELDS = ('name', 'seo_slug', SLUG_KEYS_FIELD)
+
+ACTIVE_STATUSES = ['pending', 'running']
+
+
+def product_fields(category: dict) -> dict:
+    """Denormalized product fields that mirror a category."""
+    mapping = PRODUCT_FIELDS.get(category.get('type'), {})
+    return {target: category.get(source) for source, target in mapping.items()}
+
+
+class CategoryFanout:
+    """Queue and run category propagation jobs on a daemon thread."""
+
+    def __init__(self, db, on_batch=None, slug_history=None,
+                 batch_size: int = CATEGORY_FANOUT_BATCH_SIZE,
+                 poll_seconds: float = CATEGORY_FANOUT_POLL_SECONDS,
+                 lease_seconds: float = CATEGORY_FANOUT_LEASE_SECONDS):
+        self.jobs = db[CATEGORY_JOBS_COLLECTION]
+        self.products = db['products']
+        self.on_batch = on_batch
+        self.slug_history = slug_history
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.batches = 0
+        self.retries = 0
+        self.errors = 0
+
+    def enqueue(self, category: dict, created_by: str | None = None) -> dict:
+        """Queue propagation of a category's current name/slug; supersedes older jobs."""
+        now = datetime.utcnow().isoformat()
+        self.jobs.update_many(
+            {'category_id': category['id'], 'status': {'$in': ACTIVE_STATUSES}},
+            {'$set': {'status': 'superseded', 'finished_at': now}})
+        job = {
+            'id': str(uuid.uuid4()),
+            'category_id': category['id'],
+            'category_type': category.get('type'),
+            'fields': product_fields(category),
+            'status': 'pending',
+            'last_id': None,
+            'scanned': 0,
+            'modified': 0,
+            'batches': 0,
+            'created_at': now,
+            'created_by': created_by,
+        }
+        self.jobs.insert_one(job)
+        job.pop('_id', None)
+        self._wake.set()
+        return job
+
+    def _claim(self) -> dict | None:
+        """Take the oldest pending job, or a running one whose owner's lease expired."""
+        now = datetime.utcnow()
+        job = self.jobs.find_one_and_update(
+            {'$or': [{'status': 'pending'},
+                     {'status': 'running', 'lease_until': {'$lt': now.isoformat()}}]},
+            {'$set': {'status': 'running', 'owner': self.owner,
+                      'lease_until': (now + timedelta(seconds=self.lease_seconds)).isoformat(),
+                      'updated_at': now.isoformat()}},
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER)
+        if job is not None:
+            job.pop('_id', None)
+        return job
+
+    def _checkpoint(self, job: dict, update: dict) -> bool:
+        """Record progress and renew the lease; False once the job is no longer ours."""
+        now = datetime.utcnow()
+        update = {**update, 'updated_at': now.isoformat(),
+                  'lease_until': (now + timedelta(seconds=self.lease_seconds)).isoformat()}
+        result = self.jobs.update_one(
+            {'id': job['id'], 'status': 'running', 'owner': self.owner}, {'$set': update})
+        return result.matched_count == 1
+
+    def _rewrite_batch(self, job: dict) -> tuple[int, int, list[str], object]:
+        """
+        Rewrite the next batch. Returns (products scanned, products rewritten,
+        slug keys written, _id to resume after or None when finished).
+        """
+        match = {PRODUCT_MATCH_FIELD[job['category_type']]: job['category_id']}
+        query = dict(match)
+        if job.get('last_id') is not None:
+            query['_id'] = {'$gt': job['last_id']}
+        batch = list(self.products.find(query, PROJECTION).sort('_id', ASCENDING).limit(self.batch_size))
+        if not batch:
+            return 0, 0, [], None
+
+        pending, rewritten = batch, []
+        for _ in range(CATEGORY_FANOUT_RETRIES):
+            written, all_matched = self._write_products(pending, job['fields'])
+            if all_matched:
+                rewritten += written
+                pending = []
+                break
+            # A guarded field changed under some rows: re-read them, keep
+            # the writes that landed and retry the rest with fresh values
+            applied, pending = self._sort_out(written, match, job['fields'])
+            rewritten += applied
+            if not pending:
+                break
+            self.retries += 1
+        if pending:
+            logger.warning('Category job %s: %d products kept changing; left for a later rename',
+                           job['id'], len(pending))
+
+        if rewritten and self.slug_history is not None:
+            self.slug_history.record_many(rewritten)
+        keys = [key for _, _, new_keys in rewritten for key in new_keys]
+        return len(batch), len(rewritten), keys, batch[-1]['_id'] if len(batch) == self.batch_size else None
+
+    def _write_products(self, products: list[dict], fields: dict) -> tuple[list[tuple], bool]:
+        """
+        Rewrite products whose guarded fields are unchanged since they were
+        read. Returns ([(product as written, old slug keys, new slug keys)],
+        whether every write matched).
+        """
+        now = datetime.utcnow().isoformat()
+        operations, written = [], []
+        for product in products:
+            changes = {field: value for field, value in fields.items() if product.get(field) != value}
+            if not changes:
+                continue
+            new_keys = slug_keys({**product, **changes})
+            guard = {field: product.get(field) for field in GUARDED_FIELDS}
+            operations.append(UpdateOne(
+                {'_id': product['_id'], **guard},
+                {'$set': {**changes, SLUG_KEYS_FIELD: new_keys, 'updated_at': now}}))
+            written.append(({**product, **changes}, product.get(SLUG_KEYS_FIELD) or slug_keys(product), new_keys))
+        if not operations:
+            return [], True
+        result = self.products.bulk_write(operations, ordered=False)
+        return written, result.matched_count == len(operations)
+
+    def _sort_out(self, written: list[tuple], match: dict, fields: dict) -> tuple[list[tuple], list[dict]]:
+        """
+        After a partly matched write: (writes that landed, fresh copies of the
+        products still missing the job's fields). Products that left the
+        category or were updated to the new fields by someone else are neither.
+        """
+        fresh = {product['_id']: product for product in self.products.find(
+            {'_id': {'$in': [product['_id'] for product, _, _ in written]}, **match}, PROJECTION)}
+        applied, pending = [], []
+        for product, old_keys, new_keys in written:
+            current = fresh.get(product['_id'])
+            if current is None:
+                continue
+            if any(current.get(field) != value for field, value in fields.items()):
+                pending.append(current)
+            elif current.get(SLUG_KEYS_FIELD) == new_keys:
+                applied.append((product, old_keys, new_keys))
+        return applied, pending
+
+    def run_job(self, job: dict):
+        """Process a claimed job to completion, batch by batch."""
+        while not self._stop.is_set():
+            scanned, modified, keys, last_id = self._rewrite_batch(job)
+            job['scanned'] = job.get('scanned', 0) + scanned
+            job['modified'] = job.get('modified', 0) + modified
+            job['batches'] = job.get('batches', 0) + 1
+            self.batches += 1
+            if modified and self.on_batch is not None:
+                self.on_batch(job, keys)
+
+            progress = {'last_id': last_id, 'scanned': job['scanned'],
+                        'modified': job['modified'], 'batches': job['batches']}
+            if last_id is None:
+                progress.update(status='done', finished_at=datetime.utcnow().isoformat())
+            if not self._checkpoint(job, progress):
+                logger.info('Category job %s superseded or taken over', job['id'])
+                return
+            if last_id is None:
+                logger.info('Category job %s done: %d products updated', job['id'], job['modified'])
+                return
+            job['last_id'] = last_id
+
+    def run_pending(self):
+        """Run jobs until none is claimable."""
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                return
+            try:
+                self.run_job(job)
+            except PyMongoError as exc:
+                # Leave the job running: it is retried when its lease expires
+                self.errors += 1
+                logger.error('Category job %s interrupted: %s', job['id'], exc)
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except PyMongoError as exc:
+                self.errors += 1
+                logger.warning('Category fan-out poll failed: %s', exc)
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self):
+        """Start the worker thread; it also resumes jobs interrupted by a restart."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='category-fanout', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def recent_jobs(self, limit: int = 50, status: str | None = None) -> list[dict]:
+        query = {'status': status} if status else {}
+        return list(self.jobs.find(query, {'_id': 0}).sort('created_at', -1).limit(limit))
+
+    def stats(self) -> dict:
+        return {
+            'owner': self.owner,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'batches': self.batches,
+            'retries': self.retries,
+            'errors': self.errors,
+        }
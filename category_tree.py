@@ -0,0 +1,178 @@
+"""
+In-memory category tree shared by every category lookup in app.py.
+
+The whole categories collection is small, so it is read with one query into
+an immutable CategoryTree indexed by id, slug and normalized name, with
+main -> sub links. Lookups then cost no round trips: the admin listing,
+sub-category resolution, product create/update validation, upload key
+building and category create/update/delete checks all read the tree.
+
+CategoryTreeCache remembers the 'categories' version (catalog_version.py)
+the tree was loaded at and reloads when it moves, so a category write in
+another worker is picked up even without invalidation_bus events. Only
+category writes and fan-out batches bump that scope, so product writes
+never reload the tree. It also reloads after local category writes and
+at least every CATEGORY_TREE_TTL_SECONDS as a safety net. A lookup that misses forces one
+reload (throttled) before answering "not found", so a category created a
+moment ago in another worker is never rejected.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TREE_TTL_SECONDS = float(os.getenv('CATEGORY_TREE_TTL_SECONDS', 300))
+
+# A miss triggers at most one forced reload per this many seconds
+MISS_RELOAD_SECONDS = 1.0
+
+
+def normalize_name(value) -> str:
+    """Case- and whitespace-insensitive form of a category name."""
+    return re.sub(r'\s+', ' ', str(value or '')).strip().lower()
+
+
+class CategoryTree:
+    """Immutable view over one load of the categories collection."""
+
+    def __init__(self, categories: list[dict]):
+        self.categories = categories
+        self.by_id = {category['id']: category for category in categories if category.get('id')}
+        self._mains_by_slug: dict[str, dict] = {}
+        self._mains_by_name: dict[str, dict] = {}
+        self._subs_by_main: dict[str, list[dict]] = {}
+        for category in categories:
+            if category.get('type') == 'main':
+                if category.get('slug'):
+                    self._mains_by_slug.setdefault(category['slug'], category)
+                self._mains_by_name.setdefault(normalize_name(category.get('name')), category)
+            elif category.get('type') == 'sub':
+                self._subs_by_main.setdefault(category.get('main_category_id'), []).append(category)
+
+    def get(self, category_id: str, category_type: str | None = None) -> dict | None:
+        category = self.by_id.get(category_id)
+        if category is None or (category_type and category.get('type') != category_type):
+            return None
+        return category
+
+    def mains(self) -> list[dict]:
+        """Main categories in name order."""
+        return sorted((c for c in self.categories if c.get('type') == 'main'),
+                      key=lambda c: c.get('name') or '')
+
+    def subs(self, main_category_id: str) -> list[dict]:
+        """Sub-categories of a main category in name order."""
+        return sorted(self._subs_by_main.get(main_category_id, []), key=lambda c: c.get('name') or '')
+
+    def main_for_slug(self, main_category_slug: str) -> dict | None:
+        """Main category by slug, else by name matching the slug or its title-cased form."""
+        category = self._mains_by_slug.get(main_category_slug)
+        if category is not None:
+            return category
+        for name in (main_category_slug.replace('-', ' '), main_category_slug):
+            category = self._mains_by_name.get(normalize_name(name))
+            if category is not None:
+                return category
+        return None
+
+    def main_for_name(self, name: str) -> dict | None:
+        """Main category by name, tolerating case and possessives ("WOMEN'S" -> Women)."""
+        normalized = normalize_name(name)
+        for candidate in (normalized, re.sub(r"'s\b", '', normalized), normalized.rstrip('s')):
+            category = self._mains_by_name.get(candidate) or self._mains_by_slug.get(candidate)
+            if category is not None:
+                return category
+        return None
+
+    def main_for_product(self, product: dict) -> dict | None:
+        """
+        Canonical main category of a product: through its sub-category when
+        that resolves, else from whatever main_category_* field it carries.
+        """
+        category = self.get(product.get('category_id'))
+        if category is not None:
+            main = category if category.get('type') == 'main' else self.parent(category)
+            if main is not None:
+                return main
+        return (self.get(product.get('main_category_id'), 'main')
+                or (product.get('main_category_slug') and self.main_for_slug(product['main_category_slug']))
+                or (product.get('main_category_name') and self.main_for_name(product['main_category_name']))
+                or None)
+
+    def parent(self, category: dict) -> dict | None:
+        """The main category of a sub-category."""
+        return self.get(category.get('main_category_id'), 'main')
+
+    def find_by_name(self, name: str, category_type: str | None = None,
+                     main_category_id: str | None = None) -> dict | None:
+        """Exact-name match, optionally limited to a type and a parent."""
+        for category in self.categories:
+            if category.get('name') != name:
+                continue
+            if category_type and category.get('type') != category_type:
+                continue
+            if main_category_id and category.get('main_category_id') != main_category_id:
+                continue
+            return category
+        return None
+
+
+class CategoryTreeCache:
+    """Holds the current CategoryTree and decides when to reload it."""
+
+    def __init__(self, collection, version_fn=None, ttl_seconds: float = CATEGORY_TREE_TTL_SECONDS):
+        self.collection = collection
+        self.version_fn = version_fn
+        self.ttl_seconds = ttl_seconds
+        self._tree: CategoryTree | None = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._forced_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def load(self) -> CategoryTree:
+        # Read the version first: a write landing mid-load leaves the tree
+        # tagged older than its data, so it is reloaded again
+        version = self.version_fn() if self.version_fn else None
+        tree = CategoryTree(list(self.collection.find({}, {'_id': 0})))
+        with self._lock:
+            self._tree = tree
+            self._version = version
+            self._loaded_at = time.time()
+            self.loads += 1
+        return tree
+
+    def invalidate(self):
+        """Reload on next use (after a category write here or elsewhere)."""
+        self._loaded_at = 0.0
+
+    def tree(self) -> CategoryTree:
+        tree = self._tree
+        if (tree is None or time.time() - self._loaded_at > self.ttl_seconds
+                or (self.version_fn is not None and self.version_fn() != self._version)):
+            tree = self.load()
+        return tree
+
+    def category(self, category_id: str, category_type: str | None = None) -> dict | None:
+        """Category by id, reloading once before reporting a miss."""
+        category = self.tree().get(category_id, category_type)
+        if category is None and time.time() - self._forced_at > MISS_RELOAD_SECONDS:
+            self._forced_at = time.time()
+            category = self.load().get(category_id, category_type)
+        return category
+
+    def stats(self) -> dict:
+        tree = self._tree
+        return {
+            'categories': len(tree.categories) if tree else 0,
+            'loads': self.loads,
+            'version': self._version,
+            'age_seconds': round(time.time() - self._loaded_at, 1) if tree else None,
+        }
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Declarative MongoDB index registry.
+
+Every query shape issued by app.py is backed by an entry in INDEX_SPECS.
+On app boot `start_index_sync()` creates missing indexes on a background
+thread, so request serving never waits for an index build. The same
+reconcile logic is available as a CLI for deploys and audits.
+
+Usage:
+  # Preview (report missing / divergent / extra indexes)
+  python db_indexes.py
+
+  # Create missing indexes
+  python db_indexes.py --apply
+
+  # Only one collection
+  python db_indexes.py --collection products --apply
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+from product_slugs import SLUG_HISTORY_RELEASED_TTL_SECONDS
+from product_tombstones import PRODUCT_TOMBSTONES_COLLECTION, PRODUCT_TOMBSTONE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Options that make two indexes with the same key pattern behave differently
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+INDEX_SPECS: dict[str, list[dict]] = {
+    'products': [
+        # get_product / update_product / delete_product
+        {'name': 'products_id_unique', 'keys': [('id', ASCENDING)], 'unique': True},
+        # get_products: is_active filter + name / newest sorts (id tiebreaker).
+        # name_desc and oldest flip the tiebreaker too (see sort_options in
+        # app.py), so they walk the same indexes backwards
+        {'name': 'products_active_name', 'keys': [
+            ('is_active', ASCENDING), ('name', ASCENDING), ('id', ASCENDING)]},
+        {'name': 'products_active_created', 'keys': [
+            ('is_active', ASCENDING), ('created_at', DESCENDING), ('id', ASCENDING)]},
+        # get_products?category_id=
+        {'name': 'products_active_category_name', 'keys': [
+            ('is_active', ASCENDING), ('category_id', ASCENDING),
+            ('name', ASCENDING), ('id', ASCENDING)]},
+        {'name': 'products_active_category_created', 'keys': [
+            ('is_active', ASCENDING), ('category_id', ASCENDING),
+            ('created_at', DESCENDING), ('id', ASCENDING)]},
+        # get_products?main_category_name=
+        {'name': 'products_main_name_active_name', 'keys': [
+            ('main_category_name', ASCENDING), ('is_active', ASCENDING),
+            ('name', ASCENDING), ('id', ASCENDING)]},
+        {'name': 'products_main_name_active_created', 'keys': [
+            ('main_category_name', ASCENDING), ('is_active', ASCENDING),
+            ('created_at', DESCENDING), ('id', ASCENDING)]},
+        # get_products_by_main_category (unknown slugs) and legacy slug lookups
+        {'name': 'products_main_slug_active_name', 'keys': [
+            ('main_category_slug', ASCENDING), ('is_active', ASCENDING),
+            ('name', ASCENDING), ('id', ASCENDING)]},
+        # get_products_by_main_category and delete_category: one equality on the
+        # canonical main_category_id (see migrate_category_fields.py)
+        {'name': 'products_main_id_active_name', 'keys': [
+            ('main_category_id', ASCENDING), ('is_active', ASCENDING),
+            ('name', ASCENDING), ('id', ASCENDING)]},
+        {'name': 'products_main_id_active_created', 'keys': [
+            ('main_category_id', ASCENDING), ('is_active', ASCENDING),
+            ('created_at', DESCENDING), ('id', ASCENDING)]},
+        # get_products?material=&color=&size= (multikey, see product_facets.py)
+        {'name': 'products_facet_material_active', 'keys': [
+            ('facets.material', ASCENDING), ('is_active', ASCENDING)]},
+        {'name': 'products_facet_color_active', 'keys': [
+            ('facets.color', ASCENDING), ('is_active', ASCENDING)]},
+        {'name': 'products_facet_size_active', 'keys': [
+            ('facets.size', ASCENDING), ('is_active', ASCENDING)]},
+        # get_products?palette= (colors from the photos, see product_colors.py)
+        {'name': 'products_palette_active', 'keys': [
+            ('color_palette.names', ASCENDING), ('is_active', ASCENDING)]},
+        # Category rename propagation walks a category's products in _id order
+        # (see category_fanout.py); delete_category counts a sub-category's products
+        {'name': 'products_category_id', 'keys': [('category_id', ASCENDING), ('_id', ASCENDING)]},
+        {'name': 'products_main_id', 'keys': [('main_category_id', ASCENDING), ('_id', ASCENDING)]},
+        # Incremental search index refresh (product_search.py)
+        {'name': 'products_updated_at', 'keys': [('updated_at', ASCENDING)]},
+        # get_product_by_slug: one $in over precomputed keys (see product_slugs.py)
+        {'name': 'products_slug_keys_active', 'keys': [
+            ('slug_keys', ASCENDING), ('is_active', ASCENDING)]},
+    ],
+    'categories': [
+        {'name': 'categories_id_unique', 'keys': [('id', ASCENDING)], 'unique': True},
+        {'name': 'categories_type_name', 'keys': [('type', ASCENDING), ('name', ASCENDING)]},
+        {'name': 'categories_main_type_name', 'keys': [
+            ('main_category_id', ASCENDING), ('type', ASCENDING), ('name', ASCENDING)]},
+        {'name': 'categories_slug', 'keys': [('slug', ASCENDING)]},
+    ],
+    'users': [
+        {'name': 'users_username_unique', 'keys': [('username', ASCENDING)], 'unique': True},
+        {'name': 'users_email', 'keys': [('email', ASCENDING)]},
+    ],
+    'rfq_requests': [
+        {'name': 'rfq_id_unique', 'keys': [('id', ASCENDING)], 'unique': True},
+        {'name': 'rfq_status_created', 'keys': [('status', ASCENDING), ('created_at', DESCENDING)]},
+        {'name': 'rfq_created', 'keys': [('created_at', DESCENDING)]},
+    ],
+    'slug_history': [
+        {'name': 'slug_history_key_unique', 'keys': [('key', ASCENDING)], 'unique': True},
+        {'name': 'slug_history_product', 'keys': [('product_id', ASCENDING)]},
+        # SlugHistory.sync catch-up, and expiry of released entries (product_slugs.py)
+        {'name': 'slug_history_updated_at', 'keys': [('updated_at', ASCENDING)]},
+        {'name': 'slug_history_released_ttl', 'keys': [('released_at', ASCENDING)],
+         'expireAfterSeconds': SLUG_HISTORY_RELEASED_TTL_SECONDS},
+    ],
+    'category_jobs': [
+        {'name': 'category_jobs_id_unique', 'keys': [('id', ASCENDING)], 'unique': True},
+        # CategoryFanout._claim and recent_jobs
+        {'name': 'category_jobs_status_created', 'keys': [('status', ASCENDING), ('created_at', ASCENDING)]},
+        {'name': 'category_jobs_category_status', 'keys': [('category_id', ASCENDING), ('status', ASCENDING)]},
+    ],
+    # Catch-up reads of deletions by the catalog engine (product_tombstones.py)
+    PRODUCT_TOMBSTONES_COLLECTION: [
+        {'name': 'product_tombstones_deleted_at_ttl', 'keys': [('deleted_at', ASCENDING)],
+         'expireAfterSeconds': PRODUCT_TOMBSTONE_TTL_SECONDS},
+    ],
+    'media_pages': [
+        {'name': 'media_pages_slug', 'keys': [('slug', ASCENDING)]},
+    ],
+}
+
+_sync_thread = None
+
+
+def _spec_options(spec: dict) -> dict:
+    return {k: spec[k] for k in COMPARED_OPTIONS if k in spec}
+
+
+def _existing_options(index: dict) -> dict:
+    return {k: index[k] for k in COMPARED_OPTIONS if k in index and index[k] not in (False, None)}
+
+
+def _key_list(key_doc) -> list[tuple]:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in key_doc.items()]
+
+
+def plan_collection(collection, specs: list[dict]) -> dict:
+    """
+    Compare declared specs against the indexes that exist on a collection.
+    Returns {missing, divergent, extra, ok} lists of index descriptions.
+    """
+    existing = {index['name']: index for index in collection.list_indexes()}
+    existing_by_keys = {tuple(_key_list(index['key'])): index for index in existing.values()}
+
+    plan = {'missing': [], 'divergent': [], 'extra': [], 'ok': []}
+    declared_names = set()
+
+    for spec in specs:
+        keys = [(field, direction) for field, direction in spec['keys']]
+        declared_names.add(spec['name'])
+        current = existing.get(spec['name']) or existing_by_keys.get(tuple(keys))
+
+        if current is None:
+            plan['missing'].append(spec)
+            continue
+
+        declared_names.add(current['name'])
+        differences = []
+        if _key_list(current['key']) != keys:
+            differences.append(f"keys {_key_list(current['key'])} != {keys}")
+        if _existing_options(current) != _spec_options(spec):
+            differences.append(f"options {_existing_options(current)} != {_spec_options(spec)}")
+        if current['name'] != spec['name']:
+            differences.append(f"named {current['name']!r}")
+
+        if differences:
+            plan['divergent'].append({'spec': spec, 'existing': current['name'], 'differences': differences})
+        else:
+            plan['ok'].append(spec)
+
+    for name, index in existing.items():
+        if name == '_id_' or name in declared_names:
+            continue
+        plan['extra'].append({'name': name, 'keys': _key_list(index['key'])})
+
+    return plan
+
+
+def create_missing(collection, plan: dict) -> dict:
+    """Create every missing index in a plan. Never raises."""
+    created = 0
+    failed = 0
+    for spec in plan['missing']:
+        options = _spec_options(spec)
+        try:
+            collection.create_index(spec['keys'], name=spec['name'], background=True, **options)
+            created += 1
+            logger.info('Created index %s.%s', collection.name, spec['name'])
+        except (OperationFailure, PyMongoError) as exc:
+            failed += 1
+            logger.error('Index build failed for %s.%s: %s', collection.name, spec['name'], exc)
+    return {'created': created, 'failed': failed}
+
+
+def sync_indexes(db, collections: list[str] | None = None, apply: bool = True) -> dict:
+    """
+    Reconcile INDEX_SPECS against the database.
+    Missing indexes are created when apply=True; divergent and extra indexes
+    are only reported, never dropped.
+    """
+    report = {}
+    for collection_name, specs in INDEX_SPECS.items():
+        if collections and collection_name not in collections:
+            continue
+        collection = db[collection_name]
+        try:
+            plan = plan_collection(collection, specs)
+        except PyMongoError as exc:
+            logger.error('Could not list indexes for %s: %s', collection_name, exc)
+            report[collection_name] = {'error': str(exc)}
+            continue
+
+        result = {'missing': [spec['name'] for spec in plan['missing']],
+                  'divergent': plan['divergent'],
+                  'extra': plan['extra'],
+                  'ok': [spec['name'] for spec in plan['ok']]}
+        if apply and plan['missing']:
+            result.update(create_missing(collection, plan))
+        for item in plan['divergent']:
+            logger.warning('Divergent index on %s: %s (%s)', collection_name,
+                           item['spec']['name'], '; '.join(item['differences']))
+        for item in plan['extra']:
+            logger.warning('Undeclared index on %s: %s', collection_name, item['name'])
+        report[collection_name] = result
+    return report
+
+
+def start_index_sync(db) -> threading.Thread | None:
+    """
+    Run sync_indexes on a daemon thread so app boot never waits on index builds.
+    Disabled with AUTO_SYNC_INDEXES=false.
+    """
+    global _sync_thread
+    if os.getenv('AUTO_SYNC_INDEXES', 'true').lower() not in ('1', 'true', 'yes'):
+        return None
+    if _sync_thread is not None and _sync_thread.is_alive():
+        return _sync_thread
+
+    def run():
+        try:
+            sync_indexes(db, apply=True)
+        except Exception as exc:
+            logger.error('Background index sync failed: %s', exc)
+
+    _sync_thread = threading.Thread(target=run, name='index-sync', daemon=True)
+    _sync_thread.start()
+    return _sync_thread
+
+
+def main():
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    root = Path(__file__).resolve().parent
+    for env_name in ('env.development', '.env', 'env.production'):
+        env_path = root / env_name
+        if env_path.exists():
+            load_dotenv(env_path)
+            break
+    else:
+        load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Reconcile MongoDB indexes with INDEX_SPECS')
+    parser.add_argument('--apply', action='store_true',
+                        help='Create missing indexes. Without this flag, report only.')
+    parser.add_argument('--collection', action='append',
+                        help='Limit to one collection (repeatable)')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI is required')
+        sys.exit(1)
+
+    client = MongoClient(mongo_uri)
+    db = client[os.getenv('DB_NAME', 'outre_couture')]
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    report = sync_indexes(db, collections=args.collection, apply=args.apply)
+    client.close()
+
+    for collection_name, result in report.items():
+        print(f'\n{collection_name}')
+        if 'error' in result:
+            print(f"  ❌ {result['error']}")
+            continue
+        for name in result['ok']:
+            print(f'  ✓ {name}')
+        for name in result['missing']:
+            print(f"  {'+ created' if args.apply else '+ missing'} {name}")
+        for item in result['divergent']:
+            print(f"  ! divergent {item['spec']['name']}: {'; '.join(item['differences'])}")
+        for item in result['extra']:
+            print(f"  ? extra {item['name']} {item['keys']}")
+        if result.get('failed'):
+            print(f"  ❌ {result['failed']} index build(s) failed (see log)")
+
+    if not args.apply:
+        print('\nDry-run complete. Re-run with --apply to create missing indexes.')
+
+
+if __name__ == '__main__':
+    main()
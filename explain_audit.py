@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Replay the query shapes issued by app.py route handlers (finds, counts and
+aggregations) through explain('executionStats') and flag collection scans,
+in-memory sorts and queries that examine far more documents than they return.
+
+Representative parameters (a category id, a main category slug, a product
+slug, a search term) are sampled from the configured database so the plans
+reflect real data.
+
+Usage:
+  # JSON report on stdout
+  python explain_audit.py
+
+  # Write the report to a file and exit non-zero on any COLLSCAN
+  python explain_audit.py --output explain_report.json --fail-on-collscan
+
+  # Only shapes for one endpoint
+  python explain_audit.py --endpoint get_products
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from bson import SON  # noqa: E402
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from pagination import keyset_filter  # noqa: E402
+from product_facets import facet_pipeline, facet_query  # noqa: E402
+from product_slugs import candidate_keys  # noqa: E402
+
+# Flag a plan when it examines this many documents per document returned
+DEFAULT_EXAMINED_RATIO = 10
+
+# As in app.py: id breaks ties, flipped along with name_desc / oldest
+SORT_OPTIONS = {
+    'name': [('name', 1), ('id', 1)],
+    'name_desc': [('name', -1), ('id', -1)],
+    'newest': [('created_at', -1), ('id', 1)],
+    'oldest': [('created_at', 1), ('id', -1)],
+}
+
+
+def regex_or(term: str, fields: list[str]) -> list[dict]:
+    return [{field: {'$regex': term, '$options': 'i'}} for field in fields]
+
+
+def sample_parameters(db) -> dict:
+    """Pick representative route parameters from live data."""
+    products = db['products']
+    categories = db['categories']
+
+    product = products.find_one(
+        {'is_active': True, 'seo_slug': {'$exists': True}},
+        {'_id': 0, 'id': 1, 'seo_slug': 1, 'name': 1, 'created_at': 1, 'category_id': 1,
+         'main_category_id': 1, 'main_category_slug': 1, 'main_category_name': 1, 'facets': 1},
+    ) or {}
+    main_category = categories.find_one({'type': 'main'}, {'_id': 0}) or {}
+    sub_category = categories.find_one({'type': 'sub'}, {'_id': 0}) or {}
+
+    name_words = re.findall(r'[A-Za-z]{4,}', product.get('name') or '')
+    materials = (product.get('facets') or {}).get('material') or []
+    main_slug = product.get('main_category_slug') or main_category.get('slug') or 'women'
+
+    return {
+        'product_id': product.get('id') or 'missing-product-id',
+        'seo_slug': product.get('seo_slug') or 'missing-slug',
+        'category_id': product.get('category_id') or sub_category.get('id') or 'missing-category-id',
+        'main_category_slug': main_slug,
+        'main_category_name': product.get('main_category_name') or main_category.get('name') or 'Women',
+        'main_category_id': product.get('main_category_id') or main_category.get('id') or 'missing-main-id',
+        'sub_category_id': sub_category.get('id') or 'missing-sub-id',
+        'search': (name_words[0] if name_words else 'dress').lower(),
+        'name': product.get('name') or 'Dress',
+        'created_at': product.get('created_at') or datetime.utcnow().isoformat(),
+        'material': materials[0] if materials else 'cotton',
+    }
+
+
+def query_shapes(params: dict) -> list[dict]:
+    """Every query issued by the app's route handlers, with sample parameters."""
+    search_fields = ['name', 'description', 'seo_keywords', 'seo_title']
+    shapes = []
+    # Keyset cursors resume after the sampled product (see pagination.py)
+    cursor_values = {'name': params['name'], 'created_at': params['created_at']}
+
+    # get_products
+    for sort_by, sort in SORT_OPTIONS.items():
+        shapes.append({'endpoint': 'get_products', 'shape': f'active sort={sort_by}',
+                       'collection': 'products', 'op': 'find',
+                       'filter': {'is_active': True}, 'sort': sort, 'limit': 50})
+    shapes.append({'endpoint': 'get_products', 'shape': 'active count',
+                   'collection': 'products', 'op': 'count', 'filter': {'is_active': True}})
+    for sort_by, sort in SORT_OPTIONS.items():
+        shapes.append({'endpoint': 'get_products', 'shape': f'category_id sort={sort_by}',
+                       'collection': 'products', 'op': 'find',
+                       'filter': {'is_active': True, 'category_id': params['category_id']},
+                       'sort': sort, 'limit': 50})
+    shapes.append({'endpoint': 'get_products', 'shape': 'category_id count',
+                   'collection': 'products', 'op': 'count',
+                   'filter': {'is_active': True, 'category_id': params['category_id']}})
+    for sort_by, sort in SORT_OPTIONS.items():
+        shapes.append({'endpoint': 'get_products', 'shape': f'main_category_name sort={sort_by}',
+                       'collection': 'products', 'op': 'find',
+                       'filter': {'is_active': True, 'main_category_name': params['main_category_name']},
+                       'sort': sort, 'limit': 50})
+    shapes.append({'endpoint': 'get_products', 'shape': 'main_category_name count',
+                   'collection': 'products', 'op': 'count',
+                   'filter': {'is_active': True, 'main_category_name': params['main_category_name']}})
+    # ?cursor=: the listing filter AND the keyset $or range
+    for sort_by, sort in SORT_OPTIONS.items():
+        cursor = {'v': cursor_values[sort[0][0]], 'i': params['product_id']}
+        shapes.append({'endpoint': 'get_products', 'shape': f'active cursor sort={sort_by}',
+                       'collection': 'products', 'op': 'find',
+                       'filter': {'$and': [{'is_active': True}, keyset_filter(cursor, sort)]},
+                       'sort': sort, 'limit': 50})
+    # ?material= facet filter, and ?include_facets=true counts
+    selected = {'material': [params['material']]}
+    facet_filter = {'is_active': True, **facet_query(selected)}
+    shapes.append({'endpoint': 'get_products', 'shape': 'facet material sort=name',
+                   'collection': 'products', 'op': 'find', 'filter': facet_filter,
+                   'sort': SORT_OPTIONS['name'], 'limit': 50})
+    shapes.append({'endpoint': 'get_products', 'shape': 'facet material count',
+                   'collection': 'products', 'op': 'count', 'filter': facet_filter})
+    shapes.append({'endpoint': 'get_products', 'shape': 'facet counts aggregation',
+                   'collection': 'products', 'op': 'aggregate',
+                   'pipeline': facet_pipeline({'is_active': True}, selected)})
+    shapes.append({'endpoint': 'get_products', 'shape': 'facet counts over search ids',
+                   'collection': 'products', 'op': 'aggregate',
+                   'pipeline': facet_pipeline({'id': {'$in': [params['product_id']]}}, {})})
+    # Pages answered by the search index or the listing engine are read by id
+    shapes.append({'endpoint': 'get_products', 'shape': 'page by ids',
+                   'collection': 'products', 'op': 'find',
+                   'filter': {'id': {'$in': [params['product_id']]}}})
+    search_query = {'is_active': True, '$or': regex_or(params['search'], search_fields)}
+    shapes.append({'endpoint': 'get_products', 'shape': 'search regex',
+                   'collection': 'products', 'op': 'find', 'filter': search_query,
+                   'sort': SORT_OPTIONS['name'], 'limit': 50})
+    shapes.append({'endpoint': 'get_products', 'shape': 'search regex count',
+                   'collection': 'products', 'op': 'count', 'filter': search_query})
+
+    # get_products_by_main_category: the slug resolves to a main category id in memory
+    main_slug = params['main_category_slug']
+    main_match = {'main_category_id': params['main_category_id']}
+    main_query = {'$and': [main_match, {'is_active': True}]}
+    for sort_by, sort in SORT_OPTIONS.items():
+        shapes.append({'endpoint': 'get_products_by_main_category', 'shape': f'main_category_id sort={sort_by}',
+                       'collection': 'products', 'op': 'find', 'filter': main_query,
+                       'sort': sort, 'limit': 50})
+    shapes.append({'endpoint': 'get_products_by_main_category', 'shape': 'main_category_id count',
+                   'collection': 'products', 'op': 'count', 'filter': main_query})
+    for sort_by, sort in SORT_OPTIONS.items():
+        cursor = {'v': cursor_values[sort[0][0]], 'i': params['product_id']}
+        shapes.append({'endpoint': 'get_products_by_main_category', 'shape': f'main_category_id cursor sort={sort_by}',
+                       'collection': 'products', 'op': 'find',
+                       'filter': {'$and': [main_query, keyset_filter(cursor, sort)]},
+                       'sort': sort, 'limit': 50})
+    shapes.append({'endpoint': 'get_products_by_main_category', 'shape': 'sub_category_id + search',
+                   'collection': 'products', 'op': 'find',
+                   'filter': {'$and': [main_match, {'is_active': True},
+                                       {'category_id': params['sub_category_id']},
+                                       {'$or': regex_or(params['search'], ['name', 'description'])}]},
+                   'sort': SORT_OPTIONS['name'], 'limit': 50})
+
+    # get_product / update_product / delete_product
+    shapes.append({'endpoint': 'get_product', 'shape': 'by id',
+                   'collection': 'products', 'op': 'find', 'filter': {'id': params['product_id']}, 'limit': 1})
+
+    # get_product_by_slug: one $in over precomputed slug keys
+    shapes.append({'endpoint': 'get_product_by_slug', 'shape': 'slug_keys $in',
+                   'collection': 'products', 'op': 'find',
+                   'filter': {'slug_keys': {'$in': candidate_keys(main_slug, params['seo_slug'])},
+                              'is_active': True}})
+
+    # Category lookups are served from the in-memory tree (category_tree.py),
+    # loaded with one deliberate full read of the small categories collection
+
+    # delete_category: products not yet migrated (migrate_category_fields.py)
+    # are probed by their legacy slug/name fields too
+    legacy_probe = {'$or': [
+        {'main_category_id': params['main_category_id']},
+        {'main_category_slug': main_slug},
+        {'main_category_name': params['main_category_name']},
+        {'category_id': {'$in': [params['sub_category_id']]}},
+    ]}
+    shapes.extend([
+        {'endpoint': 'delete_category', 'shape': 'main: legacy $or probe',
+         'collection': 'products', 'op': 'find', 'limit': 1, 'filter': legacy_probe},
+        {'endpoint': 'delete_category', 'shape': 'main: legacy $or count',
+         'collection': 'products', 'op': 'count', 'filter': legacy_probe},
+        {'endpoint': 'delete_category', 'shape': 'sub: products by category_id',
+         'collection': 'products', 'op': 'count', 'filter': {'category_id': params['sub_category_id']}},
+    ])
+
+    # Users / RFQ
+    shapes.extend([
+        {'endpoint': 'login', 'shape': 'user by username',
+         'collection': 'users', 'op': 'find', 'limit': 1, 'filter': {'username': 'admin'}},
+        {'endpoint': 'register', 'shape': 'user by username or email',
+         'collection': 'users', 'op': 'find', 'limit': 1,
+         'filter': {'$or': [{'username': 'admin'}, {'email': 'admin@example.com'}]}},
+        {'endpoint': 'get_rfq_requests', 'shape': 'status sorted by created_at',
+         'collection': 'rfq_requests', 'op': 'find', 'filter': {'status': 'new'},
+         'sort': [('created_at', -1)], 'limit': 50},
+        {'endpoint': 'get_rfq_requests', 'shape': 'status count',
+         'collection': 'rfq_requests', 'op': 'count', 'filter': {'status': 'new'}},
+    ])
+
+    return shapes
+
+
+def explain_command(shape: dict) -> SON:
+    if shape['op'] == 'count':
+        return SON([('count', shape['collection']), ('query', shape['filter'])])
+    if shape['op'] == 'aggregate':
+        return SON([('aggregate', shape['collection']), ('pipeline', shape['pipeline']),
+                    ('cursor', {})])
+
+    command = SON([('find', shape['collection']), ('filter', shape['filter']),
+                   ('projection', {'_id': 0})])
+    if shape.get('sort'):
+        command['sort'] = SON(shape['sort'])
+    if shape.get('skip'):
+        command['skip'] = shape['skip']
+    if shape.get('limit'):
+        command['limit'] = shape['limit']
+    return command
+
+
+def walk_stages(plan: dict) -> list[dict]:
+    """Flatten a winning plan into [{stage, index?}], root first."""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop(0)
+        if not isinstance(node, dict):
+            continue
+        if 'queryPlan' in node:  # slot-based engine wraps the classic tree
+            pending.insert(0, node['queryPlan'])
+            continue
+        if 'stage' in node:
+            entry = {'stage': node['stage']}
+            if node.get('indexName'):
+                entry['index'] = node['indexName']
+            stages.append(entry)
+        if 'inputStage' in node:
+            pending.append(node['inputStage'])
+        pending.extend(node.get('inputStages') or [])
+    return stages
+
+
+def summarize(shape: dict, explain: dict, examined_ratio: int) -> dict:
+    if 'stages' in explain:
+        # Classic aggregation explain: the query part is the leading $cursor stage
+        explain = explain['stages'][0].get('$cursor', {}) if explain['stages'] else {}
+    stats = explain.get('executionStats') or {}
+    planner = explain.get('queryPlanner') or {}
+    stages = walk_stages(planner.get('winningPlan') or {})
+    stage_names = [entry['stage'] for entry in stages]
+
+    returned = stats.get('nReturned', 0)
+    docs_examined = stats.get('totalDocsExamined', 0)
+    keys_examined = stats.get('totalKeysExamined', 0)
+
+    warnings = []
+    if 'COLLSCAN' in stage_names:
+        warnings.append('COLLSCAN')
+    if 'SORT' in stage_names:
+        warnings.append('SORT_IN_MEMORY')
+    if docs_examined > max(returned, 1) * examined_ratio:
+        warnings.append('HIGH_EXAMINED_RATIO')
+
+    return {
+        'endpoint': shape['endpoint'],
+        'shape': shape['shape'],
+        'collection': shape['collection'],
+        'op': shape['op'],
+        'n_returned': returned,
+        'docs_examined': docs_examined,
+        'keys_examined': keys_examined,
+        'execution_ms': stats.get('executionTimeMillis', 0),
+        'indexes_used': sorted({entry['index'] for entry in stages if 'index' in entry}),
+        'stages': stages,
+        'warnings': warnings,
+    }
+
+
+def run_audit(db, endpoint: str | None = None, examined_ratio: int = DEFAULT_EXAMINED_RATIO) -> dict:
+    params = sample_parameters(db)
+    results = []
+    for shape in query_shapes(params):
+        if endpoint and shape['endpoint'] != endpoint:
+            continue
+        try:
+            explain = db.command('explain', explain_command(shape), verbosity='executionStats')
+            results.append(summarize(shape, explain, examined_ratio))
+        except PyMongoError as exc:
+            results.append({'endpoint': shape['endpoint'], 'shape': shape['shape'],
+                            'collection': shape['collection'], 'op': shape['op'],
+                            'error': str(exc), 'warnings': ['EXPLAIN_FAILED']})
+
+    return {
+        'generated_at': datetime.utcnow().isoformat(),
+        'database': db.name,
+        'parameters': params,
+        'summary': {
+            'shapes': len(results),
+            'collscans': sum('COLLSCAN' in r['warnings'] for r in results),
+            'in_memory_sorts': sum('SORT_IN_MEMORY' in r['warnings'] for r in results),
+            'high_examined_ratio': sum('HIGH_EXAMINED_RATIO' in r['warnings'] for r in results),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Explain every app.py query shape and flag bad plans')
+    parser.add_argument('--endpoint', help='Only audit shapes for this route handler')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+    parser.add_argument('--examined-ratio', type=int, default=DEFAULT_EXAMINED_RATIO,
+                        help='Flag plans examining more than N docs per doc returned')
+    parser.add_argument('--fail-on-collscan', action='store_true',
+                        help='Exit with status 2 if any shape uses a collection scan')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI is required', file=sys.stderr)
+        sys.exit(1)
+
+    client = MongoClient(mongo_uri)
+    db = client[os.getenv('DB_NAME', 'outre_couture')]
+    try:
+        report = run_audit(db, endpoint=args.endpoint, examined_ratio=args.examined_ratio)
+    finally:
+        client.close()
+
+    body = json.dumps(report, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(body + '\n', encoding='utf-8')
+        summary = report['summary']
+        print(f"✓ {summary['shapes']} shapes explained -> {args.output} "
+              f"({summary['collscans']} COLLSCAN, {summary['in_memory_sorts']} in-memory sorts)",
+              file=sys.stderr)
+    else:
+        print(body)
+
+    if args.fail_on_collscan and report['summary']['collscans']:
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Extract dominant colors from product photos (color_palette, ?palette= facet).
+
+Reads each product's first image from S3, clusters its pixels with k-means
+in a process pool (see product_colors.py) and stores the palette on the
+product. Only products whose first image has no palette yet are processed,
+so re-runs pick up new products and changed images; --full redoes all.
+Prints throughput in products per second. With --watch it keeps running
+as a background worker, checking for changed products every N seconds.
+
+Safe default is dry-run (images are still analysed, nothing is written).
+
+Usage:
+  # Preview palettes for products that need one
+  python extract_product_colors.py --limit 20
+
+  # Store palettes for new/changed products
+  python extract_product_colors.py --apply
+
+  # Re-extract every product with 8 processes
+  python extract_product_colors.py --full --workers 8 --apply
+
+  # Background worker
+  python extract_product_colors.py --apply --watch 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient, UpdateOne  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from product_colors import PALETTE_FIELD, extract_palette, needs_palette  # noqa: E402
+from product_images import s3_client  # noqa: E402
+
+WRITE_BATCH_SIZE = 200
+
+
+def run_once(db, args) -> int:
+    """One pass over the catalog; returns the number of palettes written."""
+    products = db['products']
+    candidates = products.find({}, {'_id': 0, 'id': 1, 'name': 1, 'images': 1, f'{PALETTE_FIELD}.source': 1})
+    tasks = [(product['id'], product['images'][0]) for product in candidates
+             if product.get('images') and (args.full or needs_palette(product))]
+    if args.limit:
+        tasks = tasks[:args.limit]
+    if not tasks:
+        print('✓ Every product image already has a palette')
+        return 0
+
+    print(f'Extracting {len(tasks)} palettes with {args.workers} processes...')
+    started = time.perf_counter()
+    operations, failed, shown = [], 0, 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for product_id, url, palette, error in pool.map(extract_palette, tasks, chunksize=4):
+            if palette is None:
+                failed += 1
+                print(f'  ❌ {product_id}: {error}')
+                continue
+            if shown < args.show:
+                shown += 1
+                swatches = ', '.join(f"{color['name']} {color['hex']} {color['share']:.0%}"
+                                     for color in palette['colors'])
+                print(f'  {product_id}: {swatches}')
+            # Matching the first image skips products whose image changed meanwhile
+            # updated_at lets cache catch-ups (engine, search, snapshot) see it
+            operations.append(UpdateOne(
+                {'id': product_id, 'images.0': url},
+                {'$set': {PALETTE_FIELD: palette, 'updated_at': datetime.utcnow().isoformat()}}))
+    elapsed = time.perf_counter() - started
+
+    extracted = len(tasks) - failed
+    print(f'✓ {extracted} palettes in {elapsed:.1f}s '
+          f'({extracted / elapsed if elapsed else 0:.1f} products/sec), {failed} failed')
+
+    if not args.apply:
+        print('Re-run with --apply to store them.')
+        return 0
+    written = 0
+    for start in range(0, len(operations), WRITE_BATCH_SIZE):
+        result = products.bulk_write(operations[start:start + WRITE_BATCH_SIZE], ordered=False)
+        written += result.modified_count
+    print(f'✓ Stored {written} palettes')
+    if written:
+        version = CatalogVersion(db['catalog_meta']).bump()
+        print(f'✓ Catalog version bumped to {version}')
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract dominant colors from product images')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    parser.add_argument('--full', action='store_true',
+                        help='Re-extract every product, not only new or changed images')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('PALETTE_WORKERS', os.cpu_count() or 2)),
+                        help='Worker processes (default: PALETTE_WORKERS or CPU count)')
+    parser.add_argument('--limit', type=int, default=0, help='Process at most N products')
+    parser.add_argument('--show', type=int, default=5, help='Palettes to print (default: 5)')
+    parser.add_argument('--watch', type=float, default=0,
+                        help='Keep running, checking for new/changed products every N seconds')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    if s3_client() is None:
+        print('❌ AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_S3_BUCKET are required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    print()
+
+    while True:
+        try:
+            run_once(db, args)
+        except PyMongoError as exc:
+            print(f'❌ Palette extraction failed: {exc}')
+            if not args.watch:
+                sys.exit(1)
+        if not args.watch:
+            break
+        args.full = False
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Find near-duplicate product photos under the products/ S3 prefix.
+
+Every object is perceptually hashed (pHash + dHash plus a colour layout,
+see image_hashing.py) in a process pool and the hashes are kept in the
+image_hashes collection, so re-runs only download objects that are new or
+whose ETag changed. Near-duplicates (re-uploads, re-encodes, resized
+copies; not recolourings, which differ in colour layout) are then grouped
+into clusters and reported with the products using each copy and the
+bytes the extra copies take.
+
+Only reads S3; nothing is deleted. Point the products at one copy, then
+let cleanup_orphan_product_images.py remove the rest.
+
+Usage:
+  # Hash new/changed objects and report clusters
+  python find_duplicate_images.py
+
+  # Stricter matching, 8 processes, show every cluster
+  python find_duplicate_images.py --max-distance 2 --workers 8 --show 0
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import DeleteMany, MongoClient, ReplaceOne  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from image_hashing import (  # noqa: E402
+    IMAGE_DUPLICATE_MAX_COLOR_DISTANCE, IMAGE_DUPLICATE_MAX_DISTANCE, IMAGE_HASHES_COLLECTION, clusters,
+    duplicate_pairs, hash_document, hash_object, to_array, to_color_array)
+from product_images import AWS_S3_BUCKET, s3_client, s3_key_from_url  # noqa: E402
+
+WRITE_BATCH_SIZE = 500
+
+
+def list_product_objects(s3) -> dict[str, dict]:
+    """{key: {etag, size}} for every object under products/."""
+    objects = {}
+    continuation = None
+    while True:
+        kwargs = {'Bucket': AWS_S3_BUCKET, 'Prefix': 'products/'}
+        if continuation:
+            kwargs['ContinuationToken'] = continuation
+        response = s3.list_objects_v2(**kwargs)
+        for item in response.get('Contents') or []:
+            if item['Key'].endswith('/'):
+                continue
+            objects[item['Key']] = {'etag': (item.get('ETag') or '').strip('"'), 'size': item.get('Size', 0)}
+        if not response.get('IsTruncated'):
+            break
+        continuation = response.get('NextContinuationToken')
+    return objects
+
+
+def refresh_hashes(collection, objects: dict[str, dict], workers: int):
+    """Hash new or changed objects (or ones without a colour layout yet) and forget deleted ones."""
+    stored = {doc['_id']: doc for doc in collection.find({}, {'etag': 1, 'color': 1})}
+    tasks = [(key, meta['etag'], meta['size']) for key, meta in objects.items()
+             if key not in stored or stored[key].get('etag') != meta['etag'] or not stored[key].get('color')]
+    removed = [key for key in stored if key not in objects]
+    print(f'✓ {len(objects)} objects under products/, {len(tasks)} to hash, {len(removed)} gone')
+
+    operations, failed = [], 0
+    if tasks:
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for key, etag, size, hashes, error in pool.map(hash_object, tasks, chunksize=8):
+                if hashes is None:
+                    failed += 1
+                    print(f'  ❌ {key}: {error}')
+                    continue
+                operations.append(ReplaceOne({'_id': key}, hash_document(hashes, etag, size), upsert=True))
+        elapsed = time.perf_counter() - started
+        print(f'✓ Hashed {len(operations)} images in {elapsed:.1f}s '
+              f'({len(operations) / elapsed if elapsed else 0:.1f} images/sec), {failed} failed')
+    if removed:
+        operations.append(DeleteMany({'_id': {'$in': removed}}))
+    for start in range(0, len(operations), WRITE_BATCH_SIZE):
+        collection.bulk_write(operations[start:start + WRITE_BATCH_SIZE], ordered=False)
+
+
+def product_usage(products) -> dict[str, list[str]]:
+    """{S3 key: [product ids]} for every product image."""
+    usage: dict[str, list[str]] = {}
+    for product in products.find({}, {'_id': 0, 'id': 1, 'images': 1}):
+        for url in product.get('images') or []:
+            key = s3_key_from_url(url)
+            if key:
+                usage.setdefault(key, []).append(product['id'])
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find near-duplicate product images in S3')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                        help='Hashing processes (default: CPU count)')
+    parser.add_argument('--max-distance', type=int, default=IMAGE_DUPLICATE_MAX_DISTANCE,
+                        help=f'Max differing hash bits (default: {IMAGE_DUPLICATE_MAX_DISTANCE})')
+    parser.add_argument('--max-color-distance', type=float, default=IMAGE_DUPLICATE_MAX_COLOR_DISTANCE,
+                        help=f'Max colour layout difference (default: {IMAGE_DUPLICATE_MAX_COLOR_DISTANCE:g})')
+    parser.add_argument('--show', type=int, default=20, help='Clusters to print, largest first (0 = all)')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    s3 = s3_client()
+    if s3 is None:
+        print('❌ AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_S3_BUCKET are required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+    collection = db[IMAGE_HASHES_COLLECTION]
+
+    try:
+        refresh_hashes(collection, list_product_objects(s3), args.workers)
+        docs = list(collection.find({'phash': {'$exists': True}, 'color': {'$exists': True}},
+                                    {'phash': 1, 'dhash': 1, 'color': 1, 'size': 1}))
+        usage = product_usage(db['products'])
+    except PyMongoError as exc:
+        print(f'❌ Duplicate scan failed: {exc}')
+        sys.exit(1)
+
+    started = time.perf_counter()
+    pairs = duplicate_pairs(to_array(doc['phash'] for doc in docs), to_array(doc['dhash'] for doc in docs),
+                            to_color_array(doc['color'] for doc in docs), args.max_distance,
+                            args.max_color_distance)
+    groups = sorted(clusters(len(docs), pairs), key=len, reverse=True)
+    print(f'✓ Compared {len(docs)} images in {time.perf_counter() - started:.2f}s')
+    print()
+
+    wasted = 0
+    for number, group in enumerate(groups, start=1):
+        members = sorted((docs[index] for index in group), key=lambda doc: -len(usage.get(doc['_id'], [])))
+        wasted += sum(doc.get('size') or 0 for doc in members[1:])
+        if args.show and number > args.show:
+            continue
+        print(f'Cluster {number} ({len(members)} copies):')
+        for doc in members:
+            used_by = ', '.join(usage.get(doc['_id'], [])) or 'unreferenced'
+            print(f"  {doc['_id']}  {(doc.get('size') or 0) / 1024:.0f} KB  [{used_by}]")
+    if groups:
+        print()
+    print(f'✓ {len(groups)} duplicate clusters, {sum(len(group) - 1 for group in groups)} extra copies '
+          f'taking {wasted / (1024 * 1024):.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
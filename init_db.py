@@ -10,6 +10,9 @@ from datetime import datetime, timezone
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
+from product_facets import FACETS_FIELD, extract_facets
+from product_slugs import SLUG_KEYS_FIELD, sanitize_slug, slug_keys
+
 # Load environment variables
 load_dotenv()
 
@@ -231,6 +234,17 @@ def create_sample_products(main_category_ids):
     all_products = men_products + women_products + \
         accessories_products + bags_products
 
+    # Fill in the fields create_product derives, so category listings, slug
+    # URLs and facet filters see the sample products without any backfill
+    sub_categories_by_id = {cat['id']: cat for cat in sub_categories}
+    for product in all_products:
+        sub_category = sub_categories_by_id[product['category_id']]
+        product['main_category_id'] = sub_category['main_category_id']
+        product['main_category_slug'] = sub_category['main_category_slug']
+        product['seo_slug'] = sanitize_slug(product['name'])
+        product[SLUG_KEYS_FIELD] = slug_keys(product)
+        product[FACETS_FIELD] = extract_facets(product['specifications'])
+
     # Insert products
     for product in all_products:
         # Check if product already exists
@@ -0,0 +1,179 @@
+"""
+Cross-worker cache invalidation over a MongoDB capped collection.
+
+A product or category write is handled by one gunicorn worker; the others
+keep serving their in-process caches until they notice. Every write
+appends a small event to the capped `cache_invalidations` collection:
+
+  {origin, kind: 'product'|'category', op: 'upsert'|'delete',
+   id, keys: [...], version, at}
+
+and every worker tails that collection with a tailable, await-data cursor
+on a daemon thread, so events arrive within milliseconds and without
+polling. Events from the worker's own origin are skipped (it already
+applied the change). Capped collections and tailable cursors work on a
+single standalone mongod; no replica set is needed.
+
+If tailing fails (cursor killed, connection lost) the thread reconnects
+after a short pause and resumes after the last event it saw. It resumes by
+position, replaying the collection in natural (insertion) order and
+skipping up to that event: ObjectIds minted by different processes are not
+in insertion order, so an `_id > last` query could skip events. Caches stay
+correct even if events are lost, because they are versioned (see
+catalog_version.py); the bus only makes other workers notice sooner.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_COLLECTION = 'cache_invalidations'
+INVALIDATION_BUS_ENABLED = os.getenv('INVALIDATION_BUS_ENABLED', 'true').lower() != 'false'
+INVALIDATION_BUS_SIZE_BYTES = int(os.getenv('INVALIDATION_BUS_SIZE_BYTES', 1024 * 1024))
+INVALIDATION_BUS_MAX_EVENTS = int(os.getenv('INVALIDATION_BUS_MAX_EVENTS', 10000))
+
+RETRY_SECONDS = 1.0
+
+
+class InvalidationBus:
+    """Publish cache invalidation events and dispatch other workers' events to handlers."""
+
+    def __init__(self, db, collection_name: str = INVALIDATION_COLLECTION,
+                 size_bytes: int = INVALIDATION_BUS_SIZE_BYTES,
+                 max_events: int = INVALIDATION_BUS_MAX_EVENTS):
+        self.db = db
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.max_events = max_events
+        self.origin = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._handlers: list = []
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._last_id = None
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    def ensure_collection(self):
+        """Create the capped collection if it does not exist yet."""
+        if self.collection_name in self.db.list_collection_names():
+            return
+        try:
+            self.db.create_collection(
+                self.collection_name, capped=True, size=self.size_bytes, max=self.max_events)
+            logger.info('Created capped collection %s', self.collection_name)
+        except CollectionInvalid:
+            pass  # another worker created it first
+
+    def subscribe(self, handler):
+        """Call handler(event) for every event published by another worker."""
+        self._handlers.append(handler)
+
+    def publish(self, kind: str, op: str, entity_id: str | None = None,
+                keys: list | None = None, version: int | None = None):
+        """Append an event. Never raises: a lost event only delays invalidation."""
+        event = {
+            'origin': self.origin,
+            'kind': kind,
+            'op': op,
+            'id': entity_id,
+            'keys': keys or [],
+            'version': version,
+            'at': datetime.utcnow(),
+        }
+        try:
+            self.collection.insert_one(event)
+            self.published += 1
+        except PyMongoError as exc:
+            self.errors += 1
+            logger.error('Could not publish %s %s invalidation: %s', kind, op, exc)
+
+    def dispatch(self, event: dict):
+        """Hand an event to every handler, unless this worker published it."""
+        self._last_id = event.get('_id', self._last_id)
+        if event.get('origin') == self.origin:
+            return
+        self.received += 1
+        for handler in self._handlers:
+            try:
+                handler(event)
+            except Exception as exc:  # one bad handler must not stop the others
+                logger.error('Invalidation handler %r failed: %s', handler, exc)
+
+    def _resume_point(self):
+        if self._last_id is not None:
+            return self._last_id
+        latest = next(self.collection.find({}, {'_id': 1}).sort('$natural', -1).limit(1), None)
+        return latest['_id'] if latest else None
+
+    def _tail(self):
+        # Note: on an empty capped collection the cursor dies at once and
+        # _run retries after RETRY_SECONDS
+        last_id = self._resume_point()
+        cursor = self.collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+        # Events up to last_id were handled already; held back until it is
+        # found, in case it has been overwritten since (then all are new)
+        seen = [] if last_id is not None else None
+        while cursor.alive and not self._stop.is_set():
+            for event in cursor:
+                if seen is None:
+                    self.dispatch(event)
+                elif event['_id'] == last_id:
+                    seen = None
+                else:
+                    seen.append(event)
+            if seen is not None:
+                # Read to the end without meeting last_id: the capped
+                # collection wrapped past it, so everything left is newer
+                logger.warning('Invalidation bus resume point %s overwritten; replaying %d events',
+                               last_id, len(seen))
+                for event in seen:
+                    self.dispatch(event)
+                seen = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._tail()
+            except PyMongoError as exc:
+                self.errors += 1
+                logger.warning('Invalidation bus tail interrupted: %s', exc)
+            self._stop.wait(RETRY_SECONDS)
+
+    def start(self):
+        """Create the collection and start tailing it on a daemon thread."""
+        if self._thread is not None:
+            return
+        try:
+            self.ensure_collection()
+            self._last_id = self._resume_point()
+        except PyMongoError as exc:
+            logger.error('Invalidation bus unavailable: %s', exc)
+        self._thread = threading.Thread(target=self._run, name='invalidation-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        return {
+            'origin': self.origin,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'published': self.published,
+            'received': self.received,
+            'errors': self.errors,
+        }
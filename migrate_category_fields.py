@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Backfill canonical main-category fields on every product.
+
+Older products (e.g. init_db.py samples seeded before it set these) lack
+main_category_slug or carry names such as "WOMEN'S", which is why the
+category listing used to match on several fields at once (delete_category
+still probes them until every product is migrated). This migration
+resolves each product's main category (through its sub-category first, see
+CategoryTree.main_for_product) and writes main_category_id,
+main_category_slug, main_category_name and the matching slug_keys, so the
+read paths can filter with one indexed equality on main_category_id.
+
+Products are processed in _id order in batches, each written with one
+bulk_write. Progress is checkpointed in the `migrations` collection after
+every batch, so an interrupted run resumes where it stopped. Products whose
+fields are already canonical are skipped.
+
+Safe default is dry-run.
+
+Usage:
+  # Preview
+  python migrate_category_fields.py
+
+  # Migrate (resumes from the last checkpoint)
+  python migrate_category_fields.py --apply
+
+  # Start over from the first product
+  python migrate_category_fields.py --apply --restart
+
+  # Smaller write batches
+  python migrate_category_fields.py --apply --batch-size 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient, UpdateOne  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from category_tree import CategoryTree  # noqa: E402
+from product_slugs import SLUG_KEYS_FIELD, slug_keys  # noqa: E402
+
+MIGRATION_ID = 'category_fields'
+
+PROJECTION = {'_id': 1, 'id': 1, 'name': 1, 'seo_slug': 1, 'category_id': 1, 'main_category_id': 1,
+              'main_category_slug': 1, 'main_category_name': 1, SLUG_KEYS_FIELD: 1}
+
+
+def canonical_fields(tree: CategoryTree, product: dict) -> dict | None:
+    """Fields to $set on a product, {} when already canonical, None when unresolvable."""
+    main = tree.main_for_product(product)
+    if main is None:
+        return None
+    fields = {
+        'main_category_id': main['id'],
+        'main_category_slug': main.get('slug'),
+        'main_category_name': main.get('name'),
+    }
+    fields[SLUG_KEYS_FIELD] = slug_keys({**product, **fields})
+    return {field: value for field, value in fields.items() if product.get(field) != value}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill canonical main category fields on products')
+    parser.add_argument('--batch-size', type=int, default=500, help='Products per bulk write')
+    parser.add_argument('--restart', action='store_true', help='Ignore the saved checkpoint')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+    products = db['products']
+    migrations = db['migrations']
+
+    tree = CategoryTree(list(db['categories'].find({}, {'_id': 0})))
+    if args.restart and args.apply:
+        migrations.delete_one({'_id': MIGRATION_ID})
+    checkpoint = {} if args.restart else (migrations.find_one({'_id': MIGRATION_ID}) or {})
+    if checkpoint.get('completed_at'):
+        if args.apply:
+            print(f"✓ Already completed at {checkpoint['completed_at']}. Use --restart to re-scan.")
+            return
+        checkpoint = {}
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    if checkpoint.get('last_id'):
+        print(f"Resuming after {checkpoint['last_id']} ({checkpoint.get('scanned', 0)} products already scanned)")
+    print()
+
+    counts = {field: checkpoint.get(field, 0) for field in ('scanned', 'updated', 'unresolved')}
+    query = {'_id': {'$gt': checkpoint['last_id']}} if checkpoint.get('last_id') else {}
+    now = datetime.utcnow().isoformat()
+
+    def flush(batch, last_id):
+        if batch:
+            counts['updated'] += products.bulk_write(batch, ordered=False).modified_count
+        migrations.update_one(
+            {'_id': MIGRATION_ID},
+            {'$set': {'last_id': last_id, **counts, 'updated_at': datetime.utcnow().isoformat()},
+             '$setOnInsert': {'started_at': now}},
+            upsert=True)
+
+    batch = []
+    last_id = None
+    try:
+        for product in products.find(query, PROJECTION).sort('_id', 1).batch_size(args.batch_size):
+            counts['scanned'] += 1
+            last_id = product['_id']
+            fields = canonical_fields(tree, product)
+            if fields is None:
+                counts['unresolved'] += 1
+                print(f"  ❌ no main category for {product.get('id')} ({product.get('name', '')}): "
+                      f"category_id={product.get('category_id')!r} "
+                      f"main_category_name={product.get('main_category_name')!r}")
+            elif fields and not args.apply:
+                counts['updated'] += 1
+                print(f"  would set {', '.join(sorted(fields))} on {product.get('id')} ({product.get('name', '')})")
+            elif fields:
+                # Stamped per product: caches catch up on updated_at newer than
+                # what they have seen, so one stamp from the start of the run
+                # would hide products written after a concurrent app write
+                batch.append(UpdateOne({'_id': product['_id']},
+                                       {'$set': {**fields, 'updated_at': datetime.utcnow().isoformat()}}))
+
+            if args.apply and counts['scanned'] % args.batch_size == 0:
+                flush(batch, last_id)
+                batch = []
+        if args.apply:
+            flush(batch, last_id if last_id is not None else checkpoint.get('last_id'))
+            migrations.update_one({'_id': MIGRATION_ID},
+                                  {'$set': {'completed_at': datetime.utcnow().isoformat()}})
+    except PyMongoError as exc:
+        print(f"❌ Migration stopped after {counts['scanned']} products: {exc}")
+        print('   Re-run with --apply to resume from the last checkpoint.')
+        sys.exit(1)
+
+    print()
+    if args.apply:
+        print(f"✓ Scanned {counts['scanned']} products, updated {counts['updated']}, "
+              f"{counts['unresolved']} unresolved")
+        if counts['updated']:
+            # Running app workers drop their cached catalog on the new version
+            version = CatalogVersion(db['catalog_meta']).bump()
+            print(f'✓ Catalog version bumped to {version}')
+            print('  Run reconcile_category_counters.py --apply to recount products per category.')
+    else:
+        print(f"✓ {counts['updated']} of {counts['scanned']} products need updating, "
+              f"{counts['unresolved']} unresolved. Re-run with --apply to write them.")
+    if counts['unresolved']:
+        print('  Unresolved products keep their fields; fix their category_id and re-run with --restart.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+A cursor is an opaque, HMAC-signed token holding the last row's sort value
+and id. The next page is fetched with a range filter on the sort key
+instead of .skip(), so deep pages cost the same as the first one.
+
+The token also binds the sort criteria and a hash of the filter it was
+issued for, so it cannot be replayed against a different listing.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+
+from bson import json_util
+
+
+class InvalidCursorError(ValueError):
+    """Raised for tampered, malformed or mismatched cursors (a client error)."""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(token: str) -> bytes:
+    return base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+
+
+def filter_hash(query: dict) -> str:
+    body = json_util.dumps(query, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+def encode_cursor(last_doc: dict, sort_criteria: list[tuple], query: dict, secret: str) -> str:
+    """Build the cursor that resumes after last_doc."""
+    field = sort_criteria[0][0]
+    payload = json_util.dumps({
+        's': [[key, direction] for key, direction in sort_criteria],
+        'f': filter_hash(query),
+        'v': last_doc.get(field),
+        'i': last_doc.get('id'),
+    }, sort_keys=True).encode('utf-8')
+    signature = hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).digest()[:16]
+    return f'{_b64encode(payload)}.{_b64encode(signature)}'
+
+
+def decode_cursor(token: str, sort_criteria: list[tuple], query: dict, secret: str) -> dict:
+    """Verify and unpack a cursor. Raises InvalidCursorError if tampered or reused elsewhere."""
+    try:
+        payload_part, signature_part = token.split('.', 1)
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError('Malformed cursor') from exc
+
+    expected = hmac.new(secret.encode('utf-8'), payload, hashlib.sha256).digest()[:16]
+    if not hmac.compare_digest(signature, expected):
+        raise InvalidCursorError('Invalid cursor signature')
+
+    try:
+        cursor = json_util.loads(payload)
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursorError('Malformed cursor') from exc
+    if [tuple(item) for item in cursor.get('s', [])] != [tuple(item) for item in sort_criteria]:
+        raise InvalidCursorError('Cursor was issued for a different sortBy')
+    if cursor.get('f') != filter_hash(query):
+        raise InvalidCursorError('Cursor was issued for different filters')
+    return cursor
+
+
+def keyset_filter(cursor: dict, sort_criteria: list[tuple]) -> dict:
+    """
+    Range filter selecting rows strictly after the cursor position for a
+    sort of the form [(field, +/-1), ('id', +/-1)].
+    """
+    field, direction = sort_criteria[0]
+    value = cursor.get('v')
+    last_id = cursor.get('i')
+    tie = {field: value, 'id': {'$gt' if sort_criteria[1][1] == 1 else '$lt': last_id}}
+
+    # MongoDB orders missing/null values before everything else
+    if value is None:
+        if direction == 1:
+            return {'$or': [{field: {'$ne': None}}, tie]}
+        return tie
+    if direction == 1:
+        return {'$or': [{field: {'$gt': value}}, tie]}
+    return {'$or': [{field: {'$lt': value}}, {field: None}, tie]}
@@ -0,0 +1,184 @@
+"""
+Dominant colors of product photos, for the ?palette= facet.
+
+The color specification is typed by hand ("BLUSH PINK", "Blush", "pink"),
+so extract_product_colors.py derives colors from the product's first
+image instead and stores them on the product:
+
+  color_palette: {source: <image url>, names: ['pink', 'white'],
+                  colors: [{hex: '#e8b4b8', name: 'pink', share: 0.61}, ...],
+                  extracted_at}
+
+The photo is decoded at PALETTE_SAMPLE_SIZE pixels on its long side and
+its pixels are clustered with k-means (PALETTE_COLORS clusters), written
+as whole-array NumPy operations: squared distances to every centre come
+from one matrix product and centres are recomputed with np.bincount, so
+a photo is decoded and clustered in a few milliseconds. The cluster covering
+most of the image border is treated as the studio backdrop and dropped.
+Each remaining centre is named after the nearest entry of NAMED_COLORS;
+names covering at least PALETTE_MIN_SHARE of the product form the facet
+values (color_palette.names, see product_facets.py).
+
+source records which image the palette came from: a product whose first
+image changed no longer matches it, which is how incremental runs find
+their work (update_product also drops the palette in that case).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime
+
+import numpy as np
+
+from product_images import fetch_object, open_thumbnail, s3_key_from_url
+
+logger = logging.getLogger(__name__)
+
+PALETTE_FIELD = 'color_palette'
+
+PALETTE_COLORS = int(os.getenv('PALETTE_COLORS', 5))
+PALETTE_SAMPLE_SIZE = int(os.getenv('PALETTE_SAMPLE_SIZE', 64))
+PALETTE_MIN_SHARE = float(os.getenv('PALETTE_MIN_SHARE', 0.15))
+
+KMEANS_ITERATIONS = 20
+# Centres moving less than this (in 0-255 RGB units) have converged
+KMEANS_TOLERANCE = 0.5
+# The border cluster is the backdrop when it covers this much of the border
+BACKDROP_BORDER_SHARE = 0.6
+ALPHA_CUTOFF = 128
+
+# Facet vocabulary: reference colors the clusters are named after
+NAMED_COLORS = {
+    'black': (20, 20, 20),
+    'grey': (128, 128, 128),
+    'silver': (192, 192, 192),
+    'white': (245, 245, 245),
+    'ivory': (250, 240, 215),
+    'beige': (215, 195, 160),
+    'brown': (120, 75, 40),
+    'tan': (190, 150, 100),
+    'red': (200, 30, 40),
+    'maroon': (120, 20, 40),
+    'pink': (235, 150, 180),
+    'blush': (235, 185, 195),
+    'orange': (240, 130, 30),
+    'yellow': (245, 215, 50),
+    'gold': (205, 165, 60),
+    'olive': (110, 115, 40),
+    'green': (40, 140, 60),
+    'teal': (0, 128, 128),
+    'blue': (40, 90, 200),
+    'navy': (25, 35, 90),
+    'purple': (120, 50, 150),
+    'lavender': (190, 165, 220),
+}
+_NAMES = list(NAMED_COLORS)
+_REFERENCE = np.array([NAMED_COLORS[name] for name in _NAMES], dtype=np.float32)
+
+
+def kmeans(pixels: np.ndarray, k: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """(centres, labels) for an (n, 3) float32 pixel array; k-means++ seeding."""
+    rng = np.random.default_rng(seed)
+    n = len(pixels)
+    centres = [pixels[rng.integers(n)]]
+    closest = ((pixels - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, min(k, n)):
+        total = closest.sum()
+        if total <= 0:
+            break  # fewer distinct colors than clusters
+        centre = pixels[rng.choice(n, p=closest / total)]
+        centres.append(centre)
+        np.minimum(closest, ((pixels - centre) ** 2).sum(axis=1), out=closest)
+    centres = np.array(centres, dtype=np.float32)
+
+    squared_norms = (pixels ** 2).sum(axis=1, keepdims=True)
+    for _ in range(KMEANS_ITERATIONS):
+        distances = squared_norms - 2 * pixels @ centres.T + (centres ** 2).sum(axis=1)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=len(centres))
+        sums = np.stack([np.bincount(labels, weights=pixels[:, channel], minlength=len(centres))
+                         for channel in range(3)], axis=1)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centres)
+        shift = np.abs(updated - centres).max()
+        centres = updated.astype(np.float32)
+        if shift < KMEANS_TOLERANCE:
+            break
+    distances = squared_norms - 2 * pixels @ centres.T + (centres ** 2).sum(axis=1)
+    return centres, distances.argmin(axis=1)
+
+
+def color_name(rgb) -> str:
+    """Nearest NAMED_COLORS entry by "redmean" distance (close to perceived difference)."""
+    rgb = np.asarray(rgb, dtype=np.float32)
+    mean_red = (_REFERENCE[:, 0] + rgb[0]) / 2
+    delta = _REFERENCE - rgb
+    distance = ((2 + mean_red / 256) * delta[:, 0] ** 2 + 4 * delta[:, 1] ** 2
+                + (2 + (255 - mean_red) / 256) * delta[:, 2] ** 2)
+    return _NAMES[int(distance.argmin())]
+
+
+def image_palette(image, k: int = PALETTE_COLORS, min_share: float = PALETTE_MIN_SHARE) -> dict:
+    """Palette of a Pillow image already downsampled to a thumbnail."""
+    rgba = np.asarray(image.convert('RGBA'), dtype=np.float32)
+    border = np.zeros(rgba.shape[:2], dtype=bool)
+    border[0, :] = border[-1, :] = border[:, 0] = border[:, -1] = True
+    opaque = rgba[:, :, 3] >= ALPHA_CUTOFF
+    pixels = rgba[:, :, :3][opaque]
+    if not len(pixels):
+        return {'colors': [], 'names': []}
+
+    centres, labels = kmeans(pixels, k)
+    counts = np.bincount(labels, minlength=len(centres)).astype(np.float64)
+
+    # Drop the backdrop: the cluster holding most of the (opaque) border
+    border_labels = labels[border[opaque]]
+    if len(centres) > 1 and len(border_labels):
+        border_counts = np.bincount(border_labels, minlength=len(centres))
+        backdrop = int(border_counts.argmax())
+        if border_counts[backdrop] >= BACKDROP_BORDER_SHARE * len(border_labels) \
+                and counts[backdrop] < counts.sum():
+            counts[backdrop] = 0
+
+    # Clusters with the same name merge into one share-weighted swatch
+    shares = counts / counts.sum()
+    swatches: dict[str, list] = {}
+    for cluster in range(len(centres)):
+        if shares[cluster] <= 0:
+            continue
+        swatch = swatches.setdefault(color_name(centres[cluster]), [0.0, np.zeros(3)])
+        swatch[0] += shares[cluster]
+        swatch[1] += shares[cluster] * centres[cluster]
+
+    colors = []
+    for name, (share, weighted) in sorted(swatches.items(), key=lambda item: -item[1][0]):
+        rgb = np.clip(np.rint(weighted / share), 0, 255).astype(int)
+        colors.append({'hex': '#{:02x}{:02x}{:02x}'.format(*rgb), 'name': name, 'share': round(float(share), 3)})
+    return {'colors': colors, 'names': [color['name'] for color in colors if color['share'] >= min_share]}
+
+
+def extract_palette(task: tuple[str, str]) -> tuple[str, str, dict | None, str | None]:
+    """
+    Process-pool entry point: (product id, image url) ->
+    (product id, image url, palette or None, error or None).
+    """
+    product_id, url = task
+    key = s3_key_from_url(url)
+    if key is None:
+        return product_id, url, None, 'not an S3/CloudFront URL'
+    try:
+        data, _ = fetch_object(key)
+        palette = image_palette(open_thumbnail(data, PALETTE_SAMPLE_SIZE, mode='RGBA'))
+    except Exception as exc:  # one bad image must not stop the batch
+        return product_id, url, None, str(exc)
+    palette.update(source=url, extracted_at=datetime.utcnow().isoformat())
+    return product_id, url, palette, None
+
+
+def needs_palette(product: dict) -> bool:
+    """True if the product's first image has no palette yet (new or changed image)."""
+    images = product.get('images') or []
+    if not images:
+        return False
+    return ((product.get(PALETTE_FIELD) or {}).get('source')) != images[0]
@@ -0,0 +1,129 @@
+"""
+Shopper-facing facets derived from free-text product specifications.
+
+Specifications are whatever the admin typed: material "100% VISCOSE",
+color "BLUSH PINK", size "XS, S, M, L, XXL". Filtering on those strings
+would need unindexable regexes, so every product also stores normalized
+token arrays, maintained by create_product / update_product (and by
+backfill_product_facets.py for older documents):
+
+  facets: {material: ['viscose'], color: ['blush pink'], size: ['xs', 's', 'm', 'l', 'xxl']}
+
+Each array has a multikey index (see db_indexes.py), so GET /api/products
+?material=viscose&size=m,l is a plain indexed $in per facet. facet_counts()
+returns value counts for every facet with one $facet aggregation;
+each facet is counted with the other facets' filters applied but not its
+own, so a shopper can see how many products each alternative would add.
+
+The palette facet (?palette=navy) filters on colors extracted from the
+product photos instead (color_palette.names, see product_colors.py).
+"""
+
+from __future__ import annotations
+
+import re
+
+FACETS_FIELD = 'facets'
+FACET_FIELDS = ('material', 'color', 'size')
+
+# Every filterable facet and the product array it matches; palette values
+# come from extract_product_colors.py rather than the specifications
+FILTER_FACETS = FACET_FIELDS + ('palette',)
+FACET_PATHS = {**{facet: f'{FACETS_FIELD}.{facet}' for facet in FACET_FIELDS},
+               'palette': 'color_palette.names'}
+
+# Specification keys (lowercased) that feed each facet
+SPECIFICATION_KEYS = {
+    'material': ('material', 'materials', 'fabric', 'composition'),
+    'color': ('color', 'colour', 'colors', 'colours'),
+    'size': ('size', 'sizes'),
+}
+
+# Most frequent values returned per facet
+FACET_MAX_VALUES = 50
+
+SEPARATORS = re.compile(r'\s*(?:[,;/|+&]|\band\b|\bor\b)\s*')
+PERCENT = re.compile(r'\d+(?:\.\d+)?\s*%')
+
+
+def normalize_value(value) -> str:
+    """Lowercase, single-spaced, letters/digits/spaces/hyphens only."""
+    value = re.sub(r'[^a-z0-9\s-]', ' ', str(value or '').lower())
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def tokenize(facet: str, text) -> list[str]:
+    """Split one specification value into facet tokens, in first-seen order."""
+    if isinstance(text, (list, tuple)):
+        text = ', '.join(str(part) for part in text)
+    text = str(text or '')
+    if facet == 'material':
+        # "60% cotton 40% polyester" lists materials without separators
+        text = PERCENT.sub(',', text)
+    tokens = [normalize_value(part) for part in SEPARATORS.split(text)]
+    return list(dict.fromkeys(token for token in tokens if token))
+
+
+def extract_facets(specifications) -> dict[str, list[str]]:
+    """Facet tokens for a product's specifications dict."""
+    if not isinstance(specifications, dict):
+        return {facet: [] for facet in FACET_FIELDS}
+    by_key = {str(key).strip().lower(): value for key, value in specifications.items()}
+    facets = {}
+    for facet in FACET_FIELDS:
+        tokens = []
+        for key in SPECIFICATION_KEYS[facet]:
+            if key in by_key:
+                tokens += tokenize(facet, by_key[key])
+        facets[facet] = list(dict.fromkeys(tokens))
+    return facets
+
+
+def selected_facets(args) -> dict[str, list[str]]:
+    """Facet filters from request args: ?material=viscose&size=s,m&palette=navy (comma = any of)."""
+    selected = {}
+    for facet in FILTER_FACETS:
+        raw = args.get(facet)
+        if raw:
+            values = list(dict.fromkeys(normalize_value(value) for value in raw.split(',')))
+            values = [value for value in values if value]
+            if values:
+                selected[facet] = values
+    return selected
+
+
+def facet_query(selected: dict[str, list[str]], exclude: str | None = None) -> dict:
+    """MongoDB filter for the selected facet values (all facets must match)."""
+    query = {}
+    for facet, values in selected.items():
+        if facet == exclude:
+            continue
+        query[FACET_PATHS[facet]] = values[0] if len(values) == 1 else {'$in': values}
+    return query
+
+
+def facet_pipeline(base_query: dict, selected: dict[str, list[str]]) -> list[dict]:
+    """The aggregation facet_counts() runs (explain_audit.py replays it)."""
+    branches = {}
+    for facet in FILTER_FACETS:
+        branch = []
+        others = facet_query(selected, exclude=facet)
+        if others:
+            branch.append({'$match': others})
+        branch += [
+            {'$unwind': f'${FACET_PATHS[facet]}'},
+            {'$group': {'_id': f'${FACET_PATHS[facet]}', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': FACET_MAX_VALUES},
+        ]
+        branches[facet] = branch
+    return [{'$match': base_query}, {'$facet': branches}]
+
+
+def facet_counts(collection, base_query: dict, selected: dict[str, list[str]]) -> dict[str, list[dict]]:
+    """{facet: [{value, count}, ...]} for products matching base_query, in one round trip."""
+    result = next(collection.aggregate(facet_pipeline(base_query, selected)), {})
+    return {
+        facet: [{'value': row['_id'], 'count': row['count']} for row in result.get(facet, [])]
+        for facet in FILTER_FACETS
+    }
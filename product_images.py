@@ -0,0 +1,80 @@
+"""
+S3 access to product images, shared by app.py uploads and offline jobs.
+
+Product documents store CloudFront (or plain S3) URLs; jobs such as
+extract_product_colors.py read the original objects straight from the
+bucket instead of going through the CDN. The client is configured from
+the AWS_* variables and created once per process, so it is safe to use
+from multiprocessing workers.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+
+import boto3
+from botocore.config import Config
+from PIL import Image
+
+AWS_REGION = os.getenv('AWS_REGION', 'ap-south-1')
+AWS_S3_BUCKET = os.getenv('AWS_S3_BUCKET')
+AWS_CDN_BASE_URL = os.getenv('AWS_CDN_BASE_URL', '').rstrip('/')
+
+_s3_client = None
+
+
+def s3_client():
+    """Per-process S3 client, or None if AWS credentials are not configured."""
+    global _s3_client
+    if _s3_client is not None:
+        return _s3_client
+
+    access_key = os.getenv('AWS_ACCESS_KEY_ID')
+    secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
+    if not access_key or not secret_key or not AWS_S3_BUCKET:
+        return None
+
+    _s3_client = boto3.client(
+        's3',
+        region_name=AWS_REGION,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(signature_version='s3v4'),
+    )
+    return _s3_client
+
+
+def s3_key_from_url(image_url: str) -> str | None:
+    """S3 object key for a CloudFront or S3 URL; None for anything else."""
+    if not image_url or not isinstance(image_url, str):
+        return None
+    if AWS_CDN_BASE_URL and image_url.startswith(f'{AWS_CDN_BASE_URL}/'):
+        return image_url[len(AWS_CDN_BASE_URL) + 1:]
+    bucket_host = f'{AWS_S3_BUCKET}.s3.{AWS_REGION}.amazonaws.com'
+    if AWS_S3_BUCKET and image_url.startswith(f'https://{bucket_host}/'):
+        return image_url[len(f'https://{bucket_host}/'):]
+    return None
+
+
+def fetch_object(key: str) -> tuple[bytes, str | None]:
+    """(object bytes, ETag) for a key in the configured bucket."""
+    client = s3_client()
+    if client is None:
+        raise RuntimeError('AWS credentials / AWS_S3_BUCKET are not configured')
+    response = client.get_object(Bucket=AWS_S3_BUCKET, Key=key)
+    return response['Body'].read(), (response.get('ETag') or '').strip('"') or None
+
+
+def open_thumbnail(data: bytes, size: int, mode: str = 'RGB') -> Image.Image:
+    """Decode an image at (about) size x size, converted to mode.
+
+    draft() lets the JPEG decoder scale down while decoding, so large
+    photos never materialize at full resolution.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft('RGB', (size * 2, size * 2))
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    image.thumbnail((size, size), Image.Resampling.BILINEAR)
+    return image.convert(mode)
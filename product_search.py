@@ -0,0 +1,581 @@
+"""
+In-process ranked full-text search over products.
+
+Replaces the unanchored, case-insensitive $regex scans used by the product
+listing endpoints. A tokenized inverted index is built over name,
+seo_title, seo_keywords and description, then kept fresh incrementally from
+the `updated_at` timestamps written by create_product / update_product.
+Deletes are applied locally and through the invalidation bus; when the
+catalog version moves, deletions the worker has not seen yet are read from
+the product tombstones (see product_tombstones.py) with one indexed query.
+
+The full index is persisted as a memory-mapped segment file (see
+search_segment.py) so gunicorn workers boot warm and share one copy of the
+postings through the page cache.
+
+Ranking is BM25 with per-field weights folded into term frequency. Every
+query term must match (AND); the last term also matches as a prefix so
+partially typed words still find results.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from datetime import datetime
+
+from pymongo.errors import PyMongoError
+
+from product_tombstones import catch_up_from, deleted_since
+from search_segment import MappedSegment, write_segment
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: no cross-process build lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'seo_title': 2.0,
+    'seo_keywords': 2.0,
+    'description': 1.0,
+    'specifications': 1.0,
+}
+
+# Fields kept per product so filters and sorts can be applied without Mongo
+META_FIELDS = ('id', 'is_active', 'category_id', 'main_category_id', 'main_category_name',
+               'main_category_slug', 'name', 'created_at', 'updated_at')
+
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+})
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+SEARCH_REFRESH_SECONDS = float(os.getenv('SEARCH_REFRESH_SECONDS', 5))
+SEARCH_REBUILD_SECONDS = float(os.getenv('SEARCH_REBUILD_SECONDS', 300))
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH')
+
+# Typo-tolerant matching: minimum trigram similarity, and how few exact
+# results make the listing endpoints retry a search in fuzzy mode
+SEARCH_FUZZY_THRESHOLD = float(os.getenv('SEARCH_FUZZY_THRESHOLD', 0.3))
+SEARCH_FUZZY_MIN_RESULTS = int(os.getenv('SEARCH_FUZZY_MIN_RESULTS', 3))
+
+
+def stem(token: str) -> str:
+    """Very small plural stemmer: dresses -> dress, accessories -> accessory."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    if token.endswith('es') and token[:-2].endswith(('s', 'x', 'ch', 'sh')):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def tokenize(text) -> list[str]:
+    """Lowercase, strip accents, split on non-alphanumerics, drop stopwords, stem."""
+    if not text:
+        return []
+    if isinstance(text, dict):
+        text = list(text.values())
+    if not isinstance(text, str):
+        text = ' '.join(str(value) for value in text) if isinstance(text, (list, tuple)) else str(text)
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return [stem(token) for token in TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+
+def trigrams(term: str) -> set[str]:
+    """Padded character trigrams, so word starts and ends weigh in."""
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Maps trigrams to vocabulary terms for fast similar-term candidate lookup."""
+
+    def __init__(self, terms=()):
+        self._terms_by_trigram: dict[str, set[str]] = {}
+        self._size: dict[str, int] = {}
+        for term in terms:
+            self.add(term)
+
+    def add(self, term: str):
+        if term in self._size or len(term) < 3 or term.isdigit():
+            return
+        grams = trigrams(term)
+        self._size[term] = len(grams)
+        for gram in grams:
+            self._terms_by_trigram.setdefault(gram, set()).add(term)
+
+    def similar(self, token: str, threshold: float) -> dict[str, float]:
+        """Terms whose trigram Jaccard similarity to token is >= threshold."""
+        grams = trigrams(token)
+        shared: dict[str, int] = {}
+        for gram in grams:
+            for term in self._terms_by_trigram.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+        matches = {}
+        for term, count in shared.items():
+            similarity = count / (len(grams) + self._size[term] - count)
+            if similarity >= threshold:
+                matches[term] = similarity
+        return matches
+
+
+def matches_query(meta: dict, query: dict) -> bool:
+    """
+    Evaluate the equality / $and / $or subset of a Mongo filter against a
+    product's indexed fields.
+    """
+    for key, expected in query.items():
+        if key == '$and':
+            if not all(matches_query(meta, part) for part in expected):
+                return False
+        elif key == '$or':
+            if not any(matches_query(meta, part) for part in expected):
+                return False
+        elif meta.get(key) != expected:
+            return False
+    return True
+
+
+def can_filter(query: dict) -> bool:
+    """True if matches_query can evaluate every clause of this filter."""
+    for key, expected in query.items():
+        if key in ('$and', '$or'):
+            if not all(isinstance(part, dict) and can_filter(part) for part in expected):
+                return False
+        elif key not in META_FIELDS or isinstance(expected, dict):
+            return False
+    return True
+
+
+def catalog_fingerprint(collection) -> str:
+    """Cheap catalog version: document count plus the newest updated_at."""
+    latest = collection.find_one({}, {'updated_at': 1, '_id': 0}, sort=[('updated_at', -1)]) or {}
+    return f"{collection.estimated_document_count()}:{latest.get('updated_at') or ''}"
+
+
+def term_weights(product: dict) -> dict[str, float]:
+    weights: dict[str, float] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(product.get(field)):
+            weights[term] = weights.get(term, 0.0) + weight
+    return weights
+
+
+@contextmanager
+def build_lock(path: str, blocking: bool):
+    """Cross-process lock so only one worker rebuilds a segment at a time."""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a+') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+class ProductSearchIndex:
+    """
+    Inverted index over products_collection, safe to share across request threads.
+
+    The bulk of the index is a memory-mapped segment file shared by every
+    gunicorn worker (see search_segment.py). Products changed since the
+    segment was written live in a small in-memory overlay that shadows
+    their segment entries until the next rebuild.
+    """
+
+    def __init__(self, collection, tombstones=None, path: str | None = None):
+        self.collection = collection
+        self.tombstones = tombstones
+        self.path = path or SEARCH_INDEX_PATH or os.path.join(
+            tempfile.gettempdir(), f'outre_couture_search_{collection.database.name}.idx')
+        self._lock = threading.RLock()
+        self._base: MappedSegment | None = None
+        self._shadowed: set[str] = set()
+        self._shadowed_length = 0.0
+        self._deleted: set[str] = set()
+        self._trigrams = TrigramIndex()
+        self._reset_overlay()
+        self.last_updated_at = ''
+        # Newest product tombstone applied (see _drop_removed)
+        self.last_deleted_at: datetime | None = None
+        self.built_at = 0.0
+        self.checked_at = 0.0
+        # Catalog version the index was last caught up to (see ensure_fresh)
+        self.version = None
+
+    def _reset_overlay(self):
+        self._postings: dict[str, dict[str, float]] = {}
+        self._doc_terms: dict[str, tuple] = {}
+        self._doc_length: dict[str, float] = {}
+        self._docs: dict[str, dict] = {}
+        self._total_length = 0.0
+        self._vocabulary: list[str] = []
+        self._vocabulary_dirty = True
+
+    # ---- maintenance ----
+
+    def _shadow(self, product_id: str):
+        base = self._base
+        if base is None or product_id in self._shadowed or product_id not in base.ordinals:
+            return
+        self._shadowed.add(product_id)
+        self._shadowed_length += base.lengths[base.ordinals[product_id]]
+
+    def _add(self, product: dict):
+        product_id = product.get('id')
+        if not product_id:
+            return
+        self._shadow(product_id)
+        weights = term_weights(product)
+        for term, weight in weights.items():
+            self._postings.setdefault(term, {})[product_id] = weight
+            self._trigrams.add(term)
+            self._vocabulary_dirty = True
+        length = sum(weights.values())
+        self._doc_terms[product_id] = tuple(weights)
+        self._doc_length[product_id] = length
+        self._total_length += length
+        self._docs[product_id] = {field: product.get(field) for field in META_FIELDS}
+
+        updated_at = product.get('updated_at') or ''
+        if isinstance(updated_at, str) and updated_at > self.last_updated_at:
+            self.last_updated_at = updated_at
+
+    def _remove(self, product_id: str):
+        for term in self._doc_terms.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+        self._total_length -= self._doc_length.pop(product_id, 0.0)
+        self._docs.pop(product_id, None)
+        self._shadow(product_id)
+
+    def upsert(self, product: dict):
+        """Index (or re-index) one product document."""
+        with self._lock:
+            self._deleted.discard(product.get('id'))
+            self._remove(product.get('id'))
+            self._add(product)
+
+    def remove(self, product_id: str):
+        with self._lock:
+            self._deleted.add(product_id)
+            self._remove(product_id)
+
+    def _install(self, segment: MappedSegment):
+        """Swap in a segment; products deleted locally stay hidden if it still has them."""
+        with self._lock:
+            self._base = segment
+            self._trigrams = TrigramIndex(segment.iter_terms())
+            self._reset_overlay()
+            self._shadowed = set()
+            self._shadowed_length = 0.0
+            self.last_updated_at = segment.info.get('last_updated_at') or ''
+            deleted_at = segment.info.get('deleted_at')
+            self.last_deleted_at = datetime.fromisoformat(deleted_at) if deleted_at else None
+            for product_id in list(self._deleted):
+                if product_id in segment.ordinals:
+                    self._shadow(product_id)
+                else:
+                    self._deleted.discard(product_id)
+            self.checked_at = 0.0
+        logger.info('Search segment mapped: %d products, %d terms (%s)',
+                    len(segment.docs), segment.n_terms, segment.path)
+
+    def load(self) -> bool:
+        """Map the segment file if one exists. Returns False when unavailable."""
+        try:
+            segment = MappedSegment(self.path)
+        except (OSError, ValueError) as exc:
+            logger.info('No usable search segment at %s: %s', self.path, exc)
+            return False
+        self._install(segment)
+        self.built_at = time.time()
+        return True
+
+    def rebuild(self):
+        """Rebuild the whole index from MongoDB and publish it as a new segment."""
+        fingerprint = catalog_fingerprint(self.collection)
+        # Taken before the read: a deletion racing with it is applied again
+        deleted_at = datetime.utcnow()
+        projection = {field: 1 for field in set(FIELD_WEIGHTS) | set(META_FIELDS)}
+        projection['_id'] = 0
+        products = [product for product in self.collection.find({}, projection) if product.get('id')]
+
+        docs, lengths = [], []
+        postings: dict[str, dict[str, float]] = {}
+        last_updated_at = ''
+        for product in products:
+            weights = term_weights(product)
+            for term, weight in weights.items():
+                postings.setdefault(term, {})[product['id']] = weight
+            docs.append({field: product.get(field) for field in META_FIELDS})
+            lengths.append(sum(weights.values()))
+            updated_at = product.get('updated_at') or ''
+            if isinstance(updated_at, str) and updated_at > last_updated_at:
+                last_updated_at = updated_at
+
+        try:
+            write_segment(self.path, docs, lengths, postings, {
+                'fingerprint': fingerprint,
+                'last_updated_at': last_updated_at,
+                'deleted_at': deleted_at.isoformat(),
+                'total_length': sum(lengths),
+                'built_at': time.time(),
+            })
+            segment = MappedSegment(self.path)
+        except (OSError, ValueError) as exc:
+            # Read-only or unsupported filesystem: keep a private in-memory index
+            logger.warning('Search segment not written (%s); indexing in memory', exc)
+            with self._lock:
+                self._base = None
+                self._trigrams = TrigramIndex()
+                self._shadowed = set()
+                self._shadowed_length = 0.0
+                self._reset_overlay()
+                self.last_updated_at = ''
+                self.last_deleted_at = deleted_at
+                for product in products:
+                    self._add(product)
+        else:
+            self._install(segment)
+        self.built_at = time.time()
+
+    def _segment_changed_on_disk(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        return self._base is None or identity != self._base.identity
+
+    def _rebuild_shared(self, blocking: bool):
+        """Rebuild under the cross-process lock, or adopt another worker's result."""
+        with build_lock(self.path, blocking) as acquired:
+            if not acquired:
+                return
+            if self._segment_changed_on_disk() and self.load():
+                if self._base.info.get('fingerprint') == catalog_fingerprint(self.collection):
+                    return
+            self.rebuild()
+
+    def _catch_up(self, now: float):
+        projection = {field: 1 for field in set(FIELD_WEIGHTS) | set(META_FIELDS)}
+        projection['_id'] = 0
+        # Re-read CATCH_UP_OVERLAP_SECONDS back: writes can commit out of
+        # updated_at order, and re-indexing a product is idempotent
+        changed = list(self.collection.find(
+            {'updated_at': {'$gte': catch_up_from(self.last_updated_at)}}, projection))
+        with self._lock:
+            for product in changed:
+                if product.get('id') in self._deleted:
+                    continue
+                self._remove(product.get('id'))
+                self._add(product)
+            self.checked_at = now
+
+    def _drop_removed(self):
+        """Forget products other workers deleted since the last tombstone applied."""
+        if self.tombstones is None:
+            return
+        deleted_ids, deleted_at = deleted_since(self.tombstones, self.last_deleted_at)
+        with self._lock:
+            for product_id in deleted_ids:
+                indexed = product_id in self._docs or (
+                    self._base is not None and product_id in self._base.ordinals)
+                if indexed and product_id not in self._deleted:
+                    self.remove(product_id)
+            self.last_deleted_at = deleted_at
+
+    def refresh(self, force: bool = False):
+        """
+        Bring the index up to date. Maps the shared segment on first use
+        (building it if no worker has yet), re-checks the catalog version
+        every SEARCH_REBUILD_SECONDS and rebuilds or swaps the segment when
+        it changed, and otherwise indexes products whose updated_at moved.
+        """
+        now = time.time()
+        if not force and now - self.checked_at < SEARCH_REFRESH_SECONDS:
+            return
+
+        if not self.built_at:
+            if not self.load():
+                self._rebuild_shared(blocking=True)
+        elif now - self.built_at > SEARCH_REBUILD_SECONDS:
+            self.built_at = now
+            if self._segment_changed_on_disk():
+                self.load()
+            base_fingerprint = self._base.info.get('fingerprint') if self._base else None
+            if base_fingerprint != catalog_fingerprint(self.collection):
+                self._rebuild_shared(blocking=False)
+
+        self._catch_up(now)
+
+    def ensure_fresh(self, version: int | None = None) -> bool:
+        """
+        refresh() that never raises; False when the index cannot be used.
+
+        Given the catalog version, catches up immediately (deletes included)
+        when it moved past the last one seen, instead of waiting out
+        SEARCH_REFRESH_SECONDS, so results are as new as that version.
+        """
+        moved = version is not None and version != self.version
+        try:
+            self.refresh(force=moved)
+            if moved:
+                self._drop_removed()
+                self.version = version
+        except PyMongoError as exc:
+            logger.error('Search index refresh failed: %s', exc)
+            if moved:
+                return False  # results could predate the version they would be cached under
+        return bool(self.built_at)
+
+    def warm_start(self):
+        """Map an existing segment at boot; otherwise build it on a background thread."""
+        if self.load():
+            return
+        threading.Thread(target=self.ensure_fresh, name='search-index-build', daemon=True).start()
+
+    # ---- querying ----
+
+    def _meta(self, product_id: str) -> dict:
+        meta = self._docs.get(product_id)
+        if meta is None:
+            meta = self._base.docs[self._base.ordinals[product_id]]
+        return meta
+
+    def _expand_prefix(self, prefix: str) -> list[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        terms = set(self._base.terms_with_prefix(prefix)) if self._base is not None else set()
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.add(term)
+        return sorted(terms)
+
+    def _score_terms(self, terms: dict[str, float], doc_count: int, avg_length: float) -> dict[str, float]:
+        """
+        BM25 contribution of a set of alternative terms (best term per doc),
+        each scaled by its similarity to the query token.
+        """
+        scores: dict[str, float] = {}
+        base = self._base
+
+        def add(product_id, tf, length, idf):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            score = factor * idf * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > scores.get(product_id, 0.0):
+                scores[product_id] = score
+
+        for term, factor in terms.items():
+            overlay = self._postings.get(term) or {}
+            segment_postings = base.postings(term) if base is not None else None
+            df = len(overlay) + (len(segment_postings[0]) if segment_postings else 0)
+            if not df:
+                continue
+            idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            if segment_postings:
+                for ordinal, tf in zip(*segment_postings):
+                    product_id = base.doc_ids[ordinal]
+                    if product_id not in self._shadowed:
+                        add(product_id, tf, base.lengths[ordinal], idf)
+            for product_id, tf in overlay.items():
+                add(product_id, tf, self._doc_length[product_id], idf)
+        return scores
+
+    def search(self, text: str, query: dict | None = None, sort_by: str | None = None,
+               fuzzy: bool = False) -> list[str]:
+        """
+        Return ids of products matching every term of `text` and the
+        equality filters in `query`, best match first (or ordered by
+        sort_by: name, name_desc, newest, oldest).
+
+        With fuzzy=True each query term also matches vocabulary terms whose
+        trigram similarity reaches SEARCH_FUZZY_THRESHOLD ("viscouse" ->
+        "viscose", "kaftan" -> "caftan"), scored down by that similarity.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        query = query or {}
+
+        with self._lock:
+            base = self._base
+            base_docs = len(base.docs) if base is not None else 0
+            base_length = base.total_length if base is not None else 0.0
+            doc_count = (base_docs - len(self._shadowed) + len(self._docs)) or 1
+            total_length = base_length - self._shadowed_length + self._total_length
+            avg_length = (total_length / doc_count) or 1.0
+
+            scores = None
+            for position, token in enumerate(tokens):
+                is_last = position == len(tokens) - 1
+                terms = dict.fromkeys(self._expand_prefix(token) if is_last else [token], 1.0)
+                terms[token] = 1.0
+                if fuzzy:
+                    for term, similarity in self._trigrams.similar(token, SEARCH_FUZZY_THRESHOLD).items():
+                        terms.setdefault(term, similarity)
+                term_scores = self._score_terms(terms, doc_count, avg_length)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: score + term_scores[pid]
+                              for pid, score in scores.items() if pid in term_scores}
+                if not scores:
+                    return []
+
+            results = []
+            for pid, score in scores.items():
+                meta = self._meta(pid)
+                if matches_query(meta, query):
+                    results.append((pid, score, meta))
+
+        return [pid for pid, _, _ in sort_results(results, sort_by)]
+
+
+def sort_results(results: list[tuple], sort_by: str | None) -> list[tuple]:
+    """
+    Order (id, score, meta) rows by relevance or by a listing sort, id as
+    tiebreaker (descending for name_desc / oldest, as in the listings).
+    """
+    results = sorted(results, key=lambda row: row[0], reverse=sort_by in ('name_desc', 'oldest'))
+    if sort_by in ('name', 'name_desc'):
+        return sorted(results, key=lambda row: row[2].get('name') or '', reverse=sort_by == 'name_desc')
+    if sort_by in ('newest', 'oldest'):
+        return sorted(results, key=lambda row: row[2].get('created_at') or '', reverse=sort_by == 'newest')
+    return sorted(results, key=lambda row: -row[1])
@@ -0,0 +1,284 @@
+"""
+Slug resolution for GET /api/products/slug/<main_category>/<slug>.
+
+The endpoint used to try five strategies in turn: seo_slug within the main
+category (by slug, then by name), seo_slug anywhere, a Python scan of every
+product in the category comparing slugs generated from names, and finally
+the product id. A bad URL paid for all five, including the scan.
+
+Instead every product stores the keys it can be found by in a multikey
+`slug_keys` field, written by create_product / update_product (and by
+backfill_slug_keys.py for older documents):
+
+  seo:<main>/<seo_slug>     main = main_category_slug and lowercased main_category_name
+  seo:*/<seo_slug>          seo_slug in any category
+  name:<main>/<slug>        slug generated from the name, or the normalized seo_slug
+  id:<id>
+
+A request expands to the same keys in the order the old cascade tried
+them, is resolved with one indexed `$in` query, and the product matching
+the highest-priority key wins.
+
+Keys a product loses when its name or seo_slug changes are kept in the
+`slug_history` collection, together with the product's current canonical
+URL, and served from an in-memory map as 301 redirects (SlugHistory).
+The map is loaded once at boot and caught up from the entries' updated_at
+stamps; entries that stop redirecting are marked released rather than
+deleted, so the catch-up sees them, and expire after
+SLUG_HISTORY_RELEASED_TTL_SECONDS (a TTL index, see db_indexes.py).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import PyMongoError
+
+from product_tombstones import catch_up_from
+
+logger = logging.getLogger(__name__)
+
+SLUG_KEYS_FIELD = 'slug_keys'
+
+SLUG_HISTORY_RELEASED_TTL_SECONDS = int(os.getenv('SLUG_HISTORY_RELEASED_TTL_SECONDS', 7 * 24 * 3600))
+
+
+def sanitize_slug(value) -> str:
+    """Lowercase, hyphenated, [a-z0-9-] only, at most 80 characters."""
+    if not value:
+        return ''
+    slug = str(value).lower().strip().replace(' ', '-').replace('_', '-')
+    slug = re.sub(r'[^a-z0-9-]', '', slug)
+    slug = re.sub(r'-+', '-', slug).strip('-')
+    return slug[:80]
+
+
+def name_slug(name) -> str:
+    """Slug generated from a product name (legacy products without seo_slug)."""
+    slug = str(name or '').lower().strip().replace(' ', '-')
+    slug = re.sub(r'[^a-z0-9-]', '', slug)
+    return re.sub(r'-+', '-', slug).strip('-')
+
+
+def _main_keys(product: dict) -> list[str]:
+    mains = []
+    for value in (product.get('main_category_slug'), (product.get('main_category_name') or '').lower()):
+        if value and value not in mains:
+            mains.append(value)
+    return mains
+
+
+def slug_keys(product: dict) -> list[str]:
+    """Every key a product can be resolved by."""
+    keys = []
+    seo_slug = product.get('seo_slug')
+    if seo_slug:
+        keys += [f'seo:{main}/{seo_slug}' for main in _main_keys(product)]
+        keys.append(f'seo:*/{seo_slug}')
+
+    main_slug = product.get('main_category_slug')
+    if main_slug:
+        for derived in (name_slug(product.get('name')), sanitize_slug(seo_slug)):
+            if derived:
+                keys.append(f'name:{main_slug}/{derived}')
+
+    if product.get('id'):
+        keys.append(f'id:{product["id"]}')
+    return list(dict.fromkeys(keys))
+
+
+def candidate_keys(main_category: str, slug: str) -> list[str]:
+    """Keys to look up for a request, highest priority first."""
+    normalized = sanitize_slug(slug) or slug
+    slugs = list(dict.fromkeys([slug, normalized, f'{normalized}-']))
+    mains = list(dict.fromkeys([main_category, main_category.lower()]))
+    keys = [f'seo:{main}/{candidate}' for main in mains for candidate in slugs]
+    keys += [f'seo:*/{candidate}' for candidate in slugs]
+    keys.append(f'name:{main_category}/{normalized}')
+    keys.append(f'id:{slug}')
+    return list(dict.fromkeys(keys))
+
+
+def best_match(products, keys: list[str]) -> dict | None:
+    """The product whose slug_keys contain the earliest of `keys`."""
+    priority = {key: position for position, key in enumerate(keys)}
+    best, best_rank = None, len(keys)
+    for product in products:
+        rank = min((priority[key] for key in product.get(SLUG_KEYS_FIELD) or () if key in priority),
+                   default=len(keys))
+        if rank < best_rank:
+            best, best_rank = product, rank
+    return best
+
+
+def resolve_slug(collection, main_category: str, slug: str) -> dict | None:
+    """Find the active product for a slug URL with a single indexed query."""
+    keys = candidate_keys(main_category, slug)
+    products = collection.find(
+        {SLUG_KEYS_FIELD: {'$in': keys}, 'is_active': True}, {'_id': 0})
+    return best_match(products, keys)
+
+
+class SlugHistory:
+    """
+    Old slug key -> current canonical (main_category_slug, seo_slug).
+
+    Backed by the slug_history collection and mirrored in memory: loaded
+    once (warm_start at boot), then caught up with an indexed updated_at
+    query when the catalog version moves or after a local write, so
+    resolving an old URL never touches the products collection. If a
+    catch-up fails the map it already has keeps serving. Callers consult it
+    only after resolve_slug() found no live product for the URL.
+    """
+
+    def __init__(self, collection, products=None):
+        self.collection = collection
+        self.products = products
+        self._lock = threading.Lock()
+        self._targets: dict[str, tuple[str, str, str]] = {}
+        self._version = None
+        self.loaded = False
+        self.last_updated_at = ''
+        self.redirects = 0
+
+    def _apply(self, entries):
+        for entry in entries:
+            if entry.get('released'):
+                self._targets.pop(entry['key'], None)
+            else:
+                self._targets[entry['key']] = (
+                    entry['product_id'], entry['main_category_slug'], entry['seo_slug'])
+            updated_at = entry.get('updated_at') or ''
+            if isinstance(updated_at, str) and updated_at > self.last_updated_at:
+                self.last_updated_at = updated_at
+
+    def load(self, version: int | None = None):
+        """Read every live entry (at boot)."""
+        entries = list(self.collection.find({'released': {'$ne': True}}, {'_id': 0}))
+        with self._lock:
+            self._targets = {}
+            self.last_updated_at = ''
+            self._apply(entries)
+            self._version = version
+            self.loaded = True
+        logger.info('Slug history loaded: %d retired keys', len(self._targets))
+
+    def sync(self, version: int | None = None):
+        """Apply entries written or released since the last one seen."""
+        entries = list(self.collection.find(
+            {'updated_at': {'$gte': catch_up_from(self.last_updated_at)}}, {'_id': 0}))
+        with self._lock:
+            self._apply(entries)
+            self._version = version
+
+    def warm_start(self):
+        """Load on a background thread so boot is not blocked."""
+        def run():
+            try:
+                self.load()
+            except PyMongoError as exc:
+                logger.error('Could not load slug history: %s', exc)
+
+        threading.Thread(target=run, name='slug-history-load', daemon=True).start()
+
+    def ensure_fresh(self, version: int) -> bool:
+        """Catch up if the version moved. False only when the map was never loaded."""
+        if self.loaded and self._version == version:
+            return True
+        try:
+            if self.loaded:
+                self.sync(version)
+            else:
+                self.load(version)
+        except PyMongoError as exc:
+            logger.error('Could not refresh slug history: %s', exc)
+        return self.loaded
+
+    def lookup(self, keys: list[str]) -> tuple[str, str, str] | None:
+        """(product_id, main_category_slug, seo_slug) for the first retired key, or None."""
+        targets = self._targets
+        for key in keys:
+            target = targets.get(key)
+            if target is not None:
+                self.redirects += 1
+                return target
+        return None
+
+    def _owners(self, keys: list[str]) -> dict[str, set[str]]:
+        """key -> ids of the products whose slug_keys contain it."""
+        owners: dict[str, set[str]] = {}
+        if not keys or self.products is None:
+            return owners
+        wanted = set(keys)
+        for product in self.products.find(
+                {SLUG_KEYS_FIELD: {'$in': keys}}, {'_id': 0, 'id': 1, SLUG_KEYS_FIELD: 1}):
+            for key in product.get(SLUG_KEYS_FIELD) or ():
+                if key in wanted:
+                    owners.setdefault(key, set()).add(product.get('id'))
+        return owners
+
+    def record(self, product: dict, old_keys: list[str], new_keys: list[str]):
+        """
+        After an update: remember the keys the product lost and point all of
+        its history at its current URL. Keys it (re)gained are released, and
+        keys another product still owns (e.g. a shared seo:*/<slug>) are
+        never retired.
+        """
+        self.record_many([(product, old_keys, new_keys)])
+
+    def record_many(self, changes: list[tuple[dict, list[str], list[str]]]):
+        """record() for a batch of (product, old_keys, new_keys), in one bulk write."""
+        retired_by_product = [
+            [key for key in old_keys if key not in new_keys and not key.startswith('id:')]
+            for _, old_keys, new_keys in changes
+        ]
+        owners = self._owners(list({key for retired in retired_by_product for key in retired}))
+        released = list({key for _, _, new_keys in changes for key in new_keys})
+        now = datetime.utcnow().isoformat()
+        operations = [self._release_operation({'key': {'$in': released}}, now)] if released else []
+        for (product, _, _), retired in zip(changes, retired_by_product):
+            main_slug = product.get('main_category_slug')
+            seo_slug = product.get('seo_slug')
+            if not (main_slug and seo_slug):
+                continue
+            target = {'product_id': product['id'], 'main_category_slug': main_slug, 'seo_slug': seo_slug}
+            operations += [
+                UpdateOne({'key': key},
+                          {'$set': {**target, 'key': key, 'retired_at': now, 'updated_at': now},
+                           '$unset': {'released': '', 'released_at': ''}},
+                          upsert=True)
+                for key in retired if not owners.get(key, set()) - {product['id']}
+            ]
+            operations.append(UpdateMany(
+                {'product_id': product['id'], 'released': {'$ne': True}},
+                {'$set': {**target, 'updated_at': now}}))
+        if operations:
+            self.collection.bulk_write(operations, ordered=True)
+        self._version = None  # catch up on next use
+
+    @staticmethod
+    def _release_operation(query: dict, now: str) -> UpdateMany:
+        # Marked, not deleted, so other workers' catch-up sees it; the TTL index removes it later
+        return UpdateMany({**query, 'released': {'$ne': True}},
+                          {'$set': {'released': True, 'released_at': datetime.utcnow(), 'updated_at': now}})
+
+    def release(self, keys: list[str]):
+        """A new or renamed product now owns these keys: stop redirecting them."""
+        if keys:
+            self.collection.bulk_write(
+                [self._release_operation({'key': {'$in': keys}}, datetime.utcnow().isoformat())])
+            self._version = None
+
+    def forget_product(self, product_id: str):
+        """The product is gone: its old URLs should 404, not redirect."""
+        self.collection.bulk_write(
+            [self._release_operation({'product_id': product_id}, datetime.utcnow().isoformat())])
+        self._version = None
+
+    def stats(self) -> dict:
+        return {'loaded': self.loaded, 'entries': len(self._targets), 'redirects': self.redirects}
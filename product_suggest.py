@@ -0,0 +1,174 @@
+"""
+Typeahead suggestions for the storefront search box.
+
+Holds every completion key (each word-start suffix of product names,
+individual seo_keywords, category names) in one sorted array, so a prefix
+query is a binary search plus a short scan. The structure is rebuilt in the
+background when marked dirty by a product/category write or when older
+than SUGGEST_REFRESH_SECONDS; requests keep using the previous copy while a
+rebuild runs.
+"""
+
+from __future__ import annotations
+
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_REFRESH_SECONDS = float(os.getenv('SUGGEST_REFRESH_SECONDS', 60))
+
+# Lower sorts first when ranking completions
+TYPE_PRIORITY = {'category': 0, 'product': 1, 'keyword': 2}
+
+# Upper bound on keys scanned per query, as a multiple of the requested limit
+SCAN_FACTOR = 25
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse everything else to single spaces."""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+class SuggestionIndex:
+    """Immutable sorted-array prefix index; build a new one to change it."""
+
+    def __init__(self, entries: list[dict]):
+        self.entries = entries
+        keyed = []
+        for position, entry in enumerate(entries):
+            words = normalize(entry['text']).split(' ')
+            if entry['type'] == 'keyword':
+                keyed.append((' '.join(words), position, 0))
+                continue
+            # Every word start, so "dress" completes "red silk dress"
+            for offset in range(len(words)):
+                keyed.append((' '.join(words[offset:]), position, offset))
+        keyed.sort()
+        self.keys = [key for key, _, _ in keyed]
+        self.targets = [(position, offset) for _, position, offset in keyed]
+
+    def lookup(self, prefix: str, limit: int = 8) -> list[dict]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        best: dict[int, tuple] = {}
+        start = bisect.bisect_left(self.keys, prefix)
+        for index in range(start, min(len(self.keys), start + limit * SCAN_FACTOR)):
+            if not self.keys[index].startswith(prefix):
+                break
+            position, offset = self.targets[index]
+            entry = self.entries[position]
+            rank = (TYPE_PRIORITY[entry['type']], offset > 0, len(entry['text']), entry['text'])
+            if position not in best or rank < best[position]:
+                best[position] = rank
+
+        ordered = sorted(best, key=best.get)
+        seen = set()
+        results = []
+        for position in ordered:
+            entry = self.entries[position]
+            dedupe_key = (entry['type'], entry['text'].lower(), entry.get('seo_slug'))
+            if dedupe_key in seen:
+                continue
+            seen.add(dedupe_key)
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+
+def build_entries(products_collection, categories_collection) -> list[dict]:
+    entries = []
+    categories = list(categories_collection.find(
+        {}, {'_id': 0, 'id': 1, 'name': 1, 'slug': 1, 'type': 1, 'main_category_slug': 1}))
+    for category in categories:
+        if not category.get('name'):
+            continue
+        is_main = category.get('type') == 'main'
+        entries.append({
+            'type': 'category',
+            'text': category['name'],
+            'id': category.get('id'),
+            'category_type': category.get('type'),
+            'seo_slug': category.get('slug'),
+            'main_category_slug': category.get('slug') if is_main else category.get('main_category_slug'),
+        })
+
+    projection = {'_id': 0, 'id': 1, 'name': 1, 'seo_keywords': 1, 'seo_slug': 1, 'main_category_slug': 1}
+    for product in products_collection.find({'is_active': True}, projection):
+        if not product.get('name'):
+            continue
+        link = {
+            'id': product.get('id'),
+            'seo_slug': product.get('seo_slug'),
+            'main_category_slug': product.get('main_category_slug'),
+        }
+        entries.append({'type': 'product', 'text': product['name'], **link})
+        keywords = product.get('seo_keywords') or ''
+        if isinstance(keywords, list):
+            keywords = ','.join(str(keyword) for keyword in keywords)
+        for keyword in keywords.split(','):
+            keyword = keyword.strip()
+            if len(keyword) >= 2:
+                entries.append({'type': 'keyword', 'text': keyword, **link})
+    return entries
+
+
+class ProductSuggester:
+    """Keeps a SuggestionIndex current for the product and category collections."""
+
+    def __init__(self, products_collection, categories_collection):
+        self.products_collection = products_collection
+        self.categories_collection = categories_collection
+        self._index: SuggestionIndex | None = None
+        self._built_at = 0.0
+        self._dirty = False
+        self._rebuilding = threading.Lock()
+
+    def mark_dirty(self):
+        """Called after product/category writes; the next request triggers a rebuild."""
+        self._dirty = True
+
+    def rebuild(self):
+        self._dirty = False
+        started = time.time()
+        index = SuggestionIndex(build_entries(self.products_collection, self.categories_collection))
+        self._index = index
+        self._built_at = started
+        logger.info('Suggestion index rebuilt: %d keys in %.1f ms',
+                    len(index.keys), (time.time() - started) * 1000)
+
+    def _rebuild_in_background(self):
+        if not self._rebuilding.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.rebuild()
+            except PyMongoError as exc:
+                logger.error('Suggestion index rebuild failed: %s', exc)
+            finally:
+                self._rebuilding.release()
+
+        threading.Thread(target=run, name='suggest-rebuild', daemon=True).start()
+
+    def suggest(self, prefix: str, limit: int = 8) -> list[dict]:
+        if self._index is None:
+            with self._rebuilding:
+                if self._index is None:
+                    self.rebuild()
+        elif self._dirty or time.time() - self._built_at > SUGGEST_REFRESH_SECONDS:
+            self._rebuild_in_background()
+        return self._index.lookup(prefix, limit)
@@ -0,0 +1,68 @@
+"""
+Tombstones for deleted products.
+
+The per-worker copies of the catalog (catalog_engine.py, product_search.py)
+catch up with other workers' writes by reading the products whose
+`updated_at` moved past the newest one they hold. A deleted product leaves
+nothing behind to read, so delete_product also records
+
+  product_tombstones  {id, deleted_at}
+
+and a catch-up reads the tombstones newer than the last one it applied with
+one indexed query, instead of scanning every product id in the collection.
+Tombstones expire after PRODUCT_TOMBSTONE_TTL_SECONDS (a TTL index, see
+db_indexes.py), far longer than the periodic full reloads that cover
+anything older.
+
+Writes can commit slightly out of timestamp order, so every catch-up reads
+CATCH_UP_OVERLAP_SECONDS further back than its last stamp; applying an
+update or a delete twice is harmless.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_TOMBSTONES_COLLECTION = 'product_tombstones'
+PRODUCT_TOMBSTONE_TTL_SECONDS = int(os.getenv('PRODUCT_TOMBSTONE_TTL_SECONDS', 7 * 24 * 3600))
+CATCH_UP_OVERLAP_SECONDS = float(os.getenv('CATCH_UP_OVERLAP_SECONDS', 5))
+
+
+def catch_up_from(stamp):
+    """`stamp` (an ISO string or a datetime) moved back by CATCH_UP_OVERLAP_SECONDS."""
+    if not stamp:
+        return stamp
+    try:
+        moment = datetime.fromisoformat(stamp) if isinstance(stamp, str) else stamp
+    except ValueError:
+        return stamp
+    moment -= timedelta(seconds=CATCH_UP_OVERLAP_SECONDS)
+    return moment.isoformat() if isinstance(stamp, str) else moment
+
+
+def record_deletion(collection, product_id: str):
+    """Leave a tombstone for a deleted product. Never raises: the periodic reloads still catch it."""
+    try:
+        collection.insert_one({'id': product_id, 'deleted_at': datetime.utcnow()})
+    except PyMongoError as exc:
+        logger.error('Could not record deletion of product %s: %s', product_id, exc)
+
+
+def deleted_since(collection, since: datetime | None) -> tuple[list[str], datetime | None]:
+    """
+    (ids deleted since `since`, newest deleted_at read). Pass the returned
+    stamp back in next time; None reads every tombstone still kept.
+    """
+    query = {'deleted_at': {'$gte': catch_up_from(since)}} if since else {}
+    ids, newest = [], since
+    for tombstone in collection.find(query, {'_id': 0, 'id': 1, 'deleted_at': 1}):
+        ids.append(tombstone['id'])
+        if newest is None or tombstone['deleted_at'] > newest:
+            newest = tombstone['deleted_at']
+    return ids, newest
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Repair drift in the per-category product counters (category_counters).
+
+create_product, update_product and delete_product keep the counters current
+with $inc (see category_counters.py). Counters can still drift: a failed
+increment, products edited directly in the database, or a data migration
+such as migrate_category_fields.py. This recomputes every counter from the
+products collection with one aggregation and reports (or fixes) the
+differences. Run it when the catalog is quiet; a write landing mid-run is
+picked up by running it again.
+
+Safe default is dry-run.
+
+Usage:
+  # Report drift
+  python reconcile_category_counters.py
+
+  # Overwrite drifted counters
+  python reconcile_category_counters.py --apply
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent
+for env_name in ('env.development', '.env', 'env.production'):
+    env_path = ROOT / env_name
+    if env_path.exists():
+        load_dotenv(env_path)
+        break
+else:
+    load_dotenv()
+
+from pymongo import MongoClient  # noqa: E402
+from pymongo.errors import PyMongoError  # noqa: E402
+
+from catalog_version import CatalogVersion  # noqa: E402
+from category_counters import mark_seeded, reconcile  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile per-category product counters')
+    parser.add_argument('--apply', action='store_true',
+                        help='Actually write. Without this flag, dry-run only.')
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI')
+    if not mongo_uri:
+        print('❌ MONGO_URI environment variable is required')
+        sys.exit(1)
+    db = MongoClient(mongo_uri)[os.getenv('DB_NAME', 'outre_couture')]
+    names = {category['id']: category.get('name', '')
+             for category in db['categories'].find({}, {'_id': 0, 'id': 1, 'name': 1})}
+
+    print(f"Mode: {'APPLY' if args.apply else 'DRY-RUN'}")
+    print()
+
+    try:
+        drift = reconcile(db['products'], db['category_counters'], apply=args.apply)
+    except PyMongoError as exc:
+        print(f'❌ Reconcile failed: {exc}')
+        sys.exit(1)
+
+    for entry in drift:
+        stored, expected = entry['stored'], entry['expected']
+        label = names.get(entry['category_id'], 'deleted category')
+        print(f"  {entry['category_id']} ({label}): "
+              f"active {stored['active']} -> {expected['active']}, total {stored['total']} -> {expected['total']}")
+
+    print()
+    if args.apply:
+        # The app then skips its own seeding run on first read
+        mark_seeded(db['catalog_meta'], len(drift))
+    if not drift:
+        print('✓ All category counters are correct')
+    elif args.apply:
+        print(f'✓ Repaired {len(drift)} counters')
+        # Running app workers reload their counters on the new version
+        version = CatalogVersion(db['catalog_meta']).bump()
+        print(f'✓ Catalog version bumped to {version}')
+    else:
+        print(f'✓ {len(drift)} counters drifted. Re-run with --apply to repair them.')
+
+
+if __name__ == '__main__':
+    main()
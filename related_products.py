@@ -0,0 +1,244 @@
+"""
+Precomputed "related products" for product detail pages.
+
+Each active product becomes a TF-IDF vector over its name, categories,
+description, keywords and specifications (tokens from product_search.py,
+so stemming matches search). Vectors are L2-normalized rows of one dense
+float32 NumPy matrix X, so cosine similarity is a matrix product; it is
+computed RELATED_BLOCK_SIZE rows at a time (X[block] @ X.T) to keep the
+score matrix small, and np.argpartition picks the top RELATED_TOP_K
+neighbours per row.
+
+Results go to the related_products collection, one document per product
+with ready-to-render neighbour summaries, so GET /api/products/<id>
+?include=related reads a single document:
+
+  {_id: product_id, related: [{id, name, seo_slug, main_category_slug, image, score}], updated_at}
+
+Incremental runs re-score only what can have changed since the last run
+(watermark: the newest updated_at seen, stored in catalog_meta):
+
+  * products changed since the watermark, or without a stored list, get
+    their full row recomputed;
+  * so do products whose stored list points at a changed, deleted or
+    deactivated product;
+  * every other product only merges in changed products that now beat
+    the weakest entry of its list.
+
+Unchanged scores are kept as stored, although IDF drifts a little as the
+catalog grows; run with full=True now and then to recompute everything.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+from datetime import datetime
+
+import numpy as np
+from pymongo import DeleteMany, ReplaceOne
+
+from product_search import tokenize
+
+logger = logging.getLogger(__name__)
+
+RELATED_COLLECTION = 'related_products'
+STATE_ID = 'related_products'
+
+RELATED_TOP_K = int(os.getenv('RELATED_TOP_K', 8))
+RELATED_BLOCK_SIZE = int(os.getenv('RELATED_BLOCK_SIZE', 256))
+RELATED_MAX_FEATURES = int(os.getenv('RELATED_MAX_FEATURES', 4096))
+RELATED_MIN_SCORE = float(os.getenv('RELATED_MIN_SCORE', 0.05))
+
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'category_name': 2.0,
+    'main_category_name': 1.0,
+    'seo_keywords': 1.0,
+    'description': 1.0,
+    'specifications': 1.0,
+}
+
+PROJECTION = {'_id': 0, 'id': 1, 'images': 1, 'seo_slug': 1, 'main_category_slug': 1, 'updated_at': 1,
+              **{field: 1 for field in FIELD_WEIGHTS}}
+
+WRITE_BATCH_SIZE = 500
+
+
+def term_counts(product: dict) -> dict[str, float]:
+    counts: dict[str, float] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in tokenize(product.get(field)):
+            counts[term] = counts.get(term, 0.0) + weight
+    return counts
+
+
+def tfidf_matrix(products: list[dict], max_features: int = RELATED_MAX_FEATURES) -> np.ndarray:
+    """L2-normalized TF-IDF rows (float32), one per product."""
+    documents = [term_counts(product) for product in products]
+    document_frequency: dict[str, int] = {}
+    for counts in documents:
+        for term in counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    # A term in a single product cannot make two products similar
+    vocabulary = sorted((term for term, df in document_frequency.items() if df > 1),
+                        key=lambda term: (-document_frequency[term], term))[:max_features]
+    column = {term: position for position, term in enumerate(vocabulary)}
+
+    n = len(products)
+    matrix = np.zeros((n, max(len(vocabulary), 1)), dtype=np.float32)
+    idf = {term: math.log((1 + n) / (1 + document_frequency[term])) + 1 for term in vocabulary}
+    for row, counts in enumerate(documents):
+        for term, count in counts.items():
+            position = column.get(term)
+            if position is not None:
+                matrix[row, position] = (1 + math.log(count)) * idf[term]
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def top_neighbours(matrix: np.ndarray, rows: np.ndarray, k: int = RELATED_TOP_K,
+                   block_size: int = RELATED_BLOCK_SIZE,
+                   min_score: float = RELATED_MIN_SCORE) -> dict[int, list[tuple[int, float]]]:
+    """{row: [(neighbour row, cosine), ...]} best first, for the given rows."""
+    result = {}
+    n = matrix.shape[0]
+    k = min(k, n - 1)
+    if k <= 0:
+        return {int(row): [] for row in rows}
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        scores = matrix[block] @ matrix.T
+        scores[np.arange(len(block)), block] = -1.0  # never related to itself
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+        for position, row in enumerate(block):
+            result[int(row)] = [
+                (int(column), float(score))
+                for column, score in zip(candidates[position], candidate_scores[position])
+                if score >= min_score
+            ]
+    return result
+
+
+def summary(product: dict, score: float) -> dict:
+    images = product.get('images') or []
+    return {
+        'id': product['id'],
+        'name': product.get('name'),
+        'seo_slug': product.get('seo_slug'),
+        'main_category_slug': product.get('main_category_slug'),
+        'image': images[0] if images else None,
+        'score': round(score, 4),
+    }
+
+
+class RelatedProductsJob:
+    """Builds and incrementally refreshes the related_products collection."""
+
+    def __init__(self, db, k: int = RELATED_TOP_K, block_size: int = RELATED_BLOCK_SIZE,
+                 min_score: float = RELATED_MIN_SCORE):
+        self.products = db['products']
+        self.related = db[RELATED_COLLECTION]
+        self.state = db['catalog_meta']
+        self.k = k
+        self.block_size = block_size
+        self.min_score = min_score
+
+    def run(self, full: bool = False, apply: bool = True) -> dict:
+        """Re-score what changed since the last run (everything when full). Returns counters."""
+        products = [p for p in self.products.find({'is_active': True}, PROJECTION) if p.get('id')]
+        state = {} if full else (self.state.find_one({'_id': STATE_ID}) or {})
+        watermark = state.get('last_updated_at') or ''
+        stored = {} if full else {
+            doc['_id']: doc.get('related') or [] for doc in self.related.find({}, {'related': 1})
+        }
+
+        index = {product['id']: row for row, product in enumerate(products)}
+        changed = {
+            product['id'] for product in products
+            if full or product['id'] not in stored or str(product.get('updated_at') or '') > watermark
+        }
+        removed = [product_id for product_id in stored if product_id not in index]
+        affected = set(changed)
+        stale_targets = changed | set(removed)
+        for product_id, neighbours in stored.items():
+            if product_id in index and any(entry['id'] in stale_targets for entry in neighbours):
+                affected.add(product_id)
+
+        started = datetime.utcnow()
+        matrix = tfidf_matrix(products) if products else np.zeros((0, 1), dtype=np.float32)
+        documents = {}
+
+        affected_rows = np.array(sorted(index[product_id] for product_id in affected), dtype=np.int64)
+        for row, neighbours in top_neighbours(matrix, affected_rows, self.k, self.block_size,
+                                              self.min_score).items():
+            documents[products[row]['id']] = [summary(products[column], score) for column, score in neighbours]
+
+        merged = self._merge_changed(products, matrix, index, changed, affected, stored)
+        documents.update(merged)
+
+        stats = {
+            'products': len(products),
+            'changed': len(changed),
+            'rescored': len(affected),
+            'merged': len(merged),
+            'removed': len(removed),
+            'seconds': round((datetime.utcnow() - started).total_seconds(), 2),
+        }
+        if apply:
+            self._write(documents, removed)
+            newest = max((str(product.get('updated_at') or '') for product in products), default=watermark)
+            self.state.update_one(
+                {'_id': STATE_ID},
+                {'$set': {'last_updated_at': max(newest, watermark), 'last_run_at': started.isoformat(),
+                          'last_run': stats}},
+                upsert=True)
+        return {**stats, 'documents': documents}
+
+    def _merge_changed(self, products, matrix, index, changed, affected, stored) -> dict[str, list[dict]]:
+        """For untouched lists, merge in changed products that now rank in the top K."""
+        untouched = [product_id for product_id in stored if product_id in index and product_id not in affected]
+        if not untouched or not changed:
+            return {}
+        columns = np.array([index[product_id] for product_id in untouched], dtype=np.int64)
+        # Score a changed product must beat to enter each list
+        thresholds = np.array([
+            stored[product_id][-1]['score'] if len(stored[product_id]) >= self.k else self.min_score
+            for product_id in untouched
+        ], dtype=np.float32)
+
+        additions: dict[str, list[dict]] = {}
+        changed_rows = np.array(sorted(index[product_id] for product_id in changed), dtype=np.int64)
+        for start in range(0, len(changed_rows), self.block_size):
+            block = changed_rows[start:start + self.block_size]
+            scores = matrix[block] @ matrix[columns].T
+            hits = np.nonzero(scores > thresholds[np.newaxis, :])
+            for position, column in zip(*hits):
+                product_id = untouched[column]
+                additions.setdefault(product_id, []).append(
+                    summary(products[block[position]], float(scores[position, column])))
+
+        merged = {}
+        for product_id, extra in additions.items():
+            entries = sorted(stored[product_id] + extra, key=lambda entry: -entry['score'])
+            merged[product_id] = entries[:self.k]
+        return merged
+
+    def _write(self, documents: dict[str, list[dict]], removed: list[str]):
+        now = datetime.utcnow().isoformat()
+        operations = [
+            ReplaceOne({'_id': product_id}, {'related': related, 'updated_at': now}, upsert=True)
+            for product_id, related in documents.items()
+        ]
+        if removed:
+            operations.append(DeleteMany({'_id': {'$in': removed}}))
+        for start in range(0, len(operations), WRITE_BATCH_SIZE):
+            self.related.bulk_write(operations[start:start + WRITE_BATCH_SIZE], ordered=False)
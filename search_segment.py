@@ -0,0 +1,163 @@
+"""
+On-disk format for the product search index.
+
+A segment is a single read-only file that gunicorn workers memory-map, so
+the postings live once in the page cache instead of once per worker:
+
+  header   magic, format version, counts, section offsets
+  meta     JSON: fingerprint, last_updated_at, total_length, per-doc fields
+  lengths  float32[n_docs]          weighted token count per doc
+  term_off uint32[n_terms + 1]      offsets into the term blob
+  terms    utf-8 bytes, sorted      term dictionary
+  post_off uint32[n_terms + 1]      offsets into the posting arrays
+  docs     uint32[n_postings]       doc ordinals, grouped by term
+  weights  float32[n_postings]      field-weighted term frequency
+
+Segments are written to a temp file and published with os.replace, so a
+reader either sees the old file or the complete new one.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+MAGIC = b'OCSI'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sIIII' + 'Q' * 7)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_segment(path: str, docs: list[dict], lengths: list[float],
+                  postings: dict[str, dict[str, float]], info: dict):
+    """
+    Serialize an index to `path` atomically.
+    `docs` is ordered by ordinal; postings map term -> {doc id: weight}.
+    `info` (fingerprint, last_updated_at, ...) is stored in the meta section.
+    """
+    ordinal = {doc['id']: position for position, doc in enumerate(docs)}
+    terms = sorted(postings)
+
+    term_offsets = array('I', [0])
+    term_blob = bytearray()
+    posting_offsets = array('I', [0])
+    doc_ordinals = array('I')
+    weights = array('f')
+    for term in terms:
+        term_blob += term.encode('utf-8')
+        term_offsets.append(len(term_blob))
+        for doc_id, weight in sorted(postings[term].items(), key=lambda item: ordinal[item[0]]):
+            doc_ordinals.append(ordinal[doc_id])
+            weights.append(weight)
+        posting_offsets.append(len(doc_ordinals))
+
+    meta = json.dumps({**info, 'docs': docs}, separators=(',', ':'), default=str).encode('utf-8')
+    sections = [meta, array('f', lengths).tobytes(), term_offsets.tobytes(), bytes(term_blob),
+                posting_offsets.tobytes(), doc_ordinals.tobytes(), weights.tobytes()]
+
+    offsets = []
+    position = _aligned(HEADER.size)
+    for section in sections:
+        offsets.append(position)
+        position = _aligned(position + len(section))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.segment-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(docs), len(terms), len(meta), *offsets))
+            for offset, section in zip(offsets, sections):
+                handle.seek(offset)
+                handle.write(section)
+            handle.truncate(position)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class MappedSegment:
+    """Read-only view over a segment file. Never copies postings into Python lists."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as handle:
+            stat = os.fstat(handle.fileno())
+            self._mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        (magic, version, n_docs, n_terms, meta_length,
+         meta_off, lengths_off, term_off_off, terms_off,
+         post_off_off, docs_off, weights_off) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'Not a search segment (format {version}): {path}')
+
+        view = memoryview(self._mm)
+        meta = json.loads(bytes(view[meta_off:meta_off + meta_length]))
+        self.docs: list[dict] = meta.pop('docs')
+        self.info: dict = meta
+        self.doc_ids = [doc['id'] for doc in self.docs]
+        self.ordinals = {doc_id: position for position, doc_id in enumerate(self.doc_ids)}
+        self.n_terms = n_terms
+
+        self.lengths = view[lengths_off:lengths_off + 4 * n_docs].cast('f')
+        self._term_offsets = view[term_off_off:term_off_off + 4 * (n_terms + 1)].cast('I')
+        self._terms = view[terms_off:terms_off + (self._term_offsets[-1] if n_terms else 0)]
+        self._posting_offsets = view[post_off_off:post_off_off + 4 * (n_terms + 1)].cast('I')
+        n_postings = self._posting_offsets[-1] if n_terms else 0
+        self._doc_ordinals = view[docs_off:docs_off + 4 * n_postings].cast('I')
+        self._weights = view[weights_off:weights_off + 4 * n_postings].cast('f')
+
+    @property
+    def total_length(self) -> float:
+        return float(self.info.get('total_length', 0.0))
+
+    def term(self, position: int) -> bytes:
+        return bytes(self._terms[self._term_offsets[position]:self._term_offsets[position + 1]])
+
+    def _lower_bound(self, key: bytes) -> int:
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def postings(self, term: str):
+        """Return (doc ordinals, weights) memoryviews for a term, or None."""
+        key = term.encode('utf-8')
+        position = self._lower_bound(key)
+        if position >= self.n_terms or self.term(position) != key:
+            return None
+        start = self._posting_offsets[position]
+        end = self._posting_offsets[position + 1]
+        return self._doc_ordinals[start:end], self._weights[start:end]
+
+    def iter_terms(self):
+        for position in range(self.n_terms):
+            yield self.term(position).decode('utf-8')
+
+    def terms_with_prefix(self, prefix: str) -> list[str]:
+        key = prefix.encode('utf-8')
+        terms = []
+        position = self._lower_bound(key)
+        while position < self.n_terms:
+            term = self.term(position)
+            if not term.startswith(key):
+                break
+            terms.append(term.decode('utf-8'))
+            position += 1
+        return terms